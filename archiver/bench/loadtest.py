@@ -0,0 +1,373 @@
+"""End-to-end load test of the consumer against local stand-ins.
+
+The real Consumer, DownloadHandler, persistence driver and queue code run
+unchanged; only the services behind them are replaced:
+
+* SQS by a LocalQueue and DynamoDB by a SqlPersistence, both in a
+  temporary directory
+* S3 by an in-memory store
+* Reddit and gfycat by fakes serving synthetic posts
+* the Imgur API and image hosts by requests_mock, serving generated JPEGs
+
+Every stand-in can be given a latency and an error rate, and every call
+to it is timed as a stage of the report.
+"""
+import collections
+import contextlib
+import io
+import logging
+import os
+import random
+import re
+import resource
+import shutil
+import tempfile
+import time
+
+from PIL import Image as PILImage
+
+try:
+    import requests_mock
+except ImportError:
+    requests_mock = None
+
+from archiver import clients
+from archiver import config
+from archiver import constants
+from archiver import consumer
+from archiver import image_handling
+from archiver import messages
+from archiver import models
+from archiver.persistence import sql
+from archiver.queues import local
+
+LOG = logging.getLogger(__name__)
+
+QUEUE_NAME = 'loadtest'
+SUBREDDIT_NAME = 'loadtest'
+IMGUR_API = re.compile(r'^https://api\.imgur\.com/3/(image|album)/(\w+)')
+IMAGE_HOSTS = re.compile(r'^https?://(i\.imgur\.com|giant\.gfycat\.com|'
+                         r'thumbs\.gfycat\.com|images\.example\.com)/')
+ALBUM_SIZE = 3
+
+CONFIG_TEMPLATE = """
+[sqs]
+queue_name = {queue}
+
+[queue]
+driver = archiver.queues.local:LocalQueue
+local_database = {tmp}/queue.db
+visibility_timeout = {visibility}
+
+[s3]
+image_bucket = loadtest-images
+thumb_bucket = loadtest-thumbs
+thumbnail_size = 300
+
+[auth]
+access_key_id = loadtest
+access_key_secret = loadtest
+region = us-east-1
+
+[imgur]
+client_id = loadtest
+mashape_key =
+
+[reddit]
+agent_name = tweench load test
+
+[persistence]
+driver = archiver.persistence.sql:SqlPersistence
+sql_database = {tmp}/archive.db
+
+[consumer]
+embed_post_data = {embed}
+batch_posts = {batch}
+"""
+
+
+class InjectedError(Exception):
+    """Raised by a stand-in to simulate a failing service."""
+
+
+class Recorder(object):
+    def __init__(self):
+        self.timings = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[stage].append(time.time() - start)
+
+    def timed(self, stage, func):
+        def call(*args, **kwargs):
+            with self.time(stage):
+                return func(*args, **kwargs)
+        return call
+
+    def percentile(self, stage, percent):
+        values = sorted(self.timings[stage])
+        if not values:
+            return None
+        return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+class Service(object):
+    """Latency and error settings of one stand-in service."""
+
+    def __init__(self, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def call(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return not (self.error_rate and random.random() < self.error_rate)
+
+
+class Standin(object):
+    """Proxy that delays, fails and times every method call."""
+
+    def __init__(self, target, stage, recorder, service):
+        self._target = target
+        self._stage = stage
+        self._recorder = recorder
+        self._service = service
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._recorder.time(self._stage):
+                if not self._service.call():
+                    raise InjectedError(self._stage + '.' + name)
+                return attr(*args, **kwargs)
+        return call
+
+
+class FakeS3(object):
+    def __init__(self):
+        self.objects = {}
+
+    def upload(self, bucket, path, data, extra_args):
+        self.objects[(bucket, path)] = len(data.read())
+
+    def object_exists(self, bucket, path):
+        return (bucket, path) in self.objects
+
+    def download(self, bucket, path):
+        return None
+
+
+class FakeReddit(object):
+    def __init__(self, posts):
+        self.posts = {post.id: post for post in posts}
+
+    def info(self, fullnames):
+        return [self.posts[name[3:]] for name in fullnames
+                if name[3:] in self.posts]
+
+    def submission(self, url):
+        return self.posts[re.search(constants.REDDIT_POST_ID, url).group(1)]
+
+
+class FakeGfycat(object):
+    def query_gfy(self, gfy_id):
+        return {'gfyItem': {
+            'webmUrl': 'https://giant.gfycat.com/{}.webm'.format(gfy_id),
+            'max2mbGif': 'https://thumbs.gfycat.com/{}.gif'.format(gfy_id),
+            'height': 480,
+            'width': 640
+        }}
+
+
+def make_image(width=640, height=480, seed=0, fmt='JPEG'):
+    rng = random.Random(seed)
+    image = PILImage.new('RGB', (width, height))
+    # A few colored blocks give the color analysis something to find
+    for _ in range(8):
+        x, y = rng.randrange(width), rng.randrange(height)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        image.paste(color, (x, y, min(width, x + width // 3),
+                            min(height, y + height // 3)))
+    data = io.BytesIO()
+    image.save(data, fmt)
+    return data.getvalue()
+
+
+def synthetic_posts(num):
+    """Posts cycling through every kind of link the downloader handles."""
+    urls = [
+        'https://i.imgur.com/{id}.jpg',
+        'https://imgur.com/a/{id}',
+        'https://www.gfycat.com/{id}',
+        'https://images.example.com/{id}.jpg',
+    ]
+    posts = []
+    for i in range(num):
+        post_id = '{:06x}'.format(i)
+        posts.append(models.Post(
+            id=post_id,
+            title=u'Load test post {}'.format(i),
+            permalink=u'/r/{}/comments/{}/post/'.format(SUBREDDIT_NAME,
+                                                      post_id),
+            url=urls[i % len(urls)].format(id=post_id),
+            author=u'user{}'.format(i % 100),
+            created_utc=1500000000 + i,
+            over_18=False,
+            subreddit=SUBREDDIT_NAME
+        ))
+    return posts
+
+
+def _mock_http(mocker, recorder, service, image):
+    def respond(stage, handler):
+        def callback(request, context):
+            with recorder.time(stage):
+                if not service.call():
+                    context.status_code = 503
+                    return b''
+                return handler(request, context)
+        return callback
+
+    def imgur_api(request, context):
+        kind, item_id = IMGUR_API.match(request.url).groups()
+        context.headers['content-type'] = 'application/json'
+        if kind == 'image':
+            return {'data': {
+                'link': 'https://i.imgur.com/{}.jpg'.format(item_id)}}
+        return {'data': {'images': [
+            {'link': 'https://i.imgur.com/{}{}.jpg'.format(item_id, i)}
+            for i in range(ALBUM_SIZE)]}}
+
+    def image_host(request, context):
+        context.headers['content-type'] = 'image/jpeg'
+        return image
+
+    mocker.get(IMGUR_API, json=respond('imgur', imgur_api))
+    mocker.get(IMAGE_HOSTS, content=respond('image_hosts', image_host))
+
+
+def install_config(tmp, embed=False, batch=False, visibility_timeout=5):
+    """Use a config pointing every local driver at files in tmp."""
+    path = os.path.join(tmp, 'loadtest.cfg')
+    with open(path, 'w') as f:
+        f.write(CONFIG_TEMPLATE.format(
+            queue=QUEUE_NAME, tmp=tmp, visibility=visibility_timeout,
+            embed=str(embed).lower(), batch=str(batch).lower()))
+    config.set_config(config.Config(path))
+
+
+def run(posts=1000, batch_size=consumer.SQS_MAX_MESSAGES, embed=False,
+        batch=False, services=None, visibility_timeout=5, max_seconds=600):
+    """Push posts synthetic posts through a Consumer, return a report.
+
+    services maps the stand-in names (queue, reddit, persistence, s3,
+    gfycat, http) to their Service settings.
+    """
+    if requests_mock is None:
+        raise RuntimeError("The load test requires requests_mock.")
+    services = collections.defaultdict(Service, services or {})
+    recorder = Recorder()
+    tmp = tempfile.mkdtemp(prefix='tweench-loadtest-')
+    try:
+        install_config(tmp, embed, batch, visibility_timeout)
+        return _run(posts, batch_size, services, recorder, tmp,
+                    max_seconds)
+    finally:
+        clients._CLIENTS.update({'sqs': {}, 'queue': {}, 's3': None,
+                                 'persistence': None})
+        shutil.rmtree(tmp)
+
+
+def _run(num_posts, batch_size, services, recorder, tmp, max_seconds):
+    conf = config.get_config()
+    queue = local.LocalQueue(QUEUE_NAME)
+    clients._CLIENTS['queue'][QUEUE_NAME] = Standin(
+        queue, 'queue', recorder, services['queue'])
+    clients._CLIENTS['s3'] = Standin(
+        FakeS3(), 's3', recorder, services['s3'])
+    db = sql.SqlPersistence()
+    clients._CLIENTS['persistence'] = Standin(
+        db, 'persistence', recorder, services['persistence'])
+
+    posts = synthetic_posts(num_posts)
+    reddit = Standin(FakeReddit(posts), 'reddit', recorder,
+                     services['reddit'])
+    downloader = image_handling.DownloadHandler(gfycat_client=Standin(
+        FakeGfycat(), 'gfycat', recorder, services['gfycat']))
+    downloader.store_images = recorder.timed('images',
+                                             downloader.store_images)
+    worker = consumer.Consumer(reddit=reddit, downloader=downloader)
+    worker._archive_post = recorder.timed('archive_post',
+                                          worker._archive_post)
+
+    post_messages = []
+    for post in posts:
+        data = None
+        if conf.CONSUMER_EMBED_POST_DATA:
+            data = post.to_dict()
+            data['fetched_utc'] = int(time.time())
+        post_messages.append(messages.PostMessage(post.permalink, data))
+    if conf.CONSUMER_BATCH_POSTS:
+        post_messages = messages.pack_posts(
+            post_messages, max_posts=conf.CONSUMER_BATCH_MAX_POSTS)
+    for m in post_messages:
+        queue.send_message(str(m))
+
+    errors = collections.Counter()
+    with requests_mock.Mocker() as mocker:
+        _mock_http(mocker, recorder, services['http'], make_image())
+        start = time.time()
+        while queue.pending() and time.time() - start < max_seconds:
+            try:
+                with recorder.time('batch'):
+                    worker.run_batch(max_messages=batch_size)
+            except Exception as e:
+                # Unacknowledged messages come back after the visibility
+                # timeout, as they would on SQS
+                errors[type(e).__name__] += 1
+        worker.persistence.flush()
+        elapsed = time.time() - start
+
+    archived = sum(1 for post in posts if db.has_post(post.id))
+    return {
+        'posts': num_posts,
+        'archived': archived,
+        'unfinished_messages': queue.pending(),
+        'seconds': elapsed,
+        'posts_per_sec': archived / elapsed if elapsed else 0.0,
+        'errors': dict(errors),
+        'stages': {stage: {'count': len(recorder.timings[stage]),
+                           'p50': recorder.percentile(stage, 50),
+                           'p99': recorder.percentile(stage, 99)}
+                   for stage in sorted(recorder.timings)},
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    }
+
+
+def format_report(report):
+    lines = [
+        u"Archived {archived}/{posts} posts in {seconds:.1f}s "
+        u"({posts_per_sec:.1f} posts/sec), {unfinished_messages} messages "
+        u"left".format(**report),
+        u"Peak RSS: {:.1f} MB".format(report['peak_rss_mb']),
+    ]
+    if report['errors']:
+        lines.append(u"Errors: " + u", ".join(
+            u"{} x{}".format(name, count)
+            for name, count in sorted(report['errors'].items())))
+    lines.append(u"{:<14}{:>8}{:>12}{:>12}".format(
+        u"stage", u"calls", u"p50 ms", u"p99 ms"))
+    for stage, stats in sorted(report['stages'].items()):
+        lines.append(u"{:<14}{:>8}{:>12.2f}{:>12.2f}".format(
+            stage, stats['count'], stats['p50'] * 1000,
+            stats['p99'] * 1000))
+    return u"\n".join(lines)
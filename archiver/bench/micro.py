@@ -0,0 +1,265 @@
+"""Micro-benchmarks of the CPU-heavy image processing stages.
+
+Every stage runs over a fixed corpus of generated images, so results are
+comparable between runs on the same machine:
+
+* decode: Image.__init__ plus decoding the pixel data
+* thumbnail: Image._thumbnail at the configured thumbnail size
+* colors: Image.get_colors
+* classify: DownloadHandler._resolve over a fixed set of post URLs
+
+Each result is the best CPU time per call over several repeats, which is
+the least noisy estimate of what the code costs. Results can be saved as a
+baseline and later runs checked against it. Every run also times a fixed
+pure Python loop, and results are scaled by how much faster or slower that
+loop ran than in the baseline, so a busier or throttled machine doesn't
+look like a regression.
+"""
+import collections
+import json
+import logging
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import PIL
+
+from archiver import clients
+from archiver import config
+from archiver import image_handling
+from archiver.bench import loadtest
+
+LOG = logging.getLogger(__name__)
+
+STAGE_DECODE = 'decode'
+STAGE_THUMBNAIL = 'thumbnail'
+STAGE_COLORS = 'colors'
+STAGE_CLASSIFY = 'classify'
+# Not a stage of its own, the speed of the machine during the run
+CALIBRATION = 'calibration'
+IMAGE_STAGES = [STAGE_DECODE, STAGE_THUMBNAIL, STAGE_COLORS]
+STAGES = IMAGE_STAGES + [STAGE_CLASSIFY]
+
+FORMATS = ['JPEG', 'PNG', 'GIF']
+SIZES = collections.OrderedDict([
+    ('small', (320, 240)),
+    ('medium', (1280, 960)),
+    ('large', (2560, 1920)),
+    ('huge', (5120, 3840)),
+])
+
+CLASSIFY_URLS = [
+    'https://imgur.com/a/AbCdE',
+    'https://imgur.com/gallery/AbCdE',
+    'https://imgur.com/AbCdE,FgHiJ,KlMnO',
+    'https://imgur.com/AbCdE',
+    'https://i.imgur.com/AbCdE.jpg',
+    'https://gfycat.com/SomeLongGfyName',
+    'https://i.redd.it/abcdefghijkl.jpg',
+    'https://v.redd.it/abcdefghijkl',
+    'https://www.reddit.com/gallery/abc123',
+    'https://images.example.com/photos/1234.png',
+    'https://www.example.com/article.html',
+]
+
+# Keep calling until one repeat takes at least this long...
+MIN_REPEAT_TIME = 0.1
+# ...and stop repeating once a measurement has taken this long in total,
+# but only after MIN_REPEAT repeats: the best of one or two is still noisy
+MAX_MEASURE_TIME = 5.0
+MIN_REPEAT = 3
+DEFAULT_REPEAT = 10
+DEFAULT_TOLERANCE = 0.2
+CALIBRATION_LOOP = 100000
+
+# Time spent running other processes isn't counted against the benchmark.
+# time.clock is the process' CPU time everywhere but on Windows.
+if hasattr(time, 'process_time'):
+    cpu_time = time.process_time
+elif sys.platform != 'win32':
+    cpu_time = time.clock
+else:
+    cpu_time = timeit.default_timer
+
+
+def _timed(func, number=1):
+    start = cpu_time()
+    for _ in range(number):
+        func()
+    return cpu_time() - start
+
+
+def measure(func, repeat=DEFAULT_REPEAT, min_time=MIN_REPEAT_TIME,
+            max_time=MAX_MEASURE_TIME, reference=None):
+    """Return the best seconds per call of func over repeat runs.
+
+    Fast functions are called in a loop long enough to time reliably, slow
+    ones are repeated fewer times so huge images don't take minutes.
+
+    Given the reference seconds of the calibration loop, every repeat is
+    scaled by how long the loop takes around it, so the machine slowing
+    down in the middle of a measurement doesn't count.
+    """
+    number = 1
+    while True:
+        elapsed = _timed(func, number)
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed * 10 < min_time else 2
+    best = None
+    spent = 0
+    for done in range(repeat):
+        if done and spent >= max_time and done >= MIN_REPEAT:
+            break
+        before = _timed(calibrate) if reference else None
+        elapsed = _timed(func, number)
+        spent += elapsed
+        if reference:
+            # The faster of the two, the loop is short enough to catch a
+            # quiet moment where the repeat didn't
+            elapsed *= reference / min(before, _timed(calibrate))
+        best = elapsed / number if best is None else min(
+            best, elapsed / number)
+    return best
+
+
+def result_name(stage, fmt=None, size=None):
+    return '/'.join(part for part in (stage, fmt, size) if part)
+
+
+def corpus(formats=FORMATS, sizes=None):
+    """Yield (format, size name, image data) for every corpus image."""
+    for size in sizes or SIZES:
+        width, height = SIZES[size]
+        for fmt in formats:
+            yield fmt, size, loadtest.make_image(width, height, seed=0,
+                                                 fmt=fmt)
+
+
+def _image_stages(data, thumbnail_size):
+    def decode():
+        image_handling.Image(path='bench', data=data).pi.load()
+
+    image = image_handling.Image(path='bench', data=data)
+    image.pi.load()
+    return {
+        STAGE_DECODE: decode,
+        STAGE_THUMBNAIL: lambda: image._thumbnail(thumbnail_size),
+        STAGE_COLORS: image.get_colors,
+    }
+
+
+def calibrate():
+    """A fixed amount of pure Python work to gauge the machine by."""
+    total = 0
+    for i in range(CALIBRATION_LOOP):
+        total += i % 7
+    return total
+
+
+def _classify(downloader):
+    def classify():
+        for url in CLASSIFY_URLS:
+            downloader._resolve(url)
+    return classify
+
+
+def run(stages=STAGES, formats=FORMATS, sizes=None,
+        repeat=DEFAULT_REPEAT):
+    """Run the benchmarks, return a dict of result name to seconds."""
+    tmp = tempfile.mkdtemp(prefix='tweench-bench-')
+    try:
+        loadtest.install_config(tmp)
+        clients._CLIENTS['s3'] = loadtest.FakeS3()
+        return _run(stages, formats, sizes, repeat)
+    finally:
+        clients._CLIENTS.update({'s3': None, 'persistence': None})
+        shutil.rmtree(tmp)
+
+
+def _run(stages, formats, sizes, repeat):
+    conf = config.get_config()
+    results = collections.OrderedDict()
+    reference = results[CALIBRATION] = measure(calibrate, repeat)
+    if set(stages) & set(IMAGE_STAGES):
+        for fmt, size, data in corpus(formats, sizes):
+            funcs = _image_stages(data, conf.THUMBNAIL_SIZE)
+            for stage in IMAGE_STAGES:
+                if stage in stages:
+                    name = result_name(stage, fmt, size)
+                    results[name] = measure(funcs[stage], repeat,
+                                            reference=reference)
+                    LOG.info(u"%s: %.3f ms", name, results[name] * 1000)
+    if STAGE_CLASSIFY in stages:
+        downloader = image_handling.DownloadHandler(
+            gfycat_client=loadtest.FakeGfycat())
+        # Per URL, so adding URLs to the set doesn't look like a regression
+        results[STAGE_CLASSIFY] = measure(
+            _classify(downloader), repeat,
+            reference=reference) / len(CLASSIFY_URLS)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pillow': getattr(PIL, '__version__', None),
+        'machine': platform.machine(),
+    }
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f,
+                  indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _speed(results, baseline):
+    """How much slower the machine ran results than baseline."""
+    if results.get(CALIBRATION) and baseline.get(CALIBRATION):
+        return results[CALIBRATION] / baseline[CALIBRATION]
+    return 1.0
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return (name, baseline, result) for every regressed result.
+
+    A result regresses when it is more than tolerance slower than its
+    baseline, after scaling the baseline by the calibration loop. Results
+    missing from either side are ignored.
+    """
+    speed = _speed(results, baseline)
+    regressions = []
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if (name != CALIBRATION and base and
+                seconds > base * speed * (1 + tolerance)):
+            regressions.append((name, base * speed, seconds))
+    return regressions
+
+
+def format_results(results, baseline=None):
+    baseline = baseline or {}
+    speed = _speed(results, baseline)
+    lines = [u"{:<28}{:>12}{:>12}{:>9}".format(
+        u"benchmark", u"ms", u"base ms", u"change")]
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base and name != CALIBRATION:
+            base *= speed
+        if base:
+            lines.append(u"{:<28}{:>12.3f}{:>12.3f}{:>+8.1f}%".format(
+                name, seconds * 1000, base * 1000,
+                (seconds / base - 1) * 100))
+        else:
+            lines.append(u"{:<28}{:>12.3f}{:>12}{:>9}".format(
+                name, seconds * 1000, u"-", u"-"))
+    return u"\n".join(lines)
@@ -0,0 +1,158 @@
+"""Scalable Bloom filter for remembering archived post ids.
+
+A BloomFilter answers "definitely not added" or "probably added" in a fixed
+amount of memory. ScalableBloomFilter chains filters of growing capacity
+and tightening error rate, so the overall false positive rate stays below
+error_rate however many ids are added.
+
+Saved files are a sequence of filters, each a header packed as HEADER
+followed by the filter's bits. Processes sharing a file should sync() it
+rather than save() it, which merges in what the others saved.
+"""
+import contextlib
+import fcntl
+import hashlib
+import math
+import os
+import struct
+
+HEADER = struct.Struct('>IdIII')
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, error_rate, bits=None, count=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(
+            self.num_bits / float(capacity) * math.log(2))))
+        self.bits = bits or bytearray((self.num_bits + 7) // 8)
+        self.count = count
+
+    def _offsets(self, key):
+        # Double hashing, the k offsets come from a single digest
+        digest = hashlib.md5(key.encode('utf-8')).digest()
+        h1, h2 = struct.unpack('>QQ', digest)
+        return [(h1 + i * h2) % self.num_bits
+                for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for offset in self._offsets(key):
+            self.bits[offset // 8] |= 1 << (offset % 8)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[offset // 8] & (1 << (offset % 8))
+                   for offset in self._offsets(key))
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+    def update(self, other):
+        """Add every key of other, a filter of the same size."""
+        if other.num_bits != self.num_bits:
+            raise ValueError("Can't merge Bloom filters of different sizes.")
+        for i, byte in enumerate(other.bits):
+            self.bits[i] |= byte
+        # Keys added to both can't be told apart, estimate the count from
+        # the bits that are set
+        set_bits = sum(bin(byte).count('1') for byte in self.bits)
+        if set_bits < self.num_bits:
+            estimate = int(round(-self.num_bits / float(self.num_hashes) *
+                                 math.log(1 - set_bits /
+                                          float(self.num_bits))))
+        else:
+            estimate = self.capacity
+        self.count = max(self.count, other.count, estimate)
+
+
+class ScalableBloomFilter(object):
+    def __init__(self, capacity=100000, error_rate=0.001, growth=2,
+                 tightening=0.5):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = []
+
+    def add(self, key):
+        if key in self:
+            return
+        if not self.filters or self.filters[-1].is_full():
+            self.filters.append(BloomFilter(
+                self.capacity * self.growth ** len(self.filters),
+                # The first filter gets half the budget, each one after it
+                # half of the previous, so the total stays below error_rate
+                self.error_rate * (1 - self.tightening) *
+                self.tightening ** len(self.filters)))
+        self.filters[-1].add(key)
+
+    def __contains__(self, key):
+        return any(key in f for f in reversed(self.filters))
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def update(self, other):
+        """Add every key of other, a filter with the same parameters."""
+        for i, bloom in enumerate(other.filters):
+            if i < len(self.filters):
+                self.filters[i].update(bloom)
+            else:
+                self.filters.append(BloomFilter(
+                    bloom.capacity, bloom.error_rate, bytearray(bloom.bits),
+                    bloom.count))
+
+    def sync(self, path):
+        """Merge the filter saved at path into this one and save it there.
+
+        A lock file keeps processes on the same host from saving over
+        each other. Hosts don't share their files, each keeps its own.
+        """
+        with _locked(path + '.lock'):
+            self.update(self.load(path, self.capacity, self.error_rate))
+            self.save(path)
+
+    def save(self, path):
+        # Write then rename so a crash never leaves a truncated filter
+        with open(path + '.tmp', 'wb') as f:
+            for bloom in self.filters:
+                f.write(HEADER.pack(bloom.capacity, bloom.error_rate,
+                                    bloom.count, bloom.num_bits,
+                                    len(bloom.bits)))
+                f.write(bloom.bits)
+        os.rename(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, capacity=100000, error_rate=0.001):
+        """Load the filter saved at path, or start an empty one."""
+        bloom_filter = cls(capacity, error_rate)
+        if not os.path.exists(path):
+            return bloom_filter
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        position = 0
+        while position < len(data):
+            (size, rate, count, num_bits,
+             length) = HEADER.unpack_from(data, position)
+            position += HEADER.size
+            bloom = BloomFilter(size, rate,
+                                bytearray(data[position:position + length]),
+                                count)
+            if bloom.num_bits != num_bits:
+                raise ValueError("Corrupt Bloom filter file: " + path)
+            bloom_filter.filters.append(bloom)
+            position += length
+        return bloom_filter
+
+
+@contextlib.contextmanager
+def _locked(path):
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -1,5 +1,4 @@
 import importlib
-import json
 import logging
 
 from boto3 import session
@@ -8,23 +7,24 @@ import requests
 
 from archiver import config
 from archiver import constants
-from archiver import messages
+from archiver import metrics
+from archiver.queues import base as base_queue
 
-logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger(__name__)
 
 _CLIENTS = {
     'session': None,
-    'sqs': {},
+    'queue': {},
     's3': None,
     'persistence': None
 }
 
 
-def sqs_client(queue):
-    if queue not in _CLIENTS['sqs']:
-        _CLIENTS['sqs'][queue] = SQSClient(queue)
-    return _CLIENTS['sqs'][queue]
+def queue_client(queue):
+    if queue not in _CLIENTS['queue']:
+        conf = config.get_config()
+        _CLIENTS['queue'][queue] = load_driver(conf.QUEUE_DRIVER)(queue)
+    return _CLIENTS['queue'][queue]
 
 
 def s3_client():
@@ -33,14 +33,16 @@ def s3_client():
     return _CLIENTS['s3']
 
 
+def load_driver(driver):
+    driver_module, driver_class = driver.split(':')
+    driver_module = importlib.import_module(driver_module)
+    return getattr(driver_module, driver_class)
+
+
 def persistence_client():
     if not _CLIENTS['persistence']:
         conf = config.get_config()
-        persistence_module, persistence_class = (
-            conf.PERSISTENCE_DRIVER.split(':')
-        )
-        persistence_module = importlib.import_module(persistence_module)
-        persistence_class = getattr(persistence_module, persistence_class)
+        persistence_class = load_driver(conf.PERSISTENCE_DRIVER)
         _CLIENTS['persistence'] = persistence_class()
     return _CLIENTS['persistence']
 
@@ -61,26 +63,29 @@ class S3Client(object):
         self.client = get_session().client('s3')
 
     def upload(self, bucket, path, data, extra_args=None):
-        LOG.info(u"Uploading file to S3 ({}): {}".format(bucket, path))
-        self.client.upload_fileobj(
-            data, bucket, path, extra_args
-        )
+        LOG.debug(u"Uploading file to S3 (%s): %s", bucket, path)
+        with metrics.stage('s3_upload'):
+            self.client.upload_fileobj(
+                data, bucket, path, extra_args
+            )
+
+    def download(self, bucket, path):
+        try:
+            resp = self.client.get_object(Bucket=bucket, Key=path)
+        except boto_exceptions.ClientError:
+            return None
+        return resp['Body'].read()
 
     def object_exists(self, bucket, path):
         try:
             self.client.head_object(Bucket=bucket, Key=path)
         except boto_exceptions.ClientError:
             return False
-        LOG.info(u"File already exists in S3: {}".format(path))
+        LOG.debug(u"File already exists in S3: %s", path)
         return True
 
 
-class SQSClient(object):
-    _message_types = {
-        constants.MESSAGE_SUBREDDIT: messages.SubredditMessage,
-        constants.MESSAGE_POST: messages.PostMessage
-    }
-
+class SQSClient(base_queue.Queue):
     def __init__(self, queue_name):
         self.client = get_session().client('sqs')
 
@@ -90,27 +95,25 @@ class SQSClient(object):
         )
         self.queue_url = response['QueueUrl']
 
-    def send_message(self, message):
+    def send_message(self, message, delay=0):
+        kwargs = {}
+        if delay:
+            kwargs['DelaySeconds'] = min(int(delay), constants.SQS_MAX_DELAY)
         self.client.send_message(
             QueueUrl=self.queue_url,
-            MessageBody=message
+            MessageBody=message,
+            **kwargs
         )
 
-    def get_message(self, wait=20):
+    def get_messages(self, max_messages=10, wait=20):
         resp = self.client.receive_message(
             QueueUrl=self.queue_url,
             AttributeNames=['All'],
-            MaxNumberOfMessages=1,
+            MaxNumberOfMessages=max_messages,
             WaitTimeSeconds=wait
         )
-        if resp.get('Messages'):
-            m = resp.get('Messages')[0]
-            body = json.loads(m['Body'])
-            receipt_handle = m['ReceiptHandle']
-            m_obj = self._message_types[body.get('type')](
-                mid=receipt_handle, **body.get('body'))
-            return m_obj
-        return None
+        return [self._parse_message(m['Body'], m['ReceiptHandle'])
+                for m in resp.get('Messages', [])]
 
     def delete_message(self, mid):
         self.client.delete_message(
@@ -118,6 +121,13 @@ class SQSClient(object):
             ReceiptHandle=mid
         )
 
+    def extend_visibility(self, mid, timeout):
+        self.client.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=mid,
+            VisibilityTimeout=int(timeout)
+        )
+
 
 class ImgurClient(object):
     _base_url = "https://api.imgur.com"
@@ -136,7 +146,8 @@ class ImgurClient(object):
     def get_album(self, album_id):
         album_url = self._album.format(id=album_id)
         url = "{0}{1}".format(self._base_url, album_url)
-        r = requests.get(url, headers=self._prepare_headers())
+        with metrics.stage('imgur_api'):
+            r = requests.get(url, headers=self._prepare_headers())
         images = r.json().get('data', {}).get('images', [])
         links = {i.get('link') for i in images if i.get('link')}
         return list(links)
@@ -144,7 +155,8 @@ class ImgurClient(object):
     def get_image(self, image_id):
         image_url = self._image.format(id=image_id)
         url = "{0}{1}".format(self._base_url, image_url)
-        r = requests.get(url, headers=self._prepare_headers())
+        with metrics.stage('imgur_api'):
+            r = requests.get(url, headers=self._prepare_headers())
         link = r.json().get('data', {}).get('link')
         return link
 
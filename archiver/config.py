@@ -1,12 +1,43 @@
+import collections
 import ConfigParser
 
+DEFAULT_QUEUE_PRIORITY = 'default'
 
-def get_config(_config={}):
+_CONFIG = {}
+
+
+def get_config(_config=_CONFIG):
     if 'config' not in _config:
         _config['config'] = Config()
     return _config['config']
 
 
+def set_config(conf, _config=_CONFIG):
+    """Use conf instead of loading tweench.cfg, e.g. for benchmarks."""
+    _config['config'] = conf
+
+
+def _get_optional(config, section, option, default=None, getter='get'):
+    if not config.has_option(section, option):
+        return default
+    return getattr(config, getter)(section, option)
+
+
+def _get_queues(config, default_queue):
+    """Map each priority to (queue_name, weight), heaviest first.
+
+    The [sqs] queue is the "default" priority unless [queues] overrides it.
+    """
+    queues = collections.OrderedDict(
+        [(DEFAULT_QUEUE_PRIORITY, (default_queue, 1))])
+    if config.has_section('queues'):
+        for priority, value in config.items('queues'):
+            name, _, weight = value.partition(',')
+            queues[priority] = (name.strip(), int(weight or 1))
+    return collections.OrderedDict(
+        sorted(queues.items(), key=lambda item: -item[1][1]))
+
+
 class Config(object):
     def __init__(self, config_file='tweench.cfg'):
         config = ConfigParser.ConfigParser()
@@ -14,6 +45,15 @@ class Config(object):
 
         # SQS
         self.QUEUE_NAME = config.get('sqs', 'queue_name')
+        self.QUEUES = _get_queues(config, self.QUEUE_NAME)
+
+        # Queue backend
+        self.QUEUE_DRIVER = _get_optional(
+            config, 'queue', 'driver', 'archiver.clients:SQSClient')
+        self.QUEUE_LOCAL_DATABASE = _get_optional(
+            config, 'queue', 'local_database', 'tweench-queue.db')
+        self.QUEUE_VISIBILITY_TIMEOUT = _get_optional(
+            config, 'queue', 'visibility_timeout', 300, 'getint')
 
         # S3
         self.IMAGE_BUCKET_NAME = config.get('s3', 'image_bucket')
@@ -34,3 +74,90 @@ class Config(object):
 
         # Persistence
         self.PERSISTENCE_DRIVER = config.get('persistence', 'driver')
+        self.PERSISTENCE_SQL_DATABASE = _get_optional(
+            config, 'persistence', 'sql_database', 'tweench.db')
+        self.PERSISTENCE_ENSURE_TABLES = _get_optional(
+            config, 'persistence', 'ensure_tables', True, 'getboolean')
+        self.PERSISTENCE_CLAIM_LEASE = _get_optional(
+            config, 'persistence', 'claim_lease', 300, 'getint')
+        self.PERSISTENCE_COMPACT_IMAGES = _get_optional(
+            config, 'persistence', 'compact_images', True, 'getboolean')
+        self.PERSISTENCE_INLINE_IMAGE_DETAILS = _get_optional(
+            config, 'persistence', 'inline_image_details', False,
+            'getboolean')
+        self.PERSISTENCE_CACHE_DRIVER = _get_optional(
+            config, 'persistence', 'cache_driver',
+            'archiver.persistence.dynamo:DynamoPersistence')
+        self.PERSISTENCE_CACHE_SIZE = _get_optional(
+            config, 'persistence', 'cache_size', 10000, 'getint')
+        self.PERSISTENCE_CACHE_TTL = _get_optional(
+            config, 'persistence', 'cache_ttl', 300, 'getint')
+        self.PERSISTENCE_BUFFER_DRIVER = _get_optional(
+            config, 'persistence', 'buffer_driver',
+            'archiver.persistence.dynamo:DynamoPersistence')
+        self.PERSISTENCE_BUFFER_SIZE = _get_optional(
+            config, 'persistence', 'buffer_size', 100, 'getint')
+        self.PERSISTENCE_BUFFER_LATENCY = _get_optional(
+            config, 'persistence', 'buffer_latency', 5, 'getfloat')
+        self.PERSISTENCE_METERED_DRIVER = _get_optional(
+            config, 'persistence', 'metered_driver',
+            'archiver.persistence.dynamo:DynamoPersistence')
+
+        # Static feeds
+        self.FEED_OUTPUT = _get_optional(config, 'feeds', 'output', 's3')
+        self.FEED_PREFIX = _get_optional(config, 'feeds', 'prefix', 'feeds')
+        self.FEED_PAGE_SIZE = _get_optional(
+            config, 'feeds', 'page_size', 100, 'getint')
+        self.FEED_SETTLE = _get_optional(
+            config, 'feeds', 'settle', 86400, 'getint')
+
+        # Consumer
+        self.CONSUMER_EMBED_POST_DATA = _get_optional(
+            config, 'consumer', 'embed_post_data', False, 'getboolean')
+        self.CONSUMER_POST_DATA_MAX_AGE = _get_optional(
+            config, 'consumer', 'post_data_max_age', 3600, 'getint')
+        self.CONSUMER_BATCH_POSTS = _get_optional(
+            config, 'consumer', 'batch_posts', False, 'getboolean')
+        self.CONSUMER_BATCH_MAX_POSTS = _get_optional(
+            config, 'consumer', 'batch_max_posts', 25, 'getint')
+        self.CONSUMER_COMPRESS_BATCHES = _get_optional(
+            config, 'consumer', 'compress_batches', False, 'getboolean')
+
+        # Producer
+        self.PRODUCER_MIN_CRAWL_INTERVAL = _get_optional(
+            config, 'producer', 'min_crawl_interval', 0, 'getint')
+        self.PRODUCER_STATE_TTL = _get_optional(
+            config, 'producer', 'state_ttl', 60, 'getint')
+
+        # Scheduler
+        self.SCHEDULER_PLAN_FILE = _get_optional(
+            config, 'scheduler', 'plan_file', 'crawl_plan.json')
+        self.SCHEDULER_JITTER = _get_optional(
+            config, 'scheduler', 'jitter', 0.1, 'getfloat')
+        self.SCHEDULER_MIN_INTERVAL = _get_optional(
+            config, 'scheduler', 'min_interval', 300, 'getint')
+        self.SCHEDULER_MAX_INTERVAL = _get_optional(
+            config, 'scheduler', 'max_interval', 86400, 'getint')
+
+        # Archived post filter
+        self.DEDUPE_FILTER_FILE = _get_optional(
+            config, 'dedupe', 'filter_file')
+        self.DEDUPE_CAPACITY = _get_optional(
+            config, 'dedupe', 'capacity', 100000, 'getint')
+        self.DEDUPE_ERROR_RATE = _get_optional(
+            config, 'dedupe', 'error_rate', 0.001, 'getfloat')
+        self.DEDUPE_SAVE_INTERVAL = _get_optional(
+            config, 'dedupe', 'save_interval', 60, 'getint')
+
+        # Metrics
+        self.METRICS_PORT = _get_optional(
+            config, 'metrics', 'port', 0, 'getint')
+        self.METRICS_ADDRESS = _get_optional(
+            config, 'metrics', 'address', '127.0.0.1')
+
+        # Logging
+        self.LOG_LEVEL = _get_optional(config, 'logging', 'level', 'INFO')
+        self.LOG_SAMPLE_EVERY = _get_optional(
+            config, 'logging', 'sample_every', 1, 'getint')
+        self.LOG_QUEUE_SIZE = _get_optional(
+            config, 'logging', 'queue_size', 10000, 'getint')
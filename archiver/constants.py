@@ -1,11 +1,22 @@
 # Message types
 MESSAGE_SUBREDDIT = u'STORE_SUBREDDIT'
 MESSAGE_POST = u'STORE_POST'
+MESSAGE_POST_BATCH = u'STORE_POST_BATCH'
+
+# Largest SQS message body, in bytes
+SQS_MAX_MESSAGE_SIZE = 262144
+# Longest SQS message delay, in seconds
+SQS_MAX_DELAY = 900
 
 # Query types
 QUERY_TOP_ALL_TIME = 'get_top_from_all'
 QUERY_TOP_TODAY = 'get_top_from_day'
 QUERY_HOT = 'get_hot'
+QUERY_NEW = 'get_new'
+QUERY_TYPES = [QUERY_TOP_ALL_TIME, QUERY_TOP_TODAY, QUERY_HOT, QUERY_NEW]
+
+# Listings sorted newest first, an incremental crawl can stop at the mark
+TIME_ORDERED_QUERIES = frozenset([QUERY_NEW])
 
 # Regexes
 IMGUR_ALBUM = '^https?://(?:m\.|www\.)?imgur\.com/a/([a-zA-Z0-9]+)'
@@ -13,5 +24,10 @@ IMGUR_GALLERY = '^https?://(?:m\.|www\.)?imgur\.com/gallery/([a-zA-Z0-9]+)'
 IMGUR_HASHES = '^https?://(?:m\.|www\.)?imgur\.com/((?:[a-zA-Z0-9]{5,7}[&,]?)+)'
 IMGUR_PAGE = 'https?://(?:www\.|m\.)?imgur\.com/(.*)'
 IMGUR_SINGLE = 'https?://(?:i\.|www\.|m\.)?imgur\.com/(.*?)(?:\..*)'
+REDDIT_POST_ID = '/comments/([a-z0-9]+)'
+REDDIT_IMAGE = '^(https?://i\.redd\.it/[^/?#]+)'
+REDDIT_VIDEO = '^https?://v\.redd\.it/([a-zA-Z0-9]+)'
+REDDIT_GALLERY = ('^https?://(?:www\.|old\.|new\.)?reddit\.com/gallery/'
+                  '([a-zA-Z0-9]+)')
 GFYCAT = 'https?://.*\.gfycat.com/(.*)'
 EXTERNAL = '(https?://.*/(?:.*?\.(?:jpe?g|gifv?|png)))'
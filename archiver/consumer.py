@@ -1,47 +1,283 @@
 import functools
 import logging
+import random
+import re
+import time
 
 import praw
 import praw.exceptions
 
+from archiver import bloom
 from archiver import clients
 from archiver import config
 from archiver import constants
 from archiver import image_handling
+from archiver import log
 from archiver import messages
+from archiver import metrics
+from archiver import models
+from archiver.persistence import base as base_persistence
 
-logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger(__name__)
 
+# Most fullnames a single reddit.info() request accepts
+REDDIT_INFO_BATCH = 100
+SQS_MAX_MESSAGES = 10
+# Long poll used while the queues are empty. With several queues it is
+# split between them, so an idle round still takes about this long.
+SQS_LONG_POLL = 20
+
+
+def _since_mark(posts, mark):
+    """Split a newest first listing at mark, return (posts, new mark)."""
+    newest = mark
+    since = []
+    for post in posts:
+        created_utc = int(post.created_utc)
+        if mark and (post.id == mark['id'] or
+                     created_utc <= mark['created_utc']):
+            break
+        if not newest or created_utc > newest['created_utc']:
+            newest = {'created_utc': created_utc, 'id': post.id}
+        since.append(post)
+    return since, newest
+
 
 class Consumer(object):
-    def __init__(self, override_queue_name=None):
+    def __init__(self, override_queue_name=None, reddit=None,
+                 downloader=None):
         self.conf = config.get_config()
-        self.r = praw.Reddit(self.conf.REDDIT_AGENT_NAME)
-        self.sqs = clients.sqs_client(override_queue_name or
-                                      self.conf.QUEUE_NAME)
-        self.downloader = image_handling.DownloadHandler()
+        self.r = reddit or praw.Reddit(self.conf.REDDIT_AGENT_NAME)
+        if override_queue_name:
+            queues = [(override_queue_name, 1)]
+        else:
+            queues = self.conf.QUEUES.values()
+        self.queues = [(clients.queue_client(name), weight)
+                       for name, weight in queues]
+        # The queue of the message being handled, replies are sent there
+        self.sqs = self.queues[0][0]
+        # Whether the last poll of the queues found nothing
+        self._idle = False
+        # The message being handled, and when it was last made invisible
+        self.message = None
+        self._received = None
+        self._visible_since = None
+        self.downloader = downloader or image_handling.DownloadHandler()
         self._type_map = {
             constants.MESSAGE_SUBREDDIT: self.store_subreddit,
-            constants.MESSAGE_POST: self.store_post
+            constants.MESSAGE_POST: self.store_post,
+            constants.MESSAGE_POST_BATCH: self.store_post_batch
         }
         self.persistence = clients.persistence_client()
+        self.archived = None
+        self._archived_saved = time.time()
+        self._archived_dirty = False
+        if self.conf.DEDUPE_FILTER_FILE:
+            self.archived = bloom.ScalableBloomFilter.load(
+                self.conf.DEDUPE_FILTER_FILE, self.conf.DEDUPE_CAPACITY,
+                self.conf.DEDUPE_ERROR_RATE)
+
+    def _weighted_order(self):
+        remaining = list(self.queues)
+        order = []
+        while remaining:
+            pick = random.uniform(0, sum(w for _, w in remaining))
+            for i, (client, weight) in enumerate(remaining):
+                pick -= weight
+                if pick <= 0 or i == len(remaining) - 1:
+                    order.append(client)
+                    del remaining[i]
+                    break
+        return order
+
+    def _receive(self, max_messages):
+        """Poll the queues in weighted order, return the first messages.
+
+        Queues are polled without waiting while there is work, and long
+        polled in turn once they all came back empty, so an idle consumer
+        doesn't keep sending receive requests. Sets self.sqs to the queue
+        the messages came from.
+        """
+        self._received = time.time()
+        with metrics.stage('queue_receive'):
+            if len(self.queues) == 1:
+                self.sqs = self.queues[0][0]
+                return self.sqs.get_messages(max_messages=max_messages,
+                                             wait=SQS_LONG_POLL)
+            order = self._weighted_order()
+            wait = SQS_LONG_POLL // len(order) if self._idle else 0
+            for client in order:
+                resps = client.get_messages(max_messages=max_messages,
+                                            wait=wait)
+                if resps:
+                    self._idle = False
+                    self.sqs = client
+                    return resps
+            self._idle = True
+            self.sqs = order[0]
+            return []
 
     def run_once(self):
-        resp = self.sqs.get_message()
-        if resp:
-            if resp.type in self._type_map:
-                LOG.debug(u"Got message: {msg}"
-                          .format(msg=str(resp)))
-                self._type_map[resp.type](**resp.body)
-                resp.finish(self.sqs)
-            else:
-                LOG.error(u"Got message of unknown type: {message}"
-                          .format(message=resp))
+        resps = self._receive(1)
+        if resps:
+            self._dispatch(resps[0])
+        else:
+            # Nothing to do, so write out anything still buffered
+            self.persistence.flush()
+        self.persistence.flush_if_due()
+        self._save_archived()
+
+    def run_batch(self, max_messages=SQS_MAX_MESSAGES):
+        """Handle a batch of messages, looking posts up in bulk.
+
+        Posts without fresh embedded data are fetched from Reddit with one
+        info() request per REDDIT_INFO_BATCH posts instead of one request
+        each; every other message is handled as in run_once. A message that
+        fails is logged and left on the queue, the rest of the batch is
+        still handled.
+        """
+        resps = self._receive(max_messages)
+        if not resps:
+            self.persistence.flush()
+
+        lookups = []
+        for resp in resps:
+            if (resp.type == constants.MESSAGE_POST and
+                    self._fresh_post(resp.body.get('post')) is None):
+                match = re.search(constants.REDDIT_POST_ID,
+                                  resp.body['post_link'])
+                if match:
+                    lookups.append((resp, match.group(1)))
+                    continue
+            self._isolated(resp, self._dispatch, resp)
+
+        try:
+            submissions = self._fetch_posts(
+                [post_id for _, post_id in lookups])
+        except Exception:
+            LOG.exception(u"Looking up %s posts failed, fetching them one "
+                          u"at a time.", len(lookups))
+            for resp, _ in lookups:
+                self._isolated(resp, self._dispatch, resp)
+            lookups = []
+        for resp, post_id in lookups:
+            post_link = resp.body['post_link']
+            praw_post = submissions.get(post_id)
+            if praw_post is None:
+                LOG.info(u"Post not found: %s", post_link)
+                self.persistence.after_flush(
+                    functools.partial(resp.finish, self.sqs))
+                continue
+            self._isolated(resp, self._handle, resp, functools.partial(
+                self._archive_post, praw_post, post_link))
+        self.persistence.flush_if_due()
+        self._save_archived()
+
+    def _isolated(self, resp, func, *args):
+        # Unacknowledged, the message comes back after the visibility
+        # timeout like any other failure
+        try:
+            func(*args)
+        except Exception:
+            LOG.exception(u"Failed to handle message: %s", resp)
+
+    def _fetch_posts(self, post_ids):
+        submissions = {}
+        for start in range(0, len(post_ids), REDDIT_INFO_BATCH):
+            fullnames = ['t3_' + post_id for post_id in
+                         post_ids[start:start + REDDIT_INFO_BATCH]]
+            with metrics.stage('reddit_fetch'):
+                for submission in self.r.info(fullnames=fullnames):
+                    submissions[submission.id] = submission
+        return submissions
+
+    def _dispatch(self, resp):
+        if resp.type not in self._type_map:
+            LOG.error(u"Got message of unknown type: %s", resp)
+            return
+        LOG.debug(u"Got message: %s", resp)
+        self._handle(resp, functools.partial(self._type_map[resp.type],
+                                             **resp.body))
+
+    def _handle(self, resp, handler):
+        self.message = resp
+        self._visible_since = self._received
+        try:
+            with log.context(message=resp.type):
+                handler()
+        except base_persistence.PostClaimed as e:
+            # Leave the message on the queue, it comes back after the
+            # visibility timeout once the claim is finished or expired
+            LOG.info(u"Post is claimed by another worker: %s", e)
+            metrics.MESSAGES.inc(type=resp.type, outcome='claimed')
+            return
+        except Exception:
+            metrics.MESSAGES.inc(type=resp.type,
+                                 outcome=metrics.OUTCOME_ERROR)
+            raise
+        metrics.MESSAGES.inc(type=resp.type, outcome=metrics.OUTCOME_OK)
+        # Buffered drivers only acknowledge once records are written
+        self.persistence.after_flush(
+            functools.partial(resp.finish, self.sqs))
+
+    def _keep_visible(self):
+        """Extend the message's visibility once half of it is used up.
 
-    def store_subreddit(self, subreddit_name, query_type, query_num):
-        LOG.info(u"Storing subreddit: {subreddit}"
-                 .format(subreddit=subreddit_name))
+        Long running handlers call this between units of work, so the
+        message isn't handed to another worker while it is still handled.
+        """
+        timeout = self.conf.QUEUE_VISIBILITY_TIMEOUT
+        if (self.message is None or not self.message.id or
+                time.time() - self._visible_since < timeout / 2.0):
+            return
+        try:
+            self.sqs.extend_visibility(self.message.id, timeout)
+            self._visible_since = time.time()
+        except Exception:
+            LOG.warning(u"Failed to extend the visibility of %s",
+                        self.message, exc_info=True)
+
+    def _remember_post(self, post_id):
+        if self.archived is not None:
+            self.archived.add(post_id)
+            self._archived_dirty = True
+
+    def _is_archived(self, post_id):
+        # The filter can only give false positives, confirm those. Without
+        # a filter nothing is looked up and every listed post is enqueued
+        if self.archived is None or post_id not in self.archived:
+            return False
+        return self.persistence.has_post(post_id)
+
+    def _save_archived(self):
+        if self._archived_dirty and (time.time() - self._archived_saved >=
+                                     self.conf.DEDUPE_SAVE_INTERVAL):
+            self.archived.sync(self.conf.DEDUPE_FILTER_FILE)
+            self._archived_saved = time.time()
+            self._archived_dirty = False
+
+    def _post_message(self, post):
+        if self._is_archived(post.id):
+            return None
+        data = None
+        if self.conf.CONSUMER_EMBED_POST_DATA:
+            data = models.Post.from_praw(post).to_dict()
+            data['fetched_utc'] = int(time.time())
+        return messages.PostMessage(post.permalink, post=data)
+
+    def _enqueue_posts(self, post_messages):
+        if not self.conf.CONSUMER_BATCH_POSTS:
+            for m in post_messages:
+                m.enqueue(self.sqs)
+            return
+        for m in messages.pack_posts(
+                post_messages, compress=self.conf.CONSUMER_COMPRESS_BATCHES,
+                max_posts=self.conf.CONSUMER_BATCH_MAX_POSTS):
+            m.enqueue(self.sqs)
+
+    def store_subreddit(self, subreddit_name, query_type, query_num,
+                        incremental=False):
+        LOG.info(u"Storing subreddit: %s", subreddit_name)
         praw_subreddit = self.r.subreddit(subreddit_name)
         self.persistence.persist_subreddit(praw_subreddit)
 
@@ -50,35 +286,112 @@ class Consumer(object):
                 functools.partial(praw_subreddit.top, time_filter="all"),
             constants.QUERY_TOP_TODAY:
                 functools.partial(praw_subreddit.top, time_filter="day"),
-            constants.QUERY_HOT: praw_subreddit.hot
+            constants.QUERY_HOT: praw_subreddit.hot,
+            constants.QUERY_NEW: praw_subreddit.new
         }
         func = func_map.get(query_type)
         posts = func(limit=query_num)
-        for post in posts:
-            m = messages.PostMessage(post.permalink)
-            m.enqueue(self.sqs)
+        mark = newest = None
+        if incremental and query_type in constants.TIME_ORDERED_QUERIES:
+            mark = self.persistence.get_watermark(subreddit_name, query_type)
+            posts, newest = _since_mark(posts, mark)
+        else:
+            posts = list(posts)
+        # Other listings gain posts older than the ones already seen, those
+        # are only told apart from archived posts by id
+        post_messages = [m for m in map(self._post_message, posts) if m]
+        self._enqueue_posts(post_messages)
+        LOG.info(u"Enqueued %s new posts from %s",
+                 len(post_messages), subreddit_name)
+        self.persistence.record_crawl(subreddit_name, query_type, len(posts),
+                                      len(post_messages))
+        if newest is not mark:
+            self.persistence.set_watermark(subreddit_name, query_type,
+                                           newest['created_utc'],
+                                           newest['id'])
+
+    def _fresh_post(self, post):
+        if not post:
+            return None
+        age = time.time() - post.get('fetched_utc', 0)
+        if age > self.conf.CONSUMER_POST_DATA_MAX_AGE:
+            return None
+        return models.Post.from_dict(post)
 
-    def store_post(self, post_link):
+    def store_post(self, post_link, post=None):
         if post_link.startswith("/r/"):
             post_link = "https://reddit.com" + post_link
-        LOG.info(u"Storing post: {post}".format(post=post_link))
-        try:
-            praw_post = self.r.submission(url=post_link)
-            LOG.info(u"Stored post.")
-        except praw.exceptions.APIException:
-            LOG.info(u"Post not found: {post}".format(post=post_link))
-            return
-        self.persistence.persist_user(praw_post.author)
-        post_existed = self.persistence.persist_post(praw_post)
-        if post_existed:
-            LOG.info(u"Already stored, ignoring post: {post}"
-                     .format(post=post_link))
-            return
+        LOG.info(u"Storing post: %s", post_link)
+        praw_post = self._fresh_post(post)
+        if praw_post is None:
+            try:
+                with metrics.stage('reddit_fetch'):
+                    praw_post = self.r.submission(url=post_link)
+                    # praw fetches lazily, load the post while timed
+                    praw_post.title
+                LOG.info(u"Stored post.")
+            except praw.exceptions.APIException:
+                LOG.info(u"Post not found: %s", post_link)
+                return
+        self._archive_post(praw_post, post_link)
+
+    def store_post_batch(self, posts=None, z=None):
+        batch = messages.PostBatchMessage(posts=posts, z=z)
+        LOG.info(u"Storing batch of %s posts", len(batch.posts))
+        ready = []
+        lookups = []
+        for entry in batch.posts:
+            praw_post = self._fresh_post(entry.get('post'))
+            match = re.search(constants.REDDIT_POST_ID, entry['post_link'])
+            if praw_post is None and match:
+                lookups.append((entry, match.group(1)))
+            else:
+                ready.append((entry, praw_post))
+        submissions = self._fetch_posts([post_id for _, post_id in lookups])
+        for entry, post_id in lookups:
+            if post_id in submissions:
+                ready.append((entry, submissions[post_id]))
+            else:
+                LOG.info(u"Post not found: %s", entry['post_link'])
+
+        failed = []
+        claimed = []
+        for entry, praw_post in ready:
+            self._keep_visible()
+            try:
+                if praw_post is None:
+                    self.store_post(**entry)
+                else:
+                    self._archive_post(praw_post, entry['post_link'])
+            except base_persistence.PostClaimed as e:
+                LOG.info(u"Post is claimed by another worker: %s", e)
+                claimed.append(entry)
+            except Exception:
+                LOG.exception(u"Failed to store post from batch: %s",
+                              entry['post_link'])
+                failed.append(entry)
+        # Retry failures on their own, the rest of the batch is done.
+        # Claimed posts come back once the claim is finished or expired.
+        for entry in failed:
+            messages.PostMessage(**entry).enqueue(self.sqs)
+        for entry in claimed:
+            messages.PostMessage(**entry).enqueue(
+                self.sqs, delay=self.conf.PERSISTENCE_CLAIM_LEASE)
+
+    def _archive_post(self, praw_post, post_link):
+        with log.context(post=praw_post.id):
+            self.persistence.persist_user(praw_post.author)
+            post_existed = self.persistence.persist_post(praw_post)
+            if post_existed:
+                LOG.info(u"Already stored, ignoring post: %s", post_link)
+                self._remember_post(praw_post.id)
+                return
 
-        LOG.info(u"Grabbing images")
-        images = self.downloader.store_images(praw_post)
-        if images:
-            self.persistence.persist_images(images)
-        self.persistence.finalize_post(praw_post, images)
-        LOG.info(u"Post finalized.")
+            LOG.info(u"Grabbing images")
+            images = self.downloader.store_images(praw_post)
+            if images:
+                self.persistence.persist_images(images)
+            self.persistence.finalize_post(praw_post, images)
+            self._remember_post(praw_post.id)
+            LOG.info(u"Post finalized.")
 
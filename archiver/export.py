@@ -0,0 +1,205 @@
+import collections
+import decimal
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+
+from six.moves import queue
+
+try:
+    import pyarrow
+    from pyarrow import parquet
+except ImportError:
+    pyarrow = None
+
+LOG = logging.getLogger(__name__)
+
+FORMAT_JSONL = 'jsonl'
+FORMAT_PARQUET = 'parquet'
+
+COLUMNS = ['id', 'subreddit', 'created_utc', 'title', 'permalink', 'url',
+           'user', 'nsfw', 'images']
+
+_DONE = object()
+
+
+def _json_default(value):
+    # DynamoDB hands numbers back as Decimal
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == int(value) else float(value)
+    raise TypeError(repr(value) + " is not JSON serializable")
+
+
+def _file_name(subreddit):
+    return re.sub(r'[^A-Za-z0-9_-]', '_', subreddit or 'unknown')
+
+
+class JsonlWriter(object):
+    """One gzipped JSON lines file per subreddit.
+
+    At most max_open files are kept open; a file closed to make room is
+    reopened in append mode, which just adds another gzip member.
+    """
+
+    def __init__(self, output_dir, max_open=64):
+        self.output_dir = output_dir
+        self.max_open = max_open
+        self._files = collections.OrderedDict()
+        self._started = set()
+
+    def write(self, post):
+        name = _file_name(post['subreddit'])
+        f = self._files.pop(name, None)
+        if f is None:
+            mode = 'ab' if name in self._started else 'wb'
+            f = gzip.open(os.path.join(
+                self.output_dir, name + '.jsonl.gz'), mode)
+            self._started.add(name)
+            while len(self._files) >= self.max_open:
+                self._files.popitem(last=False)[1].close()
+        self._files[name] = f
+        f.write(json.dumps(post, default=_json_default).encode('utf-8'))
+        f.write(b'\n')
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+class ParquetWriter(object):
+    """Parquet files per subreddit, written in bounded row groups.
+
+    At most max_buffered rows are held across all subreddits, the largest
+    buffer is written out as a smaller row group when there are more. At
+    most max_open writers are kept open; Parquet files can't be appended
+    to, so a subreddit whose writer was closed to make room continues in
+    a new part file, e.g. pics.1.parquet.
+    """
+
+    def __init__(self, output_dir, row_group_size=10000, max_open=64,
+                 max_buffered=100000):
+        if pyarrow is None:
+            raise RuntimeError("Parquet export requires pyarrow.")
+        self.output_dir = output_dir
+        self.row_group_size = row_group_size
+        self.max_open = max_open
+        self.max_buffered = max_buffered
+        self._writers = collections.OrderedDict()
+        self._parts = collections.defaultdict(int)
+        self._rows = collections.defaultdict(list)
+        self._buffered = 0
+        self._schema = pyarrow.schema([
+            ('id', pyarrow.string()),
+            ('subreddit', pyarrow.string()),
+            ('created_utc', pyarrow.int64()),
+            ('title', pyarrow.string()),
+            ('permalink', pyarrow.string()),
+            ('url', pyarrow.string()),
+            ('user', pyarrow.string()),
+            ('nsfw', pyarrow.bool_()),
+            # Nested image data is kept as a JSON document per post
+            ('images', pyarrow.string()),
+        ])
+
+    def write(self, post):
+        name = _file_name(post['subreddit'])
+        row = dict(post)
+        row['images'] = json.dumps(post['images'], default=_json_default)
+        row['created_utc'] = (int(post['created_utc'])
+                              if post['created_utc'] is not None else None)
+        self._rows[name].append(row)
+        self._buffered += 1
+        if len(self._rows[name]) >= self.row_group_size:
+            self._flush(name)
+        elif self._buffered > self.max_buffered:
+            self._flush(max(self._rows, key=lambda n: len(self._rows[n])))
+
+    def _writer(self, name):
+        writer = self._writers.pop(name, None)
+        if writer is None:
+            while len(self._writers) >= self.max_open:
+                closed, old = self._writers.popitem(last=False)
+                old.close()
+                self._parts[closed] += 1
+            part = self._parts[name]
+            file_name = name + ('.{}'.format(part) if part else '')
+            writer = parquet.ParquetWriter(
+                os.path.join(self.output_dir, file_name + '.parquet'),
+                self._schema, compression='snappy')
+        self._writers[name] = writer
+        return writer
+
+    def _flush(self, name):
+        rows = self._rows.pop(name, [])
+        if not rows:
+            return
+        self._buffered -= len(rows)
+        table = pyarrow.Table.from_pydict(
+            {c: [row.get(c) for row in rows] for c in COLUMNS},
+            schema=self._schema)
+        self._writer(name).write_table(table)
+
+    def close(self):
+        for name in list(self._rows):
+            self._flush(name)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+        self._parts.clear()
+
+
+def export(persistence, output_dir, fmt=FORMAT_JSONL, segments=1,
+           queue_size=1000):
+    """Stream every post into per-subreddit files under output_dir.
+
+    Each segment is scanned by its own thread into a bounded queue, so
+    memory use doesn't grow with the size of the table.
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    if fmt == FORMAT_PARQUET:
+        writer = ParquetWriter(output_dir)
+    else:
+        writer = JsonlWriter(output_dir)
+
+    posts = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    def scan(segment):
+        try:
+            for post in persistence.scan_posts(segment, segments):
+                posts.put(post)
+        except Exception as e:
+            LOG.exception(u"Export scan of segment %s failed.", segment)
+            errors.append(e)
+        finally:
+            posts.put(_DONE)
+
+    threads = [threading.Thread(target=scan, args=(segment,))
+               for segment in range(segments)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    count = 0
+    running = len(threads)
+    try:
+        while running:
+            post = posts.get()
+            if post is _DONE:
+                running -= 1
+                continue
+            writer.write(post)
+            count += 1
+            if count % 10000 == 0:
+                LOG.info(u"Exported %s posts.", count)
+    finally:
+        writer.close()
+    if errors:
+        raise errors[0]
+    LOG.info(u"Export complete, %s posts written to %s.", count, output_dir)
+    return count
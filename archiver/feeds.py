@@ -0,0 +1,159 @@
+import gzip
+import io
+import json
+import logging
+import os
+import time
+
+from archiver import clients
+from archiver import config
+from archiver.persistence import encoding
+
+LOG = logging.getLogger(__name__)
+
+HEAD_PAGE = 'head.json'
+PAGE_NAME = 'page-{generation}-{number}.json'
+
+HEAD_CACHE_CONTROL = 'max-age=60'
+PAGE_CACHE_CONTROL = 'max-age=31536000, immutable'
+
+
+def feed_entry(post):
+    return {
+        'id': post['id'],
+        'title': post['title'],
+        'permalink': post['permalink'],
+        'user': post['user'],
+        'created_utc': post['created_utc'],
+        'nsfw': post['nsfw'],
+        'images': encoding.encode_images(post['images'], details=False)
+    }
+
+
+def _newest_first(posts):
+    return sorted(posts, key=lambda p: (p['created_utc'], p['id']),
+                  reverse=True)
+
+
+class FeedMaterializer(object):
+    """Writes static, paginated gallery feeds per subreddit.
+
+    Feeds are built by a single job (run_feeds.py) from the posts of the
+    persistence driver's feed index, in order of creation. Posts older than
+    settle seconds are sealed page_size at a time, oldest first, as
+    immutable numbered pages. The head page holds the newer ones and links
+    to the newest sealed page through "next", so a run rewrites the head
+    plus any newly sealed pages.
+
+    Posts archived after their part of the feed was sealed are left out
+    until the feed is rebuilt. A rebuild writes a new generation of pages
+    instead of changing pages clients may have cached.
+    """
+
+    def __init__(self, persistence=None):
+        self.conf = config.get_config()
+        self.persistence = persistence or clients.persistence_client()
+        self.page_size = self.conf.FEED_PAGE_SIZE
+        self.settle = self.conf.FEED_SETTLE
+
+    def materialize(self, subreddit, rebuild=False):
+        """Bring a subreddit's feed up to date, return the pages sealed."""
+        head = self._read(subreddit, HEAD_PAGE)
+        # Heads from before generations were added are rebuilt as well
+        if rebuild or head is None or 'generation' not in head:
+            head = self._new_head(subreddit, head)
+
+        horizon = time.time() - self.settle
+        sealed_ids = set(head['sealed_ids'])
+        posts = [p for p in self.persistence.feed_posts(
+            subreddit, after=head['sealed_until'])
+            if p['id'] not in sealed_ids]
+        settled = 0
+        for post in posts:
+            if post['created_utc'] > horizon:
+                break
+            settled += 1
+        sealed = settled - settled % self.page_size
+        for start in range(0, sealed, self.page_size):
+            self._seal(subreddit, head, posts[start:start + self.page_size])
+        head['posts'] = _newest_first(feed_entry(p) for p in posts[sealed:])
+        self._write(subreddit, HEAD_PAGE, head, HEAD_CACHE_CONTROL)
+        return sealed // self.page_size
+
+    def _new_head(self, subreddit, old_head):
+        generation = (old_head or {}).get('generation', 0) + 1
+        LOG.info(u"Starting generation %s of the feed of %s",
+                 generation, subreddit)
+        return {
+            'subreddit': subreddit,
+            'posts': [],
+            'next': None,
+            'pages': 0,
+            'generation': generation,
+            # Created time of the newest sealed post, and the sealed posts
+            # created at that time, where the next run picks up
+            'sealed_until': None,
+            'sealed_ids': []
+        }
+
+    def _seal(self, subreddit, head, posts):
+        name = PAGE_NAME.format(generation=head['generation'],
+                                number=head['pages'])
+        LOG.info(u"Sealing feed page for %s: %s", subreddit, name)
+        page = {
+            'subreddit': subreddit,
+            'posts': _newest_first(feed_entry(p) for p in posts),
+            'next': head['next']
+        }
+        self._write(subreddit, name, page, PAGE_CACHE_CONTROL)
+        head['next'] = name
+        head['pages'] += 1
+        newest = posts[-1]['created_utc']
+        if newest != head['sealed_until']:
+            head['sealed_ids'] = []
+        head['sealed_until'] = newest
+        head['sealed_ids'].extend(p['id'] for p in posts
+                                  if p['created_utc'] == newest)
+
+    def _key(self, subreddit, name):
+        return '/'.join([self.conf.FEED_PREFIX, subreddit, name])
+
+    def _write(self, subreddit, name, page, cache_control):
+        data = io.BytesIO()
+        with gzip.GzipFile(fileobj=data, mode='wb', mtime=0) as f:
+            f.write(json.dumps(page, separators=(',', ':')).encode('utf-8'))
+        data.seek(0)
+        key = self._key(subreddit, name)
+
+        if self.conf.FEED_OUTPUT == 's3':
+            clients.s3_client().upload(
+                self.conf.THUMB_BUCKET_NAME, key, data, {
+                    'ContentType': 'application/json',
+                    'ContentEncoding': 'gzip',
+                    'CacheControl': cache_control
+                })
+            return
+
+        path = os.path.join(self.conf.FEED_OUTPUT, key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # Write then rename so readers never see a partial page
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data.getvalue())
+        os.rename(path + '.tmp', path)
+
+    def _read(self, subreddit, name):
+        key = self._key(subreddit, name)
+        if self.conf.FEED_OUTPUT == 's3':
+            data = clients.s3_client().download(
+                self.conf.THUMB_BUCKET_NAME, key)
+        else:
+            path = os.path.join(self.conf.FEED_OUTPUT, key)
+            if not os.path.exists(path):
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+        if not data:
+            return None
+        with gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb') as f:
+            return json.loads(f.read().decode('utf-8'))
@@ -1,8 +1,6 @@
-import collections
 import hashlib
 import io
 import logging
-import re
 
 import colorific
 from gfycat import client as gfycat
@@ -12,26 +10,57 @@ import requests
 from archiver import clients
 from archiver import config
 from archiver import constants
+from archiver import metrics
+from archiver import models
+from archiver import resolvers
 
-logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger(__name__)
 
 
+def download(url):
+    with metrics.stage('download'):
+        return requests.get(url, stream=False)
+
+
+def image_path(url):
+    name = url.split('/')[-1]
+    return "{hash}/{name}".format(hash=hashlib.md5(url).hexdigest(),
+                                  name=name)
+
+
 class DownloadHandler(object):
-    def __init__(self):
+    def __init__(self, gfycat_client=None):
         self.conf = config.get_config()
         self.s3 = clients.s3_client()
         self.persistence = clients.persistence_client()
 
-        self._regexes = collections.OrderedDict([
-            (re.compile(constants.IMGUR_ALBUM, re.IGNORECASE), self._album),
-            (re.compile(constants.IMGUR_GALLERY, re.IGNORECASE), self._album),
-            (re.compile(constants.IMGUR_HASHES, re.IGNORECASE), self._hashes),
-            (re.compile(constants.IMGUR_PAGE, re.IGNORECASE), self._single),
-            (re.compile(constants.IMGUR_SINGLE, re.IGNORECASE), self._single),
-            (re.compile(constants.GFYCAT, re.IGNORECASE), self._gfycat),
-            (re.compile(constants.EXTERNAL, re.IGNORECASE), self._external)
-        ])
+        self.resolvers = resolvers.ResolverRegistry()
+        # Direct image links are by far the most common, give them a host
+        # of their own instead of trying the imgur page patterns first
+        self.resolvers.register(resolvers.Resolver(
+            'imgur_single', constants.IMGUR_SINGLE, self._single),
+            hosts=['i.imgur.com'])
+        for name, pattern, handler in [
+                ('imgur_album', constants.IMGUR_ALBUM, self._album),
+                ('imgur_gallery', constants.IMGUR_GALLERY, self._album),
+                ('imgur_hashes', constants.IMGUR_HASHES, self._hashes),
+                ('imgur_page', constants.IMGUR_PAGE, self._single),
+                ('imgur_single', constants.IMGUR_SINGLE, self._single)]:
+            self.resolvers.register(resolvers.Resolver(
+                name, pattern, handler), hosts=['imgur.com'])
+        self.resolvers.register(resolvers.Resolver(
+            'gfycat', constants.GFYCAT, self._gfycat), hosts=['gfycat.com'])
+        self.resolvers.register(resolvers.Resolver(
+            'reddit_image', constants.REDDIT_IMAGE, self._reddit_image),
+            hosts=['i.redd.it'])
+        self.resolvers.register(resolvers.Resolver(
+            'reddit_video', constants.REDDIT_VIDEO, self._reddit_video,
+            with_post=True), hosts=['v.redd.it'])
+        self.resolvers.register(resolvers.Resolver(
+            'reddit_gallery', constants.REDDIT_GALLERY,
+            self._reddit_gallery, with_post=True), hosts=['reddit.com'])
+        self.resolvers.register(resolvers.Resolver(
+            'external', constants.EXTERNAL, self._external))
 
         if self.conf.IMGUR_MASHAPE_KEY:
             self.imgur = clients.MashapeImgurClient(
@@ -41,59 +70,67 @@ class DownloadHandler(object):
         else:
             self.imgur = clients.ImgurClient(self.conf.IMGUR_CLIENT_ID)
 
-        self.gfycat = gfycat.GfycatClient()
+        self.gfycat = gfycat_client or gfycat.GfycatClient()
 
     def store_images(self, praw_post):
-        LOG.info(u"Determining type of image URL: {url}"
-                 .format(url=praw_post.url))
-        images = []
-        for regex in self._regexes:
-            m = regex.match(praw_post.url)
-            if m:
-                images.extend(self._regexes[regex](
-                    *m.groups()
-                ))
-                break
-        return images
+        LOG.info(u"Determining type of image URL: %s", praw_post.url)
+        resolved = self._resolve(praw_post.url)
+        if not resolved:
+            return []
+        resolver, args = resolved
+        if resolver.with_post:
+            args = (praw_post,) + args
+        with metrics.timed(metrics.IMAGES_SECONDS, resolver=resolver.name):
+            return list(resolver.handler(*args))
+
+    def _resolve(self, url):
+        """Return the (resolver, args) that downloads url, or None."""
+        return self.resolvers.resolve(url)
 
     def _single(self, image_id):
-        LOG.info(u"Single imgur page detected: {page}".format(page=image_id))
+        LOG.info(u"Single imgur page detected: %s", image_id)
         image_url = self.imgur.get_image(image_id)
         image = self._download_one_imgur(image_url)
         return [image] if image is not None else []
 
     def _album(self, album_id):
-        LOG.info(u"Album detected: {album_id}".format(album_id=album_id))
+        LOG.info(u"Album detected: %s", album_id)
         image_urls = self.imgur.get_album(album_id)
-        images = [self._download_one_imgur(url)
-                  for url in image_urls if url is not None]
-        return [image for image in images if image is not None]
+        return self._download_imgur_urls(image_urls)
 
     def _hashes(self, hashes):
         hashes = hashes.strip(',').split(',')
-        LOG.info(u"Image hashes detected: {hashes}".format(hashes=hashes))
+        LOG.info(u"Image hashes detected: %s", hashes)
         image_urls = [self.imgur.get_image(image_id) for image_id in hashes]
-        images = [self._download_one_imgur(url)
-                  for url in image_urls if url is not None]
+        return self._download_imgur_urls(image_urls)
+
+    def _download_imgur_urls(self, urls):
+        # Look up every image of the album in one persistence round trip
+        known_images = self.persistence.get_images(
+            [image_path(url) for url in urls if url])
+        images = [self._download_one_imgur(url, known_images)
+                  for url in urls if url is not None]
         return [image for image in images if image is not None]
 
-    def _download_one_imgur(self, url):
+    def _download_one_imgur(self, url, known_images=None):
         if not url:
             LOG.info(u"Imgur hash no longer valid.")
             return None
-        name = url.split('/')[-1]
-        path = "{hash}/{name}".format(hash=hashlib.md5(url).hexdigest(),
-                                      name=name)
-        object_in_s3 = self.s3.object_exists(self.conf.IMAGE_BUCKET_NAME, path)
-        object_in_db = self.persistence.get_image(path)
-        if object_in_db and object_in_s3:
+        path = image_path(url)
+        if known_images is None:
+            object_in_db = self.persistence.get_image(path)
+        else:
+            object_in_db = known_images.get(path)
+        # Only pay for the S3 HEAD when the record says we have the image
+        if object_in_db and self.s3.object_exists(
+                self.conf.IMAGE_BUCKET_NAME, path):
             return object_in_db
 
-        LOG.info(u"Downloading '{path}': {url}".format(path=path, url=url))
-        r = requests.get(url, stream=False)
+        LOG.info(u"Downloading '%s': %s", path, url)
+        r = download(url)
         if r.status_code != 200:
-            LOG.info(u"Imgur link could not be fetched, status code: {status}"
-                     .format(status=r.status_code))
+            LOG.info(u"Imgur link could not be fetched, status code: %s",
+                     r.status_code)
             return {'url': url}
         image = self._handle_image_data(r.content, path)
         return {
@@ -104,23 +141,21 @@ class DownloadHandler(object):
         }
 
     def _gfycat(self, gfy_id):
-        LOG.info(u"Gfycat detected: {gfy_id}".format(gfy_id=gfy_id))
+        LOG.info(u"Gfycat detected: %s", gfy_id)
         gfy_data = self.gfycat.query_gfy(gfy_id)
         if gfy_data and 'gfyItem' in gfy_data:
             url = gfy_data['gfyItem']['webmUrl']
-            r1 = requests.get(url, stream=False)
+            r1 = download(url)
             if r1.status_code != 200:
                 LOG.info(u"Gfycat image could not be downloaded. "
-                         u"Status code: {code}".format(code=r1.status_code))
+                         u"Status code: %s", r1.status_code)
                 return []
 
             thumb_url = (gfy_data['gfyItem'].get('max2mbGif') or
                          gfy_data['gfyItem'].get('max5mbGif'))
-            r2 = requests.get(thumb_url, stream=False)
+            r2 = download(thumb_url)
 
-            name = url.split('/')[-1]
-            path = "{hash}/{name}".format(hash=hashlib.md5(url).hexdigest(),
-                                          name=name)
+            path = image_path(url)
             self._handle_image_data(
                 data=r1.content, thumb_data=r2.content, path=path,
                 content_type=r1.headers['content-type'],
@@ -134,20 +169,58 @@ class DownloadHandler(object):
                 },
             }]
 
+    def _reddit_image(self, url):
+        LOG.info(u"Reddit image detected: %s", url)
+        return self._download_imgur_urls([url])
+
+    def _reddit_video(self, praw_post, video_id):
+        LOG.info(u"Reddit video detected: %s", video_id)
+        video = (models.reddit_media(praw_post) or {}).get('video')
+        if not video or not video['thumb']:
+            LOG.info(u"No downloadable video for: %s", praw_post.url)
+            return [{'url': praw_post.url}]
+        r1 = download(video['url'])
+        if r1.status_code != 200:
+            LOG.info(u"Reddit video could not be downloaded. "
+                     u"Status code: %s", r1.status_code)
+            return [{'url': praw_post.url}]
+        r2 = download(video['thumb'])
+
+        # Fallback URLs carry a query string, keep it out of the path
+        url = video['url'].split('?')[0]
+        path = image_path(url)
+        self._handle_image_data(
+            data=r1.content, thumb_data=r2.content, path=path,
+            content_type=r1.headers['content-type'],
+            thumb_content_type=r2.headers['content-type'])
+        return [{
+            'url': url,
+            'path': path,
+            'dimensions': {
+                'height': video['height'],
+                'width': video['width']
+            },
+        }]
+
+    def _reddit_gallery(self, praw_post, gallery_id):
+        LOG.info(u"Reddit gallery detected: %s", gallery_id)
+        urls = (models.reddit_media(praw_post) or {}).get('gallery')
+        if not urls:
+            LOG.info(u"No gallery images for: %s", praw_post.url)
+            return [{'url': praw_post.url}]
+        return self._download_imgur_urls(urls)
+
     def _external(self, url):
-        LOG.info(u"Generic image URL detected: {url}".format(url=url))
-        name = url.split('/')[-1]
-        path = "{hash}/{name}".format(hash=hashlib.md5(url).hexdigest(),
-                                      name=name)
+        LOG.info(u"Generic image URL detected: %s", url)
+        path = image_path(url)
         if not self.s3.object_exists(self.conf.IMAGE_BUCKET_NAME, path):
             try:
-                r = requests.get(url, stream=False)
+                r = download(url)
             except requests.exceptions.ConnectionError:
                 return [{'url': url}]
             if r.status_code != 200 or r.headers['content-type'].startswith(
                     "text"):
-                LOG.info(u"Failed to fetch ({status}): {url}"
-                         .format(status=r.status_code, url=url))
+                LOG.info(u"Failed to fetch (%s): %s", r.status_code, url)
                 return [{'url': url}]
             self._handle_image_data(r.content, path)
         return [{'url': url, 'path': path}]
@@ -172,7 +245,10 @@ class Image(object):
         self.thumb_data = thumb_data
         io_data = io.BytesIO(self.data)
         try:
-            self.pi = PILImage.open(io_data)
+            with metrics.stage('decode'):
+                self.pi = PILImage.open(io_data)
+                # Decode now rather than on first use so it is timed here
+                self.pi.load()
             self.type = (content_type or
                          "image/{}".format(self.pi.format.lower()))
             self.thumb_type = (thumb_content_type or
@@ -198,7 +274,7 @@ class Image(object):
                        {"ContentType": self.thumb_type})
 
     def _thumbnail(self, width=None, height=None):
-        LOG.info(u"Thumbnailing data at ({} x {})".format(width, height))
+        LOG.debug(u"Thumbnailing data at (%s x %s)", width, height)
         if width:
             wpercent = (width / float(self.pi.size[0]))
             height = int((float(self.pi.size[1]) * float(wpercent)))
@@ -206,31 +282,33 @@ class Image(object):
             hpercent = (height / float(self.pi.size[1]))
             width = int((float(self.pi.size[0]) * float(hpercent)))
 
-        thumb = self.pi.resize((width, height), PILImage.ANTIALIAS)
-        thumb_bytes = io.BytesIO()
-        thumb.save(thumb_bytes, self.pi.format)
+        with metrics.stage('thumbnail'):
+            thumb = self.pi.resize((width, height), PILImage.ANTIALIAS)
+            thumb_bytes = io.BytesIO()
+            thumb.save(thumb_bytes, self.pi.format)
         thumb_bytes.seek(0)
         return thumb_bytes
 
     def get_colors(self):
         if self.pi:
-            LOG.info(u"Analyzing color data for image...")
+            LOG.debug(u"Analyzing color data for image...")
             try:
-                colors = colorific.extract_colors(self.pi).colors
+                with metrics.stage('colors'):
+                    colors = colorific.extract_colors(self.pi).colors
                 return [{
                             'value': colorific.rgb_to_hex(c.value),
                             'prominence': int(c.prominence * 100)
                         }
                         for c in colors]
             except:
-                LOG.error(u"Exception while analyzing colors for image: {}"
-                          .format(self.path))
+                LOG.error(u"Exception while analyzing colors for image: %s",
+                          self.path)
         else:
             LOG.info(u"Can't analyze colors, no image data.")
 
     def get_dimensions(self):
         if self.pi:
-            LOG.info(u"Calculating dimensions for image...")
+            LOG.debug(u"Calculating dimensions for image...")
             return {'height': self.pi.size[0], 'width': self.pi.size[1]}
 
         LOG.info(u"Can't calculate dimensions, no image data.")
@@ -0,0 +1,181 @@
+"""Logging setup shared by every entry point.
+
+setup() sends records through a bounded queue to a listener thread that
+does the formatting and the writing, so a slow terminal or disk never
+holds up a worker. Records that can't be queued are dropped and counted
+rather than waited on.
+
+Two filters run on the thread that logs, before a record is queued:
+
+* ContextFilter adds the fields set with context(), e.g. the message and
+  post being handled, to every record logged inside the block
+* SamplingFilter passes only the first and then every Nth record of each
+  INFO or DEBUG message, warnings and errors always pass
+
+Modules only create their logger and log with %-style arguments, which
+are only formatted for records that pass the level and the filters.
+"""
+import atexit
+import contextlib
+import logging
+import sys
+import threading
+
+from six.moves import queue
+
+from archiver import config
+
+DEFAULT_FORMAT = '%(levelname)s:%(name)s:%(context)s%(message)s'
+DEFAULT_QUEUE_SIZE = 10000
+
+_LOCAL = threading.local()
+_LISTENER = {}
+
+
+def _current_context():
+    if not hasattr(_LOCAL, 'stack'):
+        _LOCAL.stack = [{}]
+    return _LOCAL.stack[-1]
+
+
+@contextlib.contextmanager
+def context(**fields):
+    """Add fields to every record logged by this thread in the block."""
+    fields = dict(_current_context(), **fields)
+    _LOCAL.stack.append(fields)
+    try:
+        yield
+    finally:
+        _LOCAL.stack.pop()
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        fields = _current_context()
+        record.context = u''.join(u'[{}={}] '.format(key, fields[key])
+                                  for key in sorted(fields))
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Pass the first and every `every`th record of each message."""
+
+    def __init__(self, every=1, max_level=logging.INFO):
+        logging.Filter.__init__(self)
+        self.every = every
+        self.max_level = max_level
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.every <= 1 or record.levelno > self.max_level:
+            return True
+        # The unformatted message identifies the log line
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % self.every == 0
+
+
+class QueueHandler(logging.Handler):
+    """Hands records to a queue instead of writing them."""
+
+    def __init__(self, record_queue):
+        logging.Handler.__init__(self)
+        self.queue = record_queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format the arguments and traceback now: they may change or go
+        # away before the listener gets to the record
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """Writes the records of a queue to handlers on a thread of its own."""
+
+    _STOP = None
+
+    def __init__(self, record_queue, *handlers):
+        self.queue = record_queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='log-listener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is self._STOP:
+                return
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        if self._thread is not None:
+            # Blocks when the queue is full, the listener is draining it
+            self.queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+
+
+def setup(level=logging.INFO, sample_every=1,
+          queue_size=DEFAULT_QUEUE_SIZE, stream=None, fmt=DEFAULT_FORMAT):
+    """Configure the root logger, once per process.
+
+    Later calls only change the level.
+    """
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _LISTENER:
+        return _LISTENER['handler']
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(fmt))
+    record_queue = queue.Queue(maxsize=queue_size)
+    handler = QueueHandler(record_queue)
+    handler.addFilter(SamplingFilter(sample_every))
+    handler.addFilter(ContextFilter())
+    root.addHandler(handler)
+
+    listener = QueueListener(record_queue, output)
+    listener.start()
+    atexit.register(_shutdown)
+    _LISTENER.update(handler=handler, listener=listener)
+    return handler
+
+
+def setup_from_config():
+    conf = config.get_config()
+    return setup(conf.LOG_LEVEL, conf.LOG_SAMPLE_EVERY, conf.LOG_QUEUE_SIZE)
+
+
+def _shutdown():
+    if not _LISTENER:
+        return
+    handler = _LISTENER.pop('handler')
+    logging.getLogger().removeHandler(handler)
+    _LISTENER.pop('listener').stop()
+    if handler.dropped:
+        sys.stderr.write("{} log records were dropped, the log queue was "
+                         "full.\n".format(handler.dropped))
@@ -1,26 +1,33 @@
+import base64
 import json
 import logging
+import zlib
 
 from archiver import constants
 
-logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger(__name__)
 
+# Compressed batches are first filled to this multiple of the size limit
+# and split if they still don't fit
+COMPRESSED_FILL = 4
+
 
 class QueueMessage(object):
     id = None
     type = None
     body = None
 
-    def enqueue(self, client):
-        LOG.debug(u"Enqueueing message: {msg}"
-                  .format(msg=str(self)))
-        client.send_message(str(self))
+    def enqueue(self, client, delay=0):
+        LOG.debug(u"Enqueueing message: %s", self)
+        if delay:
+            client.send_message(str(self), delay=delay)
+        else:
+            client.send_message(str(self))
 
     def finish(self, client):
         if not self.id:
             raise AttributeError("Message has no ID!")
-        LOG.debug(u"Deleting message: {msg}".format(msg=str(self)))
+        LOG.debug(u"Deleting message: %s", self)
         client.delete_message(self.id)
 
     def __str__(self):
@@ -35,34 +42,103 @@ class QueueMessage(object):
 
 class SubredditMessage(QueueMessage):
     def __init__(self, subreddit_name, query_type=constants.QUERY_TOP_ALL_TIME,
-                 query_num=10, mid=None):
-        LOG.debug(u"Created new SubredditMessage: {subreddit}"
-                  .format(subreddit=subreddit_name))
+                 query_num=10, incremental=False, mid=None):
+        LOG.debug(u"Created new SubredditMessage: %s", subreddit_name)
         self.type = constants.MESSAGE_SUBREDDIT
         self.subreddit_name = subreddit_name
         self.query_type = query_type
         self.query_num = query_num
+        self.incremental = incremental
         self.id = mid
 
     @property
     def body(self):
-        return {
+        body = {
             "subreddit_name": self.subreddit_name,
             "query_type": self.query_type,
             "query_num": self.query_num
         }
+        if self.incremental:
+            body["incremental"] = True
+        return body
 
 
 class PostMessage(QueueMessage):
-    def __init__(self, post_link, mid=None):
-        LOG.debug(u"Created new PostMessage: {post}"
-                  .format(post=post_link))
+    def __init__(self, post_link, post=None, mid=None):
+        LOG.debug(u"Created new PostMessage: %s", post_link)
         self.type = constants.MESSAGE_POST
         self.post_link = post_link
+        # Optional models.Post.to_dict() plus the time it was fetched
+        self.post = post
         self.id = mid
 
     @property
     def body(self):
-        return {
+        body = {
             "post_link": self.post_link
         }
+        if self.post:
+            body["post"] = self.post
+        return body
+
+
+class PostBatchMessage(QueueMessage):
+    """Several post messages in one, as a list of PostMessage bodies.
+
+    With compress set the list is sent as zlib compressed, base64 encoded
+    JSON in "z" instead of "posts".
+    """
+
+    def __init__(self, posts=None, z=None, compress=False, mid=None):
+        if z is not None:
+            posts = json.loads(zlib.decompress(base64.b64decode(z)))
+            compress = True
+        LOG.debug(u"Created new PostBatchMessage: %s posts", len(posts or []))
+        self.type = constants.MESSAGE_POST_BATCH
+        self.posts = posts or []
+        self.compress = compress
+        self.id = mid
+
+    @property
+    def body(self):
+        if self.compress:
+            data = zlib.compress(json.dumps(self.posts).encode('utf-8'))
+            return {"z": base64.b64encode(data).decode('ascii')}
+        return {"posts": self.posts}
+
+
+def pack_posts(post_messages, compress=False,
+               max_size=constants.SQS_MAX_MESSAGE_SIZE, max_posts=None):
+    """Pack PostMessages into as few PostBatchMessages as fit max_size.
+
+    With max_posts set no batch holds more posts than that, so a batch can
+    be worked through well within the visibility timeout.
+    """
+    budget = max_size * (COMPRESSED_FILL if compress else 1)
+    # Room for the type and the surrounding JSON
+    overhead = len(str(PostBatchMessage(compress=compress)))
+    batches = []
+    posts = []
+    size = overhead
+    for m in post_messages:
+        entry_size = len(json.dumps(m.body)) + 2
+        if posts and (size + entry_size > budget or
+                      len(posts) == max_posts):
+            batches.append(posts)
+            posts = []
+            size = overhead
+        posts.append(m.body)
+        size += entry_size
+    if posts:
+        batches.append(posts)
+
+    packed = []
+    while batches:
+        posts = batches.pop(0)
+        batch = PostBatchMessage(posts, compress=compress)
+        if len(str(batch)) > max_size and len(posts) > 1:
+            half = len(posts) // 2
+            batches[:0] = [posts[:half], posts[half:]]
+            continue
+        packed.append(batch)
+    return packed
@@ -0,0 +1,242 @@
+"""Counters and latency histograms in the Prometheus text format.
+
+Metrics live in REGISTRY and can be served over HTTP by start_http_server,
+which the consumer does when [metrics] port is set. Stage timings all go
+to one histogram labelled by stage and outcome:
+
+    with metrics.stage('thumbnail'):
+        ...
+
+The outcome is "error" when the block raised, "ok" otherwise.
+"""
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+import six
+from six.moves import BaseHTTPServer
+
+LOG = logging.getLogger(__name__)
+
+OUTCOME_OK = 'ok'
+OUTCOME_ERROR = 'error'
+
+# Seconds, from a fast cache hit up to a slow image download
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Called with (histogram, labels, seconds) for every timed block
+_OBSERVERS = []
+
+
+def _escape(value):
+    return (six.text_type(value).replace(u'\\', u'\\\\').replace(u'\n', u'\\n')
+            .replace(u'"', u'\\"'))
+
+
+def _format_labels(names, values):
+    if not names:
+        return u''
+    return u'{' + u','.join(u'{}="{}"'.format(name, _escape(value))
+                            for name, value in zip(names, values)) + u'}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return u'+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(u"{} takes the labels {}, got {}".format(
+                self.name, self.labelnames, sorted(labels)))
+        return tuple(labels[name] for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError()
+
+    def expose(self):
+        lines = [u'# HELP {} {}'.format(self.name, self.documentation),
+                 u'# TYPE {} {}'.format(self.name, self.metric_type)]
+        with self._lock:
+            samples = self._samples()
+        for suffix, names, values, value in samples:
+            lines.append(u'{}{}{} {}'.format(
+                self.name, suffix, _format_labels(names, values),
+                _format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [('', self.labelnames, key, value)
+                for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def _samples(self):
+        names = self.labelnames + ('le',)
+        samples = []
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(('_bucket', names,
+                                key + (_format_value(bound),), cumulative))
+            samples.append(('_sum', self.labelnames, key, total))
+            samples.append(('_count', self.labelnames, key, cumulative))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(u"Metric already registered: " +
+                                 metric.name)
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames,
+                                       buckets))
+
+    def expose(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return u'\n'.join(lines) + u'\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'tweench_stage_seconds', 'Time spent in each processing stage.',
+    ['stage', 'outcome'])
+IMAGES_SECONDS = REGISTRY.histogram(
+    'tweench_store_images_seconds',
+    'Time spent storing the images of a post, by resolver.',
+    ['resolver', 'outcome'])
+MESSAGES = REGISTRY.counter(
+    'tweench_messages_total', 'Queue messages handled.',
+    ['type', 'outcome'])
+
+
+@contextlib.contextmanager
+def timed(histogram, **labels):
+    """Observe the time the block takes, labelled with its outcome."""
+    start = time.time()
+    outcome = OUTCOME_OK
+    try:
+        yield
+    except Exception:
+        outcome = OUTCOME_ERROR
+        raise
+    finally:
+        seconds = time.time() - start
+        histogram.observe(seconds, outcome=outcome, **labels)
+        for observer in _OBSERVERS:
+            observer(histogram, labels, seconds)
+
+
+def stage(name):
+    return timed(STAGE_SECONDS, stage=name)
+
+
+def add_observer(observer):
+    _OBSERVERS.append(observer)
+
+
+def remove_observer(observer):
+    _OBSERVERS.remove(observer)
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown out the consumer's log
+        pass
+
+
+def start_http_server(port, address='127.0.0.1', registry=REGISTRY):
+    """Serve registry on a daemon thread, return the server."""
+    class Handler(MetricsHandler):
+        pass
+    Handler.registry = registry
+    server = BaseHTTPServer.HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='metrics-http')
+    thread.daemon = True
+    thread.start()
+    LOG.info(u"Serving metrics on http://%s:%s/metrics",
+             address, server.server_port)
+    return server
@@ -0,0 +1,106 @@
+class Author(object):
+    def __init__(self, name):
+        self.name = name
+        self.id = None
+
+
+class Subreddit(object):
+    def __init__(self, display_name):
+        self.display_name = display_name
+
+
+def reddit_media(post):
+    """Video and gallery URLs of a post hosted by Reddit itself, or None.
+
+    Only attributes praw already holds are read, asking a praw object for
+    one it lacks would fetch the whole post again.
+    """
+    if isinstance(post, Post):
+        return post.reddit_media
+    fields = vars(post)
+    video = (fields.get('media') or {}).get('reddit_video') or {}
+    if video.get('fallback_url'):
+        images = (fields.get('preview') or {}).get('images') or [{}]
+        thumb = images[0].get('source', {}).get('url')
+        return {'video': {
+            'url': video['fallback_url'],
+            # Reddit escapes the query strings of preview URLs
+            'thumb': thumb.replace('&amp;', '&') if thumb else None,
+            'height': video.get('height'),
+            'width': video.get('width')
+        }}
+    metadata = fields.get('media_metadata')
+    if metadata:
+        items = ((fields.get('gallery_data') or {}).get('items') or
+                 [{'media_id': media_id} for media_id in sorted(metadata)])
+        urls = []
+        for item in items:
+            media = metadata.get(item['media_id']) or {}
+            if media.get('status') == 'valid' and media.get('m'):
+                urls.append('https://i.redd.it/{id}.{ext}'.format(
+                    id=item['media_id'], ext=media['m'].split('/')[-1]))
+        return {'gallery': urls}
+    return None
+
+
+class Post(object):
+    """Plain copy of the praw submission fields the archiver reads.
+
+    Unlike a praw object it never triggers a lazy fetch from Reddit, so it
+    is safe to hold on to and read later.
+    """
+
+    def __init__(self, id, title, permalink, url, author, created_utc,
+                 over_18, subreddit, reddit_media=None):
+        self.id = id
+        self.title = title
+        self.permalink = permalink
+        self.url = url
+        self.author = Author(author) if author else None
+        self.created_utc = created_utc
+        self.over_18 = over_18
+        self.subreddit = Subreddit(subreddit)
+        self.reddit_media = reddit_media
+
+    @classmethod
+    def from_praw(cls, praw_post):
+        return cls(
+            id=praw_post.id,
+            title=praw_post.title,
+            permalink=praw_post.permalink,
+            url=praw_post.url,
+            author=praw_post.author.name if praw_post.author else None,
+            created_utc=praw_post.created_utc,
+            over_18=praw_post.over_18,
+            subreddit=praw_post.subreddit.display_name,
+            reddit_media=reddit_media(praw_post)
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            id=data['id'],
+            title=data['title'],
+            permalink=data['permalink'],
+            url=data['url'],
+            author=data.get('author'),
+            created_utc=data['created_utc'],
+            over_18=data['over_18'],
+            subreddit=data['subreddit'],
+            reddit_media=data.get('reddit_media')
+        )
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'title': self.title,
+            'permalink': self.permalink,
+            'url': self.url,
+            'author': self.author.name if self.author else None,
+            'created_utc': self.created_utc,
+            'over_18': self.over_18,
+            'subreddit': self.subreddit.display_name
+        }
+        if self.reddit_media:
+            data['reddit_media'] = self.reddit_media
+        return data
@@ -3,6 +3,14 @@ import abc
 import six
 
 
+class PersistenceError(Exception):
+    """Raised when records could not be written."""
+
+
+class PostClaimed(Exception):
+    """Raised when another worker currently holds the claim on a post."""
+
+
 @six.add_metaclass(abc.ABCMeta)
 class Persistence(object):
 
@@ -26,6 +34,86 @@ class Persistence(object):
     def finalize_post(self, praw_post, images):
         pass
 
+    @abc.abstractmethod
+    def has_post(self, post_id):
+        """Whether the post is finalized, without claiming it."""
+        pass
+
     @abc.abstractmethod
     def get_image(self, image_path):
         pass
+
+    @abc.abstractmethod
+    def get_images(self, image_paths):
+        pass
+
+    @abc.abstractmethod
+    def get_subreddit_state(self, subreddit_name):
+        """Return the crawl state of a subreddit, or None if never crawled.
+
+        The state is {'last_crawled', 'post_count', 'listings'}, listings
+        maps each query type crawled to its {'depth', 'new_posts'} as
+        recorded by record_crawl. Drivers that can't count the archived
+        posts cheaply give the total new_posts of every crawl as the
+        post_count.
+        """
+        pass
+
+    def has_subreddit(self, subreddit_name):
+        return self.get_subreddit_state(subreddit_name) is not None
+
+    @abc.abstractmethod
+    def get_watermark(self, subreddit_name, query_type):
+        """Return the newest {'created_utc', 'id'} crawled, or None."""
+        pass
+
+    @abc.abstractmethod
+    def set_watermark(self, subreddit_name, query_type, created_utc,
+                      post_id):
+        """Record a newer high-water mark, older marks are ignored."""
+        pass
+
+    @abc.abstractmethod
+    def record_crawl(self, subreddit_name, query_type, depth, new_posts):
+        """Record a crawl of a listing that looked at depth posts.
+
+        The depth of the latest crawl is kept, new_posts (the posts it found
+        that weren't archived) is added to the listing's total.
+        """
+        pass
+
+    def write_batch(self, images, posts):
+        """Write images and finalized (praw_post, images) pairs together."""
+        if images:
+            self.persist_images(images)
+        for praw_post, post_images in posts:
+            self.finalize_post(praw_post, post_images)
+
+    def after_flush(self, callback):
+        # Unbuffered drivers have written everything by the time they return
+        callback()
+
+    def flush(self):
+        pass
+
+    def flush_if_due(self):
+        pass
+
+    def scan_posts(self, segment=0, total_segments=1):
+        """Yield every finalized post as a plain dict.
+
+        Drivers that support parallel scans split the posts into
+        total_segments disjoint parts and only yield the given segment.
+        """
+        raise NotImplementedError()
+
+    def feed_posts(self, subreddit_name, after=None):
+        """Yield a subreddit's finalized posts, oldest first.
+
+        Only posts created at or after the `after` timestamp are yielded.
+        """
+        raise NotImplementedError()
+
+    def subreddit_names(self):
+        """Yield the name of every persisted subreddit."""
+        raise NotImplementedError()
@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+
+from archiver import clients
+from archiver import config
+from archiver import models
+from archiver.persistence import wrapper
+
+LOG = logging.getLogger(__name__)
+
+
+class BufferedPersistence(wrapper.WrappingPersistence):
+    """Write-behind buffer in front of another persistence driver.
+
+    Finalized posts and image records are collected across messages and
+    written with a single write_batch once buffer_size records are pending
+    or the oldest has waited buffer_latency seconds. Callbacks registered
+    with after_flush (the consumer's message acks) only run once the
+    records pending at registration time have been written.
+    """
+
+    def __init__(self, driver=None):
+        conf = config.get_config()
+        super(BufferedPersistence, self).__init__(
+            driver or clients.load_driver(conf.PERSISTENCE_BUFFER_DRIVER)())
+        self.max_records = conf.PERSISTENCE_BUFFER_SIZE
+        self.max_latency = conf.PERSISTENCE_BUFFER_LATENCY
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._images = {}
+        self._posts = []
+        self._callbacks = []
+        self._oldest = None
+
+    def _pending(self):
+        return len(self._images) + len(self._posts)
+
+    def persist_images(self, images):
+        with self._lock:
+            for image in images:
+                if 'path' in image:
+                    self._images[image['path']] = image
+            self._mark_pending()
+
+    def finalize_post(self, praw_post, images):
+        # Copy the fields now, a praw object may lazily fetch them later
+        post = models.Post.from_praw(praw_post)
+        with self._lock:
+            self._posts.append((post, images))
+            self._mark_pending()
+
+    def get_image(self, image_path):
+        with self._lock:
+            image = self._images.get(image_path)
+        return image or self.driver.get_image(image_path)
+
+    def get_images(self, image_paths):
+        with self._lock:
+            buffered = {path: self._images[path]
+                        for path in image_paths if path in self._images}
+        missing = [path for path in image_paths if path not in buffered]
+        images = self.driver.get_images(missing) if missing else {}
+        images.update(buffered)
+        return images
+
+    def after_flush(self, callback):
+        with self._lock:
+            if not self._pending():
+                run_now = True
+            else:
+                run_now = False
+                self._callbacks.append(callback)
+        if run_now:
+            callback()
+        self.flush_if_due()
+
+    def flush(self):
+        with self._lock:
+            images = list(self._images.values())
+            posts = self._posts
+            callbacks = self._callbacks
+            self._reset()
+            if images or posts:
+                LOG.info(u"Flushing %s images and %s posts.",
+                         len(images), len(posts))
+                # On failure the callbacks are dropped, so the messages are
+                # redelivered by the queue rather than acknowledged
+                self.driver.write_batch(images, posts)
+        for callback in callbacks:
+            callback()
+
+    def flush_if_due(self):
+        with self._lock:
+            due = self._pending() and (
+                self._pending() >= self.max_records or
+                time.time() - self._oldest >= self.max_latency)
+        if due:
+            self.flush()
+
+    def _mark_pending(self):
+        if self._oldest is None and self._pending():
+            self._oldest = time.time()
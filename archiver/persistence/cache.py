@@ -0,0 +1,139 @@
+import collections
+import threading
+import time
+
+from archiver import clients
+from archiver import config
+from archiver.persistence import wrapper
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires, value = entry
+            if expires < time.time():
+                return default
+            # Re-insert to mark the entry as most recently used
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self.ttl, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CachingPersistence(wrapper.WrappingPersistence):
+    """Read-through cache in front of another persistence driver.
+
+    Only positive existence lookups are cached, and every write goes to the
+    wrapped driver before updating the cache, so a hit never hides a write.
+    Subreddit state is cached either way and expires with the TTL.
+    """
+
+    def __init__(self, driver=None):
+        conf = config.get_config()
+        super(CachingPersistence, self).__init__(
+            driver or clients.load_driver(conf.PERSISTENCE_CACHE_DRIVER)())
+        self.cache = LRUCache(conf.PERSISTENCE_CACHE_SIZE,
+                              conf.PERSISTENCE_CACHE_TTL)
+
+    def persist_subreddit(self, praw_subreddit):
+        # Always a single write (it records the crawl time), no read to save
+        self.driver.persist_subreddit(praw_subreddit)
+        self.cache.invalidate(('subreddit', praw_subreddit.display_name))
+
+    def get_subreddit_state(self, subreddit_name):
+        key = ('subreddit', subreddit_name)
+        state = self.cache.get(key, _MISSING)
+        if state is _MISSING:
+            state = self.driver.get_subreddit_state(subreddit_name)
+            self.cache.set(key, state)
+        return state
+
+    def record_crawl(self, subreddit_name, query_type, depth, new_posts):
+        self.driver.record_crawl(subreddit_name, query_type, depth,
+                                 new_posts)
+        self.cache.invalidate(('subreddit', subreddit_name))
+
+    def persist_images(self, images):
+        self.driver.persist_images(images)
+        for image in images:
+            if 'path' in image:
+                self.cache.set(('image', image['path']), image)
+
+    def persist_post(self, praw_post):
+        key = ('post', praw_post.id)
+        if self.cache.get(key):
+            return True
+        existed = self.driver.persist_post(praw_post)
+        if existed:
+            self.cache.set(key, True)
+        return existed
+
+    def finalize_post(self, praw_post, images):
+        self.driver.finalize_post(praw_post, images)
+        self.cache.set(('post', praw_post.id), True)
+        self.cache.invalidate(('subreddit', praw_post.subreddit.display_name))
+
+    def has_post(self, post_id):
+        key = ('post', post_id)
+        if self.cache.get(key):
+            return True
+        existed = self.driver.has_post(post_id)
+        if existed:
+            self.cache.set(key, True)
+        return existed
+
+    def get_image(self, image_path):
+        key = ('image', image_path)
+        image = self.cache.get(key)
+        if image is None:
+            image = self.driver.get_image(image_path)
+            if image:
+                self.cache.set(key, image)
+        return image
+
+    def get_images(self, image_paths):
+        images = {}
+        missing = []
+        for path in image_paths:
+            image = self.cache.get(('image', path))
+            if image is None:
+                missing.append(path)
+            else:
+                images[path] = image
+        if missing:
+            found = self.driver.get_images(missing)
+            for path, image in found.items():
+                self.cache.set(('image', path), image)
+            images.update(found)
+        return images
+
+    def write_batch(self, images, posts):
+        self.driver.write_batch(images, posts)
+        for image in images:
+            if 'path' in image:
+                self.cache.set(('image', image['path']), image)
+        for praw_post, _ in posts:
+            self.cache.set(('post', praw_post.id), True)
@@ -1,13 +1,34 @@
+import calendar
+import collections
 import datetime
+import logging
 import time
 
+from botocore import exceptions as boto_exceptions
+
 from archiver import clients
+from archiver import config
+from archiver import constants
 from archiver.persistence import base as base_persistence
+from archiver.persistence import encoding
+
+LOG = logging.getLogger(__name__)
 
 SUBREDDIT_TABLE = 'subreddits'
 POST_TABLE = 'posts'
 IMAGE_TABLE = 'images'
 
+# Gallery feed: posts per subreddit, newest first
+FEED_INDEX = 'subreddit-created-index'
+FEED_ATTRIBUTES = ['title', 'permalink', 'user', 'images', 'nsfw']
+
+# BatchGetItem accepts at most 100 keys and BatchWriteItem 25 items
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+BATCH_RETRY_LIMIT = 8
+BATCH_RETRY_DELAY = 0.05
+INDEX_POLL_DELAY = 20
+
 TABLE_DEFINITIONS = {
     SUBREDDIT_TABLE: {
         'TableName': SUBREDDIT_TABLE,
@@ -40,6 +61,37 @@ TABLE_DEFINITIONS = {
             {
                 'AttributeName': 'id',
                 'AttributeType': 'S'
+            },
+            {
+                'AttributeName': 'subreddit',
+                'AttributeType': 'S'
+            },
+            {
+                'AttributeName': 'created_utc',
+                'AttributeType': 'N'
+            }
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': FEED_INDEX,
+                'KeySchema': [
+                    {
+                        'AttributeName': 'subreddit',
+                        'KeyType': 'HASH'  # Partition key
+                    },
+                    {
+                        'AttributeName': 'created_utc',
+                        'KeyType': 'RANGE'  # Sort key
+                    }
+                ],
+                'Projection': {
+                    'ProjectionType': 'INCLUDE',
+                    'NonKeyAttributes': FEED_ATTRIBUTES
+                },
+                'ProvisionedThroughput': {
+                    'ReadCapacityUnits': 10,
+                    'WriteCapacityUnits': 2
+                }
             }
         ],
         'ProvisionedThroughput': {
@@ -69,34 +121,184 @@ TABLE_DEFINITIONS = {
 }
 
 
+def _parse_created(created):
+    # Older posts only stored str(datetime), with or without microseconds
+    fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in created else '%Y-%m-%d %H:%M:%S'
+    created = datetime.datetime.strptime(created, fmt)
+    return calendar.timegm(created.utctimetuple())
+
+
+def _post_record(item):
+    created_utc = item.get('created_utc')
+    if created_utc is None and item.get('created'):
+        created_utc = _parse_created(item['created'])
+    return {
+        'id': item['id'],
+        'subreddit': item.get('subreddit'),
+        'created_utc': int(created_utc) if created_utc is not None else None,
+        'title': item.get('title'),
+        'permalink': item.get('permalink'),
+        'url': item.get('url'),
+        'user': item.get('user'),
+        'nsfw': item.get('nsfw'),
+        'images': encoding.decode_images(item.get('images')) or []
+    }
+
+
+def _depth_attribute(query_type):
+    return 'depth_' + query_type
+
+
+def _new_posts_attribute(query_type):
+    return 'new_posts_' + query_type
+
+
+def _subreddit_state(item):
+    last_crawled = item.get('last_crawled')
+    listings = {}
+    for query_type in constants.QUERY_TYPES:
+        depth = item.get(_depth_attribute(query_type))
+        if depth is not None:
+            listings[query_type] = {
+                'depth': int(depth),
+                'new_posts': int(item.get(_new_posts_attribute(query_type),
+                                          0))
+            }
+    return {
+        'last_crawled': int(last_crawled) if last_crawled else None,
+        'post_count': int(item.get('post_count', 0)),
+        'listings': listings
+    }
+
+
+def _watermark_attribute(query_type):
+    return 'watermark_' + query_type
+
+
+def _same_index(index, wanted):
+    projection = index.get('Projection', {})
+    return (index['KeySchema'] == wanted['KeySchema'] and
+            projection.get('ProjectionType') ==
+            wanted['Projection']['ProjectionType'] and
+            set(projection.get('NonKeyAttributes', [])) ==
+            set(wanted['Projection']['NonKeyAttributes']))
+
+
+def _condition_failed(error):
+    return (error.response['Error']['Code'] ==
+            'ConditionalCheckFailedException')
+
+
 class DynamoPersistence(base_persistence.Persistence):
     tables = None
 
     def __init__(self):
+        conf = config.get_config()
+        self.claim_lease = conf.PERSISTENCE_CLAIM_LEASE
+        self.compact_images = conf.PERSISTENCE_COMPACT_IMAGES
+        self.inline_image_details = conf.PERSISTENCE_INLINE_IMAGE_DETAILS
         self.db = clients.get_session().resource('dynamodb')
-        self.tables = {x.name: x for x in self.db.tables.all()}
-        self._ensure_tables_exist()
+        # Table resources are lazy, so building them costs no requests
+        self.tables = {t: self.db.Table(t) for t in TABLE_DEFINITIONS}
+        if conf.PERSISTENCE_ENSURE_TABLES:
+            self._ensure_tables_exist()
 
     def _ensure_tables_exist(self):
-        created_tables = False
+        client = self.db.meta.client
+        created_tables = []
         for t in TABLE_DEFINITIONS:
-            if t not in self.tables:
-                self.tables[t] = self.db.create_table(**TABLE_DEFINITIONS[t])
-                created_tables = True
-        if created_tables:
-            # DynamoDB tables take a moment to propagate (or we get 400s)
-            time.sleep(10)
+            try:
+                client.describe_table(TableName=t)
+                continue
+            except boto_exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                    raise
+            LOG.info(u"Creating missing DynamoDB table: %s", t)
+            try:
+                self.db.create_table(**TABLE_DEFINITIONS[t])
+            except boto_exceptions.ClientError as e:
+                # Another worker got there first, wait for it all the same
+                if e.response['Error']['Code'] != 'ResourceInUseException':
+                    raise
+            created_tables.append(t)
+        # DynamoDB tables take a moment to become ACTIVE (or we get 400s)
+        waiter = client.get_waiter('table_exists')
+        for t in created_tables:
+            waiter.wait(TableName=t)
 
     def persist_subreddit(self, praw_subreddit):
-        data = {
-            'id': praw_subreddit.id,
-            'name': praw_subreddit.display_name,
-            'title': praw_subreddit.title,
-        }
-        sub = self.tables[SUBREDDIT_TABLE].get_item(Key={'name': praw_subreddit.display_name})
+        # A single upsert that also records when the subreddit was crawled
+        self.tables[SUBREDDIT_TABLE].update_item(
+            Key={'name': praw_subreddit.display_name},
+            UpdateExpression=('SET #id = :id, #title = :title, '
+                              'last_crawled = :now'),
+            ExpressionAttributeNames={'#id': 'id', '#title': 'title'},
+            ExpressionAttributeValues={
+                ':id': praw_subreddit.id,
+                ':title': praw_subreddit.title,
+                ':now': int(time.time())
+            }
+        )
+
+    def get_subreddit_state(self, subreddit_name):
+        attributes = ['last_crawled', 'post_count']
+        for query_type in constants.QUERY_TYPES:
+            attributes += [_depth_attribute(query_type),
+                           _new_posts_attribute(query_type)]
+        sub = self.tables[SUBREDDIT_TABLE].get_item(
+            Key={'name': subreddit_name},
+            ProjectionExpression=', '.join(attributes)
+        )
         if 'Item' not in sub:
-            print("sub not found: %s" % praw_subreddit.display_name)
-            self.tables[SUBREDDIT_TABLE].put_item(Item=data)
+            return None
+        return _subreddit_state(sub['Item'])
+
+    def get_watermark(self, subreddit_name, query_type):
+        attribute = _watermark_attribute(query_type)
+        sub = self.tables[SUBREDDIT_TABLE].get_item(
+            Key={'name': subreddit_name},
+            ProjectionExpression='#mark',
+            ExpressionAttributeNames={'#mark': attribute}
+        )
+        mark = sub.get('Item', {}).get(attribute)
+        if not mark:
+            return None
+        return {'created_utc': int(mark['created_utc']), 'id': mark['id']}
+
+    def set_watermark(self, subreddit_name, query_type, created_utc,
+                      post_id):
+        created_utc = int(created_utc)
+        try:
+            # Only ever move the mark forward, crawls can finish out of order
+            self.tables[SUBREDDIT_TABLE].update_item(
+                Key={'name': subreddit_name},
+                UpdateExpression='SET #mark = :mark',
+                ConditionExpression=('attribute_not_exists(#mark) OR '
+                                     '#mark.created_utc < :created'),
+                ExpressionAttributeNames={
+                    '#mark': _watermark_attribute(query_type)},
+                ExpressionAttributeValues={
+                    ':mark': {'created_utc': created_utc, 'id': post_id},
+                    ':created': created_utc
+                }
+            )
+        except boto_exceptions.ClientError as e:
+            if not _condition_failed(e):
+                raise
+
+    def record_crawl(self, subreddit_name, query_type, depth, new_posts):
+        # One write per crawl, not per post. post_count counts the posts
+        # crawls found new, rather than touching the subreddit for every
+        # archived post or counting the feed index on every read.
+        self.tables[SUBREDDIT_TABLE].update_item(
+            Key={'name': subreddit_name},
+            UpdateExpression=('SET #depth = :depth '
+                              'ADD #new :new, post_count :new'),
+            ExpressionAttributeNames={
+                '#depth': _depth_attribute(query_type),
+                '#new': _new_posts_attribute(query_type)},
+            ExpressionAttributeValues={':depth': depth, ':new': new_posts}
+        )
 
     def persist_user(self, praw_user):
         pass
@@ -108,19 +310,99 @@ class DynamoPersistence(base_persistence.Persistence):
                     batch.put_item(Item=i)
 
     def persist_post(self, praw_post):
-        # Only check to see if the post existed already
-        post = self.tables[POST_TABLE].get_item(Key={'id': praw_post.id})
-        if 'Item' in post:
-            return True
-        return False
+        # Claim the post with a lease so only one worker processes it. The
+        # claim is replaced by the full item in finalize_post.
+        now = int(time.time())
+        try:
+            self.tables[POST_TABLE].put_item(
+                Item={'id': praw_post.id,
+                      'claimed_until': now + self.claim_lease},
+                ConditionExpression=('attribute_not_exists(id) OR '
+                                     'claimed_until < :now'),
+                ExpressionAttributeValues={':now': now}
+            )
+            return False
+        except boto_exceptions.ClientError as e:
+            if not _condition_failed(e):
+                raise
+        post = self.tables[POST_TABLE].get_item(
+            Key={'id': praw_post.id}, ProjectionExpression='claimed_until')
+        if 'claimed_until' in post.get('Item', {}):
+            raise base_persistence.PostClaimed(praw_post.id)
+        return True
+
+    def has_post(self, post_id):
+        post = self.tables[POST_TABLE].get_item(
+            Key={'id': post_id}, ProjectionExpression='id, claimed_until')
+        item = post.get('Item')
+        # Claimed posts are still being processed by a worker
+        return bool(item) and 'claimed_until' not in item
 
     def get_image(self, image_path):
         image = self.tables[IMAGE_TABLE].get_item(Key={'path': image_path})
         return image.get('Item')
 
+    def get_images(self, image_paths):
+        paths = list(set(image_paths))
+        images = {}
+        for start in range(0, len(paths), BATCH_GET_SIZE):
+            request = {IMAGE_TABLE: {'Keys': [
+                {'path': path}
+                for path in paths[start:start + BATCH_GET_SIZE]
+            ]}}
+            for attempt in range(BATCH_RETRY_LIMIT):
+                resp = self.db.batch_get_item(RequestItems=request)
+                for image in resp.get('Responses', {}).get(IMAGE_TABLE, []):
+                    images[image['path']] = image
+                request = resp.get('UnprocessedKeys')
+                if not request:
+                    break
+                # Throttled keys come back unprocessed, back off and retry
+                time.sleep(BATCH_RETRY_DELAY * 2 ** attempt)
+            else:
+                # Anything left over is treated as missing and re-downloaded
+                LOG.warning(u"Giving up on %s unprocessed image keys.",
+                            len(request[IMAGE_TABLE]['Keys']))
+        return images
+
+    def write_batch(self, images, posts):
+        # Duplicate keys in one BatchWriteItem are rejected, keep the last
+        items = collections.OrderedDict()
+        for image in images:
+            if 'path' in image:
+                items[(IMAGE_TABLE, image['path'])] = image
+        for praw_post, post_images in posts:
+            items[(POST_TABLE, praw_post.id)] = self._post_item(
+                praw_post, post_images)
+        items = list(items.items())
+
+        for start in range(0, len(items), BATCH_WRITE_SIZE):
+            request = {}
+            for (table, _), item in items[start:start + BATCH_WRITE_SIZE]:
+                request.setdefault(table, []).append(
+                    {'PutRequest': {'Item': item}})
+            for attempt in range(BATCH_RETRY_LIMIT):
+                resp = self.db.batch_write_item(RequestItems=request)
+                request = resp.get('UnprocessedItems')
+                if not request:
+                    break
+                time.sleep(BATCH_RETRY_DELAY * 2 ** attempt)
+            else:
+                raise base_persistence.PersistenceError(
+                    "Unable to write {num} items after {tries} attempts"
+                    .format(num=sum(len(r) for r in request.values()),
+                            tries=BATCH_RETRY_LIMIT))
+
     def finalize_post(self, praw_post, images):
+        self.tables[POST_TABLE].put_item(
+            Item=self._post_item(praw_post, images))
+
+    def _post_item(self, praw_post, images):
         created = datetime.datetime.utcfromtimestamp(praw_post.created_utc)
-        data = {
+        if self.compact_images:
+            images = encoding.encode_images(
+                images, details=self.inline_image_details)
+        return {
             'id': praw_post.id,
             'title': praw_post.title,
             'permalink': praw_post.permalink,
@@ -129,6 +411,108 @@ class DynamoPersistence(base_persistence.Persistence):
             'images': images,
             'nsfw': praw_post.over_18,
             'created': str(created),
+            'created_utc': int(praw_post.created_utc),
             'subreddit': praw_post.subreddit.display_name
         }
-        self.tables[POST_TABLE].put_item(Item=data)
+
+    def scan_posts(self, segment=0, total_segments=1):
+        kwargs = {
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            # Skips claim placeholders for posts that are still in progress
+            'FilterExpression': 'attribute_exists(subreddit)'
+        }
+        while True:
+            resp = self.tables[POST_TABLE].scan(**kwargs)
+            for item in resp['Items']:
+                yield _post_record(item)
+            if 'LastEvaluatedKey' not in resp:
+                break
+            kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+    def feed_posts(self, subreddit_name, after=None):
+        kwargs = {
+            'IndexName': FEED_INDEX,
+            'KeyConditionExpression': 'subreddit = :name',
+            'ExpressionAttributeValues': {':name': subreddit_name},
+            'ScanIndexForward': True
+        }
+        if after is not None:
+            kwargs['KeyConditionExpression'] += ' AND created_utc >= :after'
+            kwargs['ExpressionAttributeValues'][':after'] = int(after)
+        while True:
+            resp = self.tables[POST_TABLE].query(**kwargs)
+            for item in resp['Items']:
+                yield _post_record(item)
+            if 'LastEvaluatedKey' not in resp:
+                break
+            kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+    def subreddit_names(self):
+        kwargs = {
+            'ProjectionExpression': '#name',
+            # "name" is a reserved word in expressions
+            'ExpressionAttributeNames': {'#name': 'name'}
+        }
+        while True:
+            resp = self.tables[SUBREDDIT_TABLE].scan(**kwargs)
+            for item in resp['Items']:
+                yield item['name']
+            if 'LastEvaluatedKey' not in resp:
+                break
+            kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+    def migrate_feed_index(self):
+        """Backfill created_utc and (re)build the gallery feed index."""
+        self._backfill_created_utc()
+
+        client = self.db.meta.client
+        wanted = TABLE_DEFINITIONS[POST_TABLE]['GlobalSecondaryIndexes'][0]
+        index = self._describe_feed_index()
+        if index and not _same_index(index, wanted):
+            LOG.info(u"Replacing outdated index: %s", FEED_INDEX)
+            client.update_table(
+                TableName=POST_TABLE,
+                GlobalSecondaryIndexUpdates=[
+                    {'Delete': {'IndexName': FEED_INDEX}}]
+            )
+            while self._describe_feed_index():
+                time.sleep(INDEX_POLL_DELAY)
+            index = None
+        if not index:
+            LOG.info(u"Creating index: %s", FEED_INDEX)
+            client.update_table(
+                TableName=POST_TABLE,
+                AttributeDefinitions=(
+                    TABLE_DEFINITIONS[POST_TABLE]['AttributeDefinitions']),
+                GlobalSecondaryIndexUpdates=[{'Create': wanted}]
+            )
+        while self._describe_feed_index().get('IndexStatus') != 'ACTIVE':
+            time.sleep(INDEX_POLL_DELAY)
+
+    def _describe_feed_index(self):
+        table = self.db.meta.client.describe_table(TableName=POST_TABLE)
+        for index in table['Table'].get('GlobalSecondaryIndexes', []):
+            if index['IndexName'] == FEED_INDEX:
+                return index
+        return {}
+
+    def _backfill_created_utc(self):
+        paginator = self.db.meta.client.get_paginator('scan')
+        pages = paginator.paginate(
+            TableName=POST_TABLE,
+            ProjectionExpression='id, created',
+            FilterExpression=('attribute_exists(created) AND '
+                              'attribute_not_exists(created_utc)')
+        )
+        count = 0
+        for page in pages:
+            for item in page['Items']:
+                self.tables[POST_TABLE].update_item(
+                    Key={'id': item['id']['S']},
+                    UpdateExpression='SET created_utc = :created',
+                    ExpressionAttributeValues={
+                        ':created': _parse_created(item['created']['S'])}
+                )
+                count += 1
+        LOG.info(u"Backfilled created_utc on %s posts.", count)
@@ -0,0 +1,91 @@
+"""Compact encoding for the image list stored on post records.
+
+Encoded form (mirrored by decodeImages in client/web/tweench.js)::
+
+    {
+        "v": 1,
+        "p": ["http://i.imgur.com/", ...],
+        "i": [[prefix, name, hash, [height, width], [color, ...]], ...]
+    }
+
+Each entry in "i" stands for one image: its url is ``p[prefix] + name`` and
+its path (the key of the images table) is ``hash + "/" + name``. Colors are
+packed as ``rgb << 7 | prominence``. Trailing nulls are dropped, hash is
+null for images that could not be downloaded, and dimensions and colors are
+only present when details are inlined. Images that don't fit this shape
+are stored as their original dict.
+"""
+
+VERSION = 1
+
+_KEYS = frozenset(['url', 'path', 'dimensions', 'colors'])
+
+
+def pack_color(color):
+    return (int(color['value'].lstrip('#'), 16) << 7 |
+            min(int(color['prominence']), 127))
+
+
+def unpack_color(packed):
+    packed = int(packed)
+    return {'value': '#{:06x}'.format(packed >> 7),
+            'prominence': packed & 127}
+
+
+def _encode_image(image, prefixes, details):
+    url = image.get('url')
+    if not url or not _KEYS.issuperset(image):
+        return image
+    name = url.split('/')[-1]
+    path_hash = None
+    if image.get('path'):
+        path_hash, _, path_name = image['path'].rpartition('/')
+        if path_name != name or not path_hash:
+            return image
+    prefix = url[:len(url) - len(name)]
+    if prefix not in prefixes:
+        prefixes[prefix] = len(prefixes)
+
+    entry = [prefixes[prefix], name, path_hash, None, None]
+    if details:
+        dimensions = image.get('dimensions')
+        if dimensions:
+            entry[3] = [dimensions['height'], dimensions['width']]
+        if image.get('colors'):
+            entry[4] = [pack_color(c) for c in image['colors']]
+    while entry[-1] is None:
+        entry.pop()
+    return entry
+
+
+def encode_images(images, details=True):
+    prefixes = {}
+    entries = [_encode_image(image, prefixes, details) for image in images]
+    return {
+        'v': VERSION,
+        'p': sorted(prefixes, key=prefixes.get),
+        'i': entries
+    }
+
+
+def _decode_image(entry, prefixes):
+    if isinstance(entry, dict):
+        return entry
+    entry = list(entry) + [None] * (5 - len(entry))
+    prefix, name, path_hash, dimensions, colors = entry
+    image = {'url': prefixes[int(prefix)] + name}
+    if path_hash:
+        image['path'] = u'{}/{}'.format(path_hash, name)
+    if dimensions:
+        image['dimensions'] = {'height': int(dimensions[0]),
+                               'width': int(dimensions[1])}
+    if colors:
+        image['colors'] = [unpack_color(c) for c in colors]
+    return image
+
+
+def decode_images(data):
+    # Posts written before the compact encoding hold a plain list
+    if data is None or isinstance(data, list):
+        return data
+    return [_decode_image(entry, data['p']) for entry in data['i']]
@@ -2,7 +2,6 @@ import logging
 
 from archiver.persistence import base as base_persistence
 
-logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger(__name__)
 
 
@@ -16,20 +15,17 @@ class LoggingPersistence(base_persistence.Persistence):
             'name': praw_subreddit.display_name,
             'title': praw_subreddit.title,
         }
-        LOG.info("Persisting subreddit to DB: {subreddit}"
-                 .format(subreddit=data))
+        LOG.info("Persisting subreddit to DB: %s", data)
 
     def persist_user(self, praw_user):
         data = {
             'id': praw_user.id,
             'name': praw_user.name
         }
-        LOG.info("Persisting user to DB: {user}"
-                 .format(user=data))
+        LOG.info("Persisting user to DB: %s", data)
 
     def persist_images(self, images):
-        LOG.info("Got {num} images, persisting them."
-                 .format(num=len(images)))
+        LOG.info("Got %s images, persisting them.", len(images))
 
     def persist_post(self, praw_post):
         data = {
@@ -39,13 +35,38 @@ class LoggingPersistence(base_persistence.Persistence):
             'url': praw_post.url,
             'retrieved': False
         }
-        LOG.info("Persisting post to DB: {post}"
-                 .format(post=data))
+        LOG.info("Persisting post to DB: %s", data)
 
     def finalize_post(self, praw_post, images):
-        LOG.info("Marking post as retrieved: {post}"
-                 .format(post=praw_post.permalink))
+        LOG.info("Marking post as retrieved: %s", praw_post.permalink)
+
+    def has_post(self, post_id):
+        LOG.info("Checking if post exists in persistence layer, returning "
+                 "False for compatibility: %s", post_id)
+        return False
 
     def get_image(self, image_path):
         LOG.info("Checking if image exists in persistence layer, returning "
-                 "None for compatibility: {path}".format(path=image_path))
+                 "None for compatibility: %s", image_path)
+
+    def get_images(self, image_paths):
+        LOG.info("Checking if %s images exist in persistence layer, "
+                 "returning nothing for compatibility.", len(image_paths))
+        return {}
+
+    def get_subreddit_state(self, subreddit_name):
+        LOG.info("Checking subreddit state in persistence layer, returning "
+                 "None for compatibility: %s", subreddit_name)
+
+    def get_watermark(self, subreddit_name, query_type):
+        LOG.info("Checking crawl watermark in persistence layer, returning "
+                 "None for compatibility: %s %s", subreddit_name, query_type)
+
+    def set_watermark(self, subreddit_name, query_type, created_utc,
+                      post_id):
+        LOG.info("Persisting crawl watermark to DB: %s %s %s %s",
+                 subreddit_name, query_type, created_utc, post_id)
+
+    def record_crawl(self, subreddit_name, query_type, depth, new_posts):
+        LOG.info("Persisting listing crawl to DB: %s %s %s %s",
+                 subreddit_name, query_type, depth, new_posts)
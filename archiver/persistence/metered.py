@@ -0,0 +1,37 @@
+from archiver import clients
+from archiver import config
+from archiver import metrics
+from archiver.persistence import wrapper
+
+# Calls timed as "persistence.<name>" stages; the scans and feed_posts
+# return generators and after_flush only registers a callback, none of
+# them are worth it
+METERED_CALLS = [
+    'persist_subreddit', 'persist_user', 'persist_images', 'persist_post',
+    'finalize_post', 'has_post', 'get_image', 'get_images',
+    'get_subreddit_state', 'get_watermark', 'set_watermark', 'record_crawl',
+    'write_batch', 'flush', 'flush_if_due',
+]
+
+
+def _metered(name):
+    stage = 'persistence.' + name
+
+    def call(self, *args, **kwargs):
+        with metrics.stage(stage):
+            return getattr(self.driver, name)(*args, **kwargs)
+    call.__name__ = name
+    return call
+
+
+class MeteredPersistence(wrapper.WrappingPersistence):
+    """Records the latency and outcome of every call to metered_driver."""
+
+    def __init__(self, driver=None):
+        conf = config.get_config()
+        super(MeteredPersistence, self).__init__(
+            driver or clients.load_driver(conf.PERSISTENCE_METERED_DRIVER)())
+
+
+for _name in METERED_CALLS:
+    setattr(MeteredPersistence, _name, _metered(_name))
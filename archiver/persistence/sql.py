@@ -1,21 +1,279 @@
+import json
+import sqlite3
+import time
+
+from archiver import config
 from archiver.persistence import base as base_persistence
 
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS subreddits ("
+    "  name TEXT PRIMARY KEY,"
+    "  id TEXT,"
+    "  title TEXT"
+    ")",
+    "CREATE TABLE IF NOT EXISTS subreddit_crawls ("
+    "  name TEXT PRIMARY KEY,"
+    "  last_crawled INTEGER"
+    ")",
+    "CREATE TABLE IF NOT EXISTS subreddit_watermarks ("
+    "  name TEXT,"
+    "  query_type TEXT,"
+    "  created INTEGER,"
+    "  post_id TEXT,"
+    "  PRIMARY KEY (name, query_type)"
+    ")",
+    "CREATE TABLE IF NOT EXISTS subreddit_listings ("
+    "  name TEXT,"
+    "  query_type TEXT,"
+    "  depth INTEGER,"
+    "  new_posts INTEGER DEFAULT 0,"
+    "  PRIMARY KEY (name, query_type)"
+    ")",
+    "CREATE TABLE IF NOT EXISTS users ("
+    "  name TEXT PRIMARY KEY"
+    ")",
+    "CREATE TABLE IF NOT EXISTS posts ("
+    "  id TEXT PRIMARY KEY,"
+    "  subreddit TEXT,"
+    "  created INTEGER,"
+    "  title TEXT,"
+    "  permalink TEXT,"
+    "  url TEXT,"
+    "  user TEXT,"
+    "  nsfw INTEGER,"
+    "  images TEXT"
+    ")",
+    "CREATE TABLE IF NOT EXISTS images ("
+    "  path TEXT PRIMARY KEY,"
+    "  url TEXT,"
+    "  dimensions TEXT,"
+    "  colors TEXT"
+    ")",
+    # Post id and image path are covered by their primary key indexes
+    "CREATE INDEX IF NOT EXISTS posts_subreddit_created "
+    "ON posts (subreddit, created)",
+)
+
+# Statements are kept as constants so sqlite3's statement cache can reuse
+# the prepared versions for every call.
+INSERT_SUBREDDIT = (
+    "INSERT OR IGNORE INTO subreddits (name, id, title) VALUES (?, ?, ?)")
+INSERT_CRAWL = (
+    "INSERT OR REPLACE INTO subreddit_crawls (name, last_crawled) "
+    "VALUES (?, ?)")
+INSERT_WATERMARK = (
+    "INSERT OR IGNORE INTO subreddit_watermarks "
+    "(name, query_type, created, post_id) VALUES (?, ?, ?, ?)")
+UPDATE_WATERMARK = (
+    "UPDATE subreddit_watermarks SET created = ?, post_id = ? "
+    "WHERE name = ? AND query_type = ? AND created < ?")
+INSERT_LISTING = (
+    "INSERT OR IGNORE INTO subreddit_listings (name, query_type) "
+    "VALUES (?, ?)")
+UPDATE_LISTING = (
+    "UPDATE subreddit_listings SET depth = ?, new_posts = new_posts + ? "
+    "WHERE name = ? AND query_type = ?")
+INSERT_USER = "INSERT OR IGNORE INTO users (name) VALUES (?)"
+INSERT_IMAGE = (
+    "INSERT OR REPLACE INTO images (path, url, dimensions, colors) "
+    "VALUES (?, ?, ?, ?)")
+INSERT_POST = (
+    "INSERT OR REPLACE INTO posts (id, subreddit, created, title, permalink, "
+    "url, user, nsfw, images) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+SELECT_SUBREDDIT_STATE = (
+    "SELECT s.name, c.last_crawled, "
+    "  (SELECT COUNT(*) FROM posts p WHERE p.subreddit = s.name) "
+    "FROM subreddits s LEFT JOIN subreddit_crawls c ON c.name = s.name "
+    "WHERE s.name = ?")
+SELECT_WATERMARK = (
+    "SELECT created, post_id FROM subreddit_watermarks "
+    "WHERE name = ? AND query_type = ?")
+SELECT_LISTINGS = (
+    "SELECT query_type, depth, new_posts FROM subreddit_listings "
+    "WHERE name = ?")
+SELECT_POST = "SELECT 1 FROM posts WHERE id = ?"
+SELECT_IMAGE = (
+    "SELECT path, url, dimensions, colors FROM images WHERE path = ?")
+SELECT_IMAGES = (
+    "SELECT path, url, dimensions, colors FROM images WHERE path IN ({})")
+SCAN_POSTS = (
+    "SELECT id, subreddit, created, title, permalink, url, user, nsfw, "
+    "images FROM posts WHERE rowid % ? = ?")
+FEED_POSTS = (
+    "SELECT id, subreddit, created, title, permalink, url, user, nsfw, "
+    "images FROM posts WHERE subreddit = ? AND created >= ? "
+    "ORDER BY created, id")
+SELECT_SUBREDDIT_NAMES = "SELECT name FROM subreddits"
+
+# Stay well below SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds
+SELECT_BATCH_SIZE = 500
+
+
+def _post_from_row(row):
+    (post_id, subreddit, created, title, permalink, url, user, nsfw,
+     images) = row
+    return {
+        'id': post_id,
+        'subreddit': subreddit,
+        'created_utc': created,
+        'title': title,
+        'permalink': permalink,
+        'url': url,
+        'user': user,
+        'nsfw': bool(nsfw),
+        'images': json.loads(images) if images else []
+    }
+
+
+def _image_from_row(row):
+    path, url, dimensions, colors = row
+    return {
+        'path': path,
+        'url': url,
+        'dimensions': json.loads(dimensions) if dimensions else None,
+        'colors': json.loads(colors) if colors else None
+    }
+
 
 class SqlPersistence(base_persistence.Persistence):
+    def __init__(self, database=None):
+        conf = config.get_config()
+        self.database = database or conf.PERSISTENCE_SQL_DATABASE
+        self.conn = sqlite3.connect(self.database, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+
     def persist_subreddit(self, praw_subreddit):
-        raise NotImplementedError()
+        with self.conn:
+            self.conn.execute(INSERT_SUBREDDIT, (praw_subreddit.display_name,
+                                                 praw_subreddit.id,
+                                                 praw_subreddit.title))
+            self.conn.execute(INSERT_CRAWL, (praw_subreddit.display_name,
+                                             int(time.time())))
+
+    def get_subreddit_state(self, subreddit_name):
+        row = self.conn.execute(
+            SELECT_SUBREDDIT_STATE, (subreddit_name,)).fetchone()
+        if not row:
+            return None
+        listings = {
+            query_type: {'depth': depth, 'new_posts': new_posts}
+            for query_type, depth, new_posts in self.conn.execute(
+                SELECT_LISTINGS, (subreddit_name,))}
+        return {'last_crawled': row[1], 'post_count': row[2],
+                'listings': listings}
+
+    def get_watermark(self, subreddit_name, query_type):
+        row = self.conn.execute(
+            SELECT_WATERMARK, (subreddit_name, query_type)).fetchone()
+        if not row:
+            return None
+        return {'created_utc': row[0], 'id': row[1]}
+
+    def set_watermark(self, subreddit_name, query_type, created_utc,
+                      post_id):
+        created_utc = int(created_utc)
+        with self.conn:
+            self.conn.execute(INSERT_WATERMARK, (subreddit_name, query_type,
+                                                 created_utc, post_id))
+            self.conn.execute(UPDATE_WATERMARK, (created_utc, post_id,
+                                                 subreddit_name, query_type,
+                                                 created_utc))
+
+    def record_crawl(self, subreddit_name, query_type, depth, new_posts):
+        with self.conn:
+            self.conn.execute(INSERT_LISTING, (subreddit_name, query_type))
+            self.conn.execute(UPDATE_LISTING, (depth, new_posts,
+                                               subreddit_name, query_type))
 
     def persist_user(self, praw_user):
-        raise NotImplementedError()
+        if not praw_user:
+            return
+        with self.conn:
+            self.conn.execute(INSERT_USER, (praw_user.name,))
 
     def persist_images(self, images):
-        raise NotImplementedError()
+        rows = [(i['path'], i.get('url'),
+                 json.dumps(i.get('dimensions')) if i.get('dimensions')
+                 else None,
+                 json.dumps(i.get('colors')) if i.get('colors') else None)
+                for i in images if 'path' in i]
+        with self.conn:
+            self.conn.executemany(INSERT_IMAGE, rows)
 
     def persist_post(self, praw_post):
-        raise NotImplementedError()
+        # Only check to see if the post existed already
+        return self.conn.execute(
+            SELECT_POST, (praw_post.id,)).fetchone() is not None
+
+    def has_post(self, post_id):
+        return self.conn.execute(
+            SELECT_POST, (post_id,)).fetchone() is not None
 
     def finalize_post(self, praw_post, images):
-        raise NotImplementedError()
+        with self.conn:
+            self.conn.execute(INSERT_POST, (
+                praw_post.id,
+                praw_post.subreddit.display_name,
+                int(praw_post.created_utc),
+                praw_post.title,
+                praw_post.permalink,
+                praw_post.url,
+                praw_post.author.name if praw_post.author else None,
+                1 if praw_post.over_18 else 0,
+                json.dumps(images)
+            ))
+
+    def get_image(self, image_path):
+        row = self.conn.execute(SELECT_IMAGE, (image_path,)).fetchone()
+        return _image_from_row(row) if row else None
+
+    def get_images(self, image_paths):
+        paths = list(set(image_paths))
+        images = {}
+        for start in range(0, len(paths), SELECT_BATCH_SIZE):
+            batch = paths[start:start + SELECT_BATCH_SIZE]
+            statement = SELECT_IMAGES.format(', '.join('?' * len(batch)))
+            for row in self.conn.execute(statement, batch):
+                image = _image_from_row(row)
+                images[image['path']] = image
+        return images
+
+    def scan_posts(self, segment=0, total_segments=1):
+        # Segments are scanned from threads of their own, give each one a
+        # connection rather than sharing self.conn between them. An
+        # in-memory database only exists on its own connection.
+        if self.database == ':memory:':
+            conn = self.conn
+        else:
+            conn = sqlite3.connect(self.database, check_same_thread=False)
+        # Iterating the cursor streams rows instead of loading them all
+        cursor = conn.cursor()
+        try:
+            for row in cursor.execute(SCAN_POSTS, (total_segments, segment)):
+                yield _post_from_row(row)
+        finally:
+            cursor.close()
+            if conn is not self.conn:
+                conn.close()
+
+    def feed_posts(self, subreddit_name, after=None):
+        # Served by the posts_subreddit_created index
+        cursor = self.conn.cursor()
+        try:
+            for row in cursor.execute(
+                    FEED_POSTS, (subreddit_name, after or 0)):
+                yield _post_from_row(row)
+        finally:
+            cursor.close()
 
-    def exists_image(self, image_path):
-        raise NotImplementedError()
+    def subreddit_names(self):
+        cursor = self.conn.cursor()
+        try:
+            for row in cursor.execute(SELECT_SUBREDDIT_NAMES):
+                yield row[0]
+        finally:
+            cursor.close()
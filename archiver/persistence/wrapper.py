@@ -0,0 +1,71 @@
+from archiver.persistence import base as base_persistence
+
+
+class WrappingPersistence(base_persistence.Persistence):
+    """Base for drivers that add behaviour in front of another driver.
+
+    Every call is passed through to the wrapped driver unless overridden.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def persist_subreddit(self, praw_subreddit):
+        return self.driver.persist_subreddit(praw_subreddit)
+
+    def persist_user(self, praw_user):
+        return self.driver.persist_user(praw_user)
+
+    def persist_images(self, images):
+        return self.driver.persist_images(images)
+
+    def persist_post(self, praw_post):
+        return self.driver.persist_post(praw_post)
+
+    def finalize_post(self, praw_post, images):
+        return self.driver.finalize_post(praw_post, images)
+
+    def has_post(self, post_id):
+        return self.driver.has_post(post_id)
+
+    def get_image(self, image_path):
+        return self.driver.get_image(image_path)
+
+    def get_images(self, image_paths):
+        return self.driver.get_images(image_paths)
+
+    def get_subreddit_state(self, subreddit_name):
+        return self.driver.get_subreddit_state(subreddit_name)
+
+    def get_watermark(self, subreddit_name, query_type):
+        return self.driver.get_watermark(subreddit_name, query_type)
+
+    def set_watermark(self, subreddit_name, query_type, created_utc,
+                      post_id):
+        return self.driver.set_watermark(subreddit_name, query_type,
+                                         created_utc, post_id)
+
+    def record_crawl(self, subreddit_name, query_type, depth, new_posts):
+        return self.driver.record_crawl(subreddit_name, query_type, depth,
+                                        new_posts)
+
+    def write_batch(self, images, posts):
+        return self.driver.write_batch(images, posts)
+
+    def after_flush(self, callback):
+        return self.driver.after_flush(callback)
+
+    def flush(self):
+        return self.driver.flush()
+
+    def flush_if_due(self):
+        return self.driver.flush_if_due()
+
+    def scan_posts(self, segment=0, total_segments=1):
+        return self.driver.scan_posts(segment, total_segments)
+
+    def feed_posts(self, subreddit_name, after=None):
+        return self.driver.feed_posts(subreddit_name, after)
+
+    def subreddit_names(self):
+        return self.driver.subreddit_names()
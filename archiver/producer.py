@@ -1,24 +1,67 @@
 import logging
+import time
 
 from archiver import clients
 from archiver import config
+from archiver import constants
 from archiver import messages
+from archiver.persistence import cache
 
-logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger(__name__)
 
+_UNKNOWN = object()
+
 
 class Producer(object):
     def __init__(self):
         self.conf = config.get_config()
+        self.persistence = clients.persistence_client()
+        self.states = cache.LRUCache(self.conf.PERSISTENCE_CACHE_SIZE,
+                                     self.conf.PRODUCER_STATE_TTL)
+
+    def add_subreddit(self, subreddit_name, query_type, num, force=False,
+                      incremental=False, queue=config.DEFAULT_QUEUE_PRIORITY):
+        if not force:
+            reason = self._skip_reason(subreddit_name, query_type, num)
+            if reason:
+                LOG.info(u"Skipping subreddit %s: %s", subreddit_name, reason)
+                return False
+        if queue not in self.conf.QUEUES:
+            raise ValueError("Unknown queue: " + queue)
+        LOG.info("Beginning to archive %s %s from subreddit: %s",
+                 num, query_type, subreddit_name)
+        m = messages.SubredditMessage(subreddit_name, query_type, num,
+                                      incremental=incremental)
+        m.enqueue(clients.queue_client(self.conf.QUEUES[queue][0]))
+        # The enqueued crawl changes the state, don't trust the cached copy
+        self.states.invalidate(subreddit_name)
+        return True
+
+    def _skip_reason(self, subreddit_name, query_type, num):
+        state = self.get_subreddit_state(subreddit_name)
+        if state is None:
+            return None
+        interval = self.conf.PRODUCER_MIN_CRAWL_INTERVAL
+        if interval and state.get('last_crawled') and (
+                time.time() - state['last_crawled'] < interval):
+            return u"crawled less than {interval}s ago".format(
+                interval=interval)
+        # The all time top list barely changes, once a crawl of it went num
+        # posts deep there is nothing new to fetch
+        listing = state.get('listings', {}).get(query_type)
+        if (query_type == constants.QUERY_TOP_ALL_TIME and listing and
+                listing['depth'] >= num):
+            return u"top {depth} posts already crawled".format(
+                depth=listing['depth'])
+        return None
 
-    def add_subreddit(self, subreddit_name, query_type, num):
-        LOG.info("Beginning to archive {num} {type} from subreddit: {sub}"
-                 .format(type=query_type, sub=subreddit_name, num=num))
-        m = messages.SubredditMessage(subreddit_name, query_type, num)
-        m.enqueue(clients.sqs_client(self.conf.QUEUE_NAME))
+    def get_subreddit_state(self, subreddit_name):
+        state = self.states.get(subreddit_name, _UNKNOWN)
+        if state is _UNKNOWN:
+            state = self.persistence.get_subreddit_state(subreddit_name)
+            self.states.set(subreddit_name, state)
+        return state
 
     def has_subreddit(self, subreddit_name):
-        LOG.info("Checking for subreddit: {subreddit}"
-                 .format(subreddit=subreddit_name))
-        return False
+        LOG.info("Checking for subreddit: %s", subreddit_name)
+        return self.get_subreddit_state(subreddit_name) is not None
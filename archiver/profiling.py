@@ -0,0 +1,212 @@
+"""On-demand profiling of a running consumer.
+
+A Profiler session covers the next `messages` handled queue messages or
+`seconds` seconds, whichever comes first, and writes to output_dir:
+
+* a profile of the consumer thread, either collapsed stacks from a
+  sampling profiler (one "frame;frame;frame count" line per stack, the
+  input of flamegraph.pl and speedscope) or cProfile data for pstats
+* a JSON line per message with the time spent in each metrics stage while
+  handling it, and a last line with the stages outside any message, like
+  receiving and bulk post lookups
+
+Sessions are started with start(), or by sending the process the signal
+given to install_signal, so a live worker can be profiled without a
+restart. The signal only requests a session, the consumer loop starts it
+from poll().
+"""
+import collections
+import cProfile
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from archiver import metrics
+
+LOG = logging.getLogger(__name__)
+
+FORMAT_COLLAPSED = 'collapsed'
+FORMAT_PSTATS = 'pstats'
+FORMATS = [FORMAT_COLLAPSED, FORMAT_PSTATS]
+
+DEFAULT_INTERVAL = 0.005
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+
+
+class SamplingProfiler(object):
+    """Samples the stack of one thread from a background thread."""
+
+    def __init__(self, thread_id, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='sampling-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+def _describe(resp):
+    body = resp.body or {}
+    for key in ('post_link', 'subreddit_name'):
+        if key in body:
+            return body[key]
+    return None
+
+
+class Profiler(object):
+    def __init__(self, consumer, output_dir='.', fmt=FORMAT_COLLAPSED,
+                 messages=100, seconds=60, interval=DEFAULT_INTERVAL):
+        if fmt not in FORMATS:
+            raise ValueError(u"Unknown profile format: {}".format(fmt))
+        self.consumer = consumer
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.messages = messages
+        self.seconds = seconds
+        self.interval = interval
+        self.requested = False
+        self._profile = None
+        self._handle = None
+        self._thread = None
+        self._started = None
+        self._timings = []
+        self._stages = None
+        self._outside = None
+
+    @property
+    def active(self):
+        return self._started is not None
+
+    def install_signal(self, signum=signal.SIGUSR1):
+        # The handler runs between any two bytecodes, possibly while the
+        # log queue or a metrics lock is held, so it only sets a flag
+        signal.signal(signum, self._request)
+        # Don't break off a long poll in progress, profile after it
+        signal.siginterrupt(signum, False)
+
+    def _request(self, signum, frame):
+        self.requested = True
+
+    def start(self):
+        """Start a session, unless one is already running."""
+        self.requested = False
+        if self.active:
+            return
+        LOG.info(u"Profiling the next %s messages or %ss.",
+                 self.messages, self.seconds)
+        self._thread = threading.current_thread()
+        self._timings = []
+        self._outside = {}
+        self._handle = self.consumer._handle
+        self.consumer._handle = self._timed_handle
+        metrics.add_observer(self._observe)
+        if self.fmt == FORMAT_PSTATS:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._profile = SamplingProfiler(self._thread.ident,
+                                             self.interval)
+            self._profile.start()
+        self._started = time.time()
+
+    def poll(self):
+        """Start a requested session, end one that has run its course.
+
+        Returns the paths of the files written when a session ended.
+        """
+        if self.requested:
+            self.start()
+        elif self.active and (len(self._timings) >= self.messages or
+                              time.time() - self._started >= self.seconds):
+            return self.stop()
+        return None
+
+    def stop(self):
+        """End the session, return the paths of the files written."""
+        if not self.active:
+            return []
+        if self.fmt == FORMAT_PSTATS:
+            self._profile.disable()
+        else:
+            self._profile.stop()
+        metrics.remove_observer(self._observe)
+        self.consumer._handle = self._handle
+        elapsed = time.time() - self._started
+        self._started = None
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        prefix = os.path.join(self.output_dir, 'consumer-{pid}-{time}'.format(
+            pid=os.getpid(), time=time.strftime('%Y%m%d-%H%M%S')))
+        profile_path = '{}.{}'.format(prefix, self.fmt)
+        if self.fmt == FORMAT_PSTATS:
+            self._profile.dump_stats(profile_path)
+        else:
+            self._profile.write(profile_path)
+        self._profile = None
+        timings_path = prefix + '.timings.jsonl'
+        with open(timings_path, 'w') as f:
+            for timing in self._timings + [{'message': None,
+                                            'stages': self._outside}]:
+                f.write(json.dumps(timing, sort_keys=True) + '\n')
+        LOG.info(u"Profiled %s messages in %.1fs, wrote %s",
+                 len(self._timings), elapsed, profile_path)
+        return [profile_path, timings_path]
+
+    def _observe(self, histogram, labels, seconds):
+        if threading.current_thread() is not self._thread:
+            return
+        stages = self._outside if self._stages is None else self._stages
+        # Stages nest (a download within an album), so each is inclusive
+        name = labels.get('stage') or labels.get('resolver', histogram.name)
+        stages[name] = stages.get(name, 0.0) + seconds
+
+    def _timed_handle(self, resp, handler):
+        self._stages = {}
+        start = time.time()
+        try:
+            return self._handle(resp, handler)
+        finally:
+            self._timings.append({
+                'message': resp.type,
+                'target': _describe(resp),
+                'seconds': time.time() - start,
+                'stages': self._stages
+            })
+            self._stages = None
+            self.poll()
@@ -0,0 +1,48 @@
+import abc
+import json
+
+import six
+
+from archiver import constants
+from archiver import messages
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Queue(object):
+    _message_types = {
+        constants.MESSAGE_SUBREDDIT: messages.SubredditMessage,
+        constants.MESSAGE_POST: messages.PostMessage,
+        constants.MESSAGE_POST_BATCH: messages.PostBatchMessage
+    }
+
+    @abc.abstractmethod
+    def send_message(self, message, delay=0):
+        """Send message, hidden from receivers for delay seconds."""
+        pass
+
+    @abc.abstractmethod
+    def get_messages(self, max_messages=10, wait=20):
+        """Receive up to max_messages, waiting up to wait seconds for any.
+
+        Received messages are hidden from other receivers until they are
+        deleted or their visibility timeout runs out.
+        """
+        pass
+
+    @abc.abstractmethod
+    def delete_message(self, mid):
+        pass
+
+    @abc.abstractmethod
+    def extend_visibility(self, mid, timeout):
+        """Keep a received message hidden for timeout more seconds."""
+        pass
+
+    def get_message(self, wait=20):
+        resp = self.get_messages(max_messages=1, wait=wait)
+        return resp[0] if resp else None
+
+    def _parse_message(self, data, receipt_handle):
+        body = json.loads(data)
+        return self._message_types[body.get('type')](
+            mid=receipt_handle, **body.get('body'))
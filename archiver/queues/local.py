@@ -0,0 +1,109 @@
+import sqlite3
+import time
+
+from archiver import config
+from archiver.queues import base as base_queue
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS messages ("
+    "  id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    "  queue TEXT,"
+    "  body TEXT,"
+    "  visible_at REAL,"
+    "  receive_count INTEGER DEFAULT 0"
+    ")",
+    "CREATE INDEX IF NOT EXISTS messages_queue_visible "
+    "ON messages (queue, visible_at)",
+)
+
+INSERT_MESSAGE = (
+    "INSERT INTO messages (queue, body, visible_at) VALUES (?, ?, ?)")
+SELECT_VISIBLE = (
+    "SELECT id, body, receive_count FROM messages "
+    "WHERE queue = ? AND visible_at <= ? ORDER BY id LIMIT ?")
+UPDATE_RECEIVED = (
+    "UPDATE messages SET visible_at = ?, receive_count = ? WHERE id = ?")
+UPDATE_VISIBILITY = (
+    "UPDATE messages SET visible_at = ? WHERE id = ? AND receive_count = ?")
+COUNT_MESSAGES = "SELECT COUNT(*) FROM messages WHERE queue = ?"
+DELETE_MESSAGE = "DELETE FROM messages WHERE id = ? AND receive_count = ?"
+
+POLL_INTERVAL = 0.05
+
+
+def _receipt(message_id, receive_count):
+    return '{}:{}'.format(message_id, receive_count)
+
+
+def _parse_receipt(mid):
+    message_id, _, receive_count = mid.partition(':')
+    return int(message_id), int(receive_count)
+
+
+class LocalQueue(base_queue.Queue):
+    """Queue kept in a local SQLite database, for single node setups.
+
+    Like SQS, received messages stay hidden for the visibility timeout and
+    then become visible again unless deleted. Receipt handles are only
+    valid for the receive that returned them, so a worker that took too
+    long can't delete a message another worker has since received.
+    """
+
+    def __init__(self, queue_name, database=None):
+        conf = config.get_config()
+        self.queue_name = queue_name
+        self.visibility_timeout = conf.QUEUE_VISIBILITY_TIMEOUT
+        # Transactions are managed explicitly, see get_messages
+        self.conn = sqlite3.connect(database or conf.QUEUE_LOCAL_DATABASE,
+                                    timeout=30, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+
+    def send_message(self, message, delay=0):
+        self.conn.execute(INSERT_MESSAGE,
+                          (self.queue_name, message, time.time() + delay))
+
+    def get_messages(self, max_messages=10, wait=20):
+        deadline = time.time() + wait
+        while True:
+            resp = self._receive(max_messages)
+            if resp or time.time() >= deadline:
+                return resp
+            time.sleep(POLL_INTERVAL)
+
+    def _receive(self, max_messages):
+        now = time.time()
+        # Take the write lock up front so two receivers never get the same
+        # message
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.conn.execute(
+                SELECT_VISIBLE,
+                (self.queue_name, now, max_messages)).fetchall()
+            for message_id, _, receive_count in rows:
+                self.conn.execute(UPDATE_RECEIVED, (
+                    now + self.visibility_timeout, receive_count + 1,
+                    message_id))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return [self._parse_message(body, _receipt(message_id,
+                                                   receive_count + 1))
+                for message_id, body, receive_count in rows]
+
+    def pending(self):
+        """Number of messages not deleted yet, visible or not."""
+        return self.conn.execute(
+            COUNT_MESSAGES, (self.queue_name,)).fetchone()[0]
+
+    def delete_message(self, mid):
+        self.conn.execute(DELETE_MESSAGE, _parse_receipt(mid))
+
+    def extend_visibility(self, mid, timeout):
+        message_id, receive_count = _parse_receipt(mid)
+        self.conn.execute(UPDATE_VISIBILITY, (time.time() + timeout,
+                                              message_id, receive_count))
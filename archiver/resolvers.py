@@ -0,0 +1,77 @@
+"""Registry of the resolvers that map post URLs to download handlers.
+
+Resolvers are registered for the hostnames they handle. A URL is matched
+against the resolvers of its host first, found with one dict lookup for
+the exact host and then one per parent domain, so a subdomain like
+m.imgur.com is covered by registering imgur.com. Fallback resolvers,
+registered without hosts, are only tried for URLs the resolvers of their
+host don't match, which for unknown hosts is every URL.
+"""
+import collections
+import re
+
+from six.moves.urllib import parse
+
+
+class Resolver(object):
+    """Matches one kind of URL and names the handler that downloads it.
+
+    The handler is called with the groups of pattern, preceded by the post
+    itself when with_post is set.
+    """
+
+    def __init__(self, name, pattern, handler, with_post=False):
+        self.name = name
+        self.regex = re.compile(pattern, re.IGNORECASE)
+        self.handler = handler
+        self.with_post = with_post
+
+    def match(self, url):
+        m = self.regex.match(url)
+        return m.groups() if m else None
+
+
+def url_host(url):
+    try:
+        host = parse.urlsplit(url).hostname
+    except ValueError:
+        return None
+    return host.rstrip('.') if host else None
+
+
+class ResolverRegistry(object):
+    def __init__(self):
+        self._hosts = {}
+        self._fallback = []
+        self.hits = collections.Counter()
+        self.misses = 0
+
+    def register(self, resolver, hosts=None):
+        """Add resolver for hosts and their subdomains, or as a fallback.
+
+        Resolvers of the same host are tried in the order registered.
+        """
+        if not hosts:
+            self._fallback.append(resolver)
+            return
+        for host in hosts:
+            self._hosts.setdefault(host.lower(), []).append(resolver)
+
+    def _host_resolvers(self, host):
+        while host:
+            if host in self._hosts:
+                return self._hosts[host]
+            host = host.partition('.')[2]
+        return None
+
+    def resolve(self, url):
+        """Return (resolver, groups) for url, or None if nothing matches."""
+        for resolvers in (self._host_resolvers(url_host(url)),
+                          self._fallback):
+            for resolver in resolvers or ():
+                groups = resolver.match(url)
+                if groups is not None:
+                    self.hits[resolver.name] += 1
+                    return resolver, groups
+        self.misses += 1
+        return None
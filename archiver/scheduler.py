@@ -0,0 +1,147 @@
+import heapq
+import json
+import logging
+import random
+import time
+
+from archiver import config
+from archiver import constants
+from archiver import producer
+
+LOG = logging.getLogger(__name__)
+
+# Aim for each crawl to find about this share of its listing as new posts
+TARGET_FILL = 0.5
+# How far a single observation may move the interval
+MAX_SPEEDUP = 4.0
+MAX_SLOWDOWN = 2.0
+
+
+class Crawl(object):
+    """One recurring entry of the crawl plan."""
+
+    def __init__(self, subreddit, query_type, num, interval, priority=0,
+                 incremental=False, queue=config.DEFAULT_QUEUE_PRIORITY):
+        self.subreddit = subreddit
+        self.query_type = query_type
+        self.num = num
+        self.interval = interval
+        self.priority = priority
+        self.incremental = incremental
+        self.queue = queue
+        self.last_run = None
+        self.last_count = None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            subreddit=data['subreddit'],
+            query_type=data['query_type'],
+            num=int(data['num']),
+            interval=int(data['interval']),
+            priority=int(data.get('priority', 0)),
+            incremental=bool(data.get('incremental', False)),
+            queue=data.get('queue', config.DEFAULT_QUEUE_PRIORITY)
+        )
+
+
+def load_plan(path):
+    with open(path) as f:
+        return [Crawl.from_dict(entry) for entry in json.load(f)]
+
+
+class Scheduler(object):
+    """Enqueues the crawls of a crawl plan as they come due.
+
+    The first run of every crawl is spread over its jitter window, and every
+    interval is jittered, so entries with the same interval don't all hit
+    the queue at once. After each run the interval is adapted to the rate
+    at which its listing turned up new posts, bounded by min_interval and
+    max_interval. Crawls found due together, e.g. when the scheduler fell
+    behind, run in order of priority, highest first.
+    """
+
+    def __init__(self, plan=None, producer_client=None):
+        self.conf = config.get_config()
+        self.producer = producer_client or producer.Producer()
+        self.jitter = self.conf.SCHEDULER_JITTER
+        self.min_interval = self.conf.SCHEDULER_MIN_INTERVAL
+        self.max_interval = self.conf.SCHEDULER_MAX_INTERVAL
+        if plan is None:
+            plan = load_plan(self.conf.SCHEDULER_PLAN_FILE)
+        self._heap = []
+        self._sequence = 0
+        now = time.time()
+        for crawl in plan:
+            if (crawl.incremental and
+                    crawl.query_type not in constants.TIME_ORDERED_QUERIES):
+                LOG.warning(u"Only listings ordered by time are crawled "
+                            u"incrementally, %s %s is crawled in full",
+                            crawl.subreddit, crawl.query_type)
+            self._push(crawl, now + random.uniform(
+                0, crawl.interval * self.jitter))
+
+    def _push(self, crawl, due):
+        self._sequence += 1
+        heapq.heappush(self._heap, (due, self._sequence, crawl))
+
+    def _jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run_pending(self):
+        """Run every crawl that is due, return seconds until the next one."""
+        now = time.time()
+        pending = []
+        while self._heap and self._heap[0][0] <= now:
+            pending.append(heapq.heappop(self._heap))
+        pending.sort(key=lambda entry: (-entry[2].priority, entry[:2]))
+        for _, _, crawl in pending:
+            now = time.time()
+            self._run(crawl, now)
+            self._push(crawl, now + self._jittered(crawl.interval))
+        if not self._heap:
+            return None
+        return max(0, self._heap[0][0] - time.time())
+
+    def run(self):
+        while self._heap:
+            wait = self.run_pending()
+            if wait:
+                time.sleep(wait)
+
+    def _run(self, crawl, now):
+        self._adapt(crawl, now)
+        try:
+            self.producer.add_subreddit(crawl.subreddit, crawl.query_type,
+                                        crawl.num,
+                                        incremental=crawl.incremental,
+                                        queue=crawl.queue)
+        except Exception:
+            LOG.exception(u"Failed to schedule crawl of %s", crawl.subreddit)
+        crawl.last_run = now
+
+    def _adapt(self, crawl, now):
+        # Only the posts this listing found count, other entries for the
+        # subreddit may archive far more (or fewer)
+        state = self.producer.get_subreddit_state(crawl.subreddit)
+        listing = (state or {}).get('listings', {}).get(crawl.query_type)
+        count = listing['new_posts'] if listing else 0
+        if crawl.last_run is not None and crawl.last_count is not None:
+            new_posts = count - crawl.last_count
+            elapsed = now - crawl.last_run
+            if new_posts > 0 and elapsed > 0:
+                rate = float(new_posts) / elapsed
+                wanted = crawl.num * TARGET_FILL / rate
+            else:
+                wanted = crawl.interval * MAX_SLOWDOWN
+            wanted = max(crawl.interval / MAX_SPEEDUP,
+                         min(crawl.interval * MAX_SLOWDOWN, wanted))
+            interval = max(self.min_interval,
+                           min(self.max_interval, wanted))
+            if interval != crawl.interval:
+                LOG.info(u"Crawl interval for %s %s changed from "
+                         u"%.0fs to %.0fs (%s new posts)",
+                         crawl.subreddit, crawl.query_type, crawl.interval,
+                         interval, new_posts)
+            crawl.interval = interval
+        crawl.last_count = count
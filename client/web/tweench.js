@@ -2,6 +2,43 @@ var downloadLock = false;
 var lastEvaluatedKey = null;
 var docClient = new AWS.DynamoDB.DocumentClient();
 
+// Mirrors archiver/persistence/encoding.py, see there for the format
+function unpackColor(packed) {
+    var value = (packed >>> 7).toString(16);
+    while (value.length < 6) {
+        value = '0' + value;
+    }
+    return {value: '#' + value, prominence: packed & 127};
+}
+
+function decodeImages(data) {
+    // Posts written before the compact encoding hold a plain list
+    if (typeof(data) === 'undefined' || data === null || Array.isArray(data)) {
+        return data;
+    }
+    var images = [];
+    for (var i = 0, len = data.i.length; i < len; i++) {
+        var entry = data.i[i];
+        if (!Array.isArray(entry)) {
+            images.push(entry);
+            continue;
+        }
+        var name = entry[1];
+        var image = {url: data.p[entry[0]] + name};
+        if (entry[2]) {
+            image.path = entry[2] + '/' + name;
+        }
+        if (entry[3]) {
+            image.dimensions = {height: entry[3][0], width: entry[3][1]};
+        }
+        if (entry[4]) {
+            image.colors = entry[4].map(unpackColor);
+        }
+        images.push(image);
+    }
+    return images;
+}
+
 function addImageToPage(image, post) {
     var url = base_path + image['path'];
     var thumb_url = base_thumb_path + image['path'];
@@ -41,6 +78,26 @@ function addImageToPage(image, post) {
     return li;
 }
 
+function addPostImages(post, elements) {
+    var images = decodeImages(post.images);
+    if (typeof(images) === 'undefined') {
+        return;
+    }
+    for (var j = 0, images_len = images.length; j < images_len; j++) {
+        if (typeof(images[j]['path']) !== 'undefined') {
+            elements.push(addImageToPage(images[j], post));
+        }
+    }
+}
+
+function appendElements(elements) {
+    console.log("Loaded " + elements.length + " images.");
+    var $container = $('#container');
+    $container.imagesLoaded(function () {
+        $container.masonry('appended', elements, true);
+    });
+}
+
 function tableQueryCallback(error, data) {
     console.log("Table query complete.");
     if (error) {
@@ -52,28 +109,38 @@ function tableQueryCallback(error, data) {
         var elements = [];
         for (var i = 0, posts_len = posts.length; i < posts_len; i++) {
             var post = posts[i];
-            var images = post.images;
-            if (typeof(images) === 'undefined') {
-                continue;
-            }
-            for (var j = 0, images_len = images.length; j < images_len; j++) {
-                if (typeof(images[j]['path']) !== 'undefined') {
-                    elements.push(addImageToPage(images[j], post));
-                }
-            }
+            addPostImages(post, elements);
             if (elements.length >= maxImageCount) {
-                lastEvaluatedKey.id = post.id;
+                // Resume the feed index right after the last rendered post
+                lastEvaluatedKey = {
+                    id: post.id,
+                    subreddit: post.subreddit,
+                    created_utc: post.created_utc
+                };
                 break;
             }
         }
-        console.log("Loaded " + elements.length + " images.");
-        var $container = $('#container');
-        $container.imagesLoaded(function () {
-            $container.masonry('appended', elements, true);
-        });
+        appendElements(elements);
     }
 }
 
+function staticPageCallback(data) {
+    console.log("Static feed page loaded.");
+    // The next page name plays the part of LastEvaluatedKey
+    lastEvaluatedKey = data["next"] || undefined;
+    var elements = [];
+    for (var i = 0, posts_len = data["posts"].length; i < posts_len; i++) {
+        addPostImages(data["posts"][i], elements);
+    }
+    appendElements(elements);
+}
+
+function staticPageError(xhr, status, error) {
+    console.log("Static feed page failed: " + status + " " + error);
+    lastEvaluatedKey = undefined;
+    downloadLock = false;
+}
+
 function layoutCompleteCallback(event, items) {
     console.log("Layout complete, enabling fancybox.");
     downloadLock = false;
@@ -132,6 +199,13 @@ function getMoreImages(page, sequence, scrollDirection) {
     if (sequence == null || sequence > 0) {
         console.log("Getting more images, page/direction: "
             + page + "/" + scrollDirection);
+        if (typeof(feedBasePath) !== 'undefined' && feedBasePath) {
+            var pageName = lastEvaluatedKey || "head.json";
+            $.getJSON(feedBasePath + subreddit + "/" + pageName)
+                .done(staticPageCallback)
+                .fail(staticPageError);
+            return;
+        }
         var params = {
             TableName: "posts",
             IndexName: "subreddit-created-index",
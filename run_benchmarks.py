@@ -0,0 +1,50 @@
+import argparse
+import logging
+import os
+import sys
+
+from archiver import log
+from archiver.bench import micro
+
+parser = argparse.ArgumentParser(
+    description="Benchmark the image processing stages and check them "
+                "against a saved baseline.")
+parser.add_argument('--baseline', default='bench_baseline.json',
+                    help="Baseline file to check against or save to")
+parser.add_argument('--save', action='store_true',
+                    help="Save the results as the new baseline")
+parser.add_argument('--tolerance', type=float,
+                    default=micro.DEFAULT_TOLERANCE,
+                    help="Allowed slowdown before a result counts as a "
+                         "regression, 0.2 being 20%%")
+parser.add_argument('--stages', nargs='+', choices=micro.STAGES,
+                    default=micro.STAGES)
+parser.add_argument('--formats', nargs='+', choices=micro.FORMATS,
+                    default=micro.FORMATS)
+parser.add_argument('--sizes', nargs='+', choices=list(micro.SIZES),
+                    default=list(micro.SIZES))
+parser.add_argument('--repeat', type=int, default=micro.DEFAULT_REPEAT)
+parser.add_argument('--verbose', action='store_true')
+args = parser.parse_args()
+
+log.setup(logging.INFO if args.verbose else logging.WARNING)
+
+results = micro.run(stages=args.stages, formats=args.formats,
+                    sizes=args.sizes, repeat=args.repeat)
+
+if args.save:
+    micro.save_baseline(args.baseline, results)
+    print(micro.format_results(results))
+    print(u"Baseline saved to {}".format(args.baseline))
+    sys.exit(0)
+
+baseline = {}
+if os.path.exists(args.baseline):
+    baseline = micro.load_baseline(args.baseline)['results']
+print(micro.format_results(results, baseline))
+regressions = micro.compare(results, baseline, args.tolerance)
+for name, base, seconds in regressions:
+    # base is already scaled to this run's calibration
+    print(u"REGRESSION {}: {:.3f} ms -> {:.3f} ms".format(
+        name, base * 1000, seconds * 1000))
+sys.exit(1 if regressions else 0)
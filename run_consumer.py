@@ -1,8 +1,45 @@
+import argparse
+import logging
+
+from archiver import config
 from archiver import consumer
+from archiver import log
+from archiver import metrics
+from archiver import profiling
+
+parser = argparse.ArgumentParser(
+    description="Archive posts from the queues. Send SIGUSR1 to profile a "
+                "running consumer.")
+parser.add_argument('--profile', action='store_true',
+                    help="Profile from the start instead of on SIGUSR1")
+parser.add_argument('--profile-format', choices=profiling.FORMATS,
+                    default=profiling.FORMAT_COLLAPSED,
+                    help="Sampled collapsed stacks, or cProfile pstats")
+parser.add_argument('--profile-messages', type=int, default=100,
+                    help="Queue messages covered by a profile")
+parser.add_argument('--profile-seconds', type=int, default=60,
+                    help="Longest a profile runs")
+parser.add_argument('--profile-dir', default='profiles',
+                    help="Directory the profiles are written to")
+args = parser.parse_args()
+
+LOG = logging.getLogger(__name__)
+
+log.setup_from_config()
+conf = config.get_config()
+if conf.METRICS_PORT:
+    metrics.start_http_server(conf.METRICS_PORT, conf.METRICS_ADDRESS)
 
 c = consumer.Consumer()
+profiler = profiling.Profiler(
+    c, output_dir=args.profile_dir, fmt=args.profile_format,
+    messages=args.profile_messages, seconds=args.profile_seconds)
+profiler.install_signal()
+if args.profile:
+    profiler.start()
 while True:
     try:
-        c.run_once()
-    except Exception as e:
-        print(e)
+        c.run_batch()
+    except Exception:
+        LOG.exception(u"Consumer batch failed.")
+    profiler.poll()
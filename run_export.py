@@ -0,0 +1,19 @@
+import argparse
+
+from archiver import clients
+from archiver import export
+from archiver import log
+
+parser = argparse.ArgumentParser(
+    description="Export every archived post into per-subreddit files.")
+parser.add_argument('output_dir')
+parser.add_argument('--format', default=export.FORMAT_JSONL,
+                    choices=[export.FORMAT_JSONL, export.FORMAT_PARQUET])
+parser.add_argument('--segments', type=int, default=4,
+                    help="Parallel scan segments. The SQL driver reads "
+                         "the whole table for each, use 1 with it.")
+args = parser.parse_args()
+
+log.setup_from_config()
+export.export(clients.persistence_client(), args.output_dir,
+              fmt=args.format, segments=args.segments)
@@ -0,0 +1,20 @@
+import argparse
+
+from archiver import clients
+from archiver import feeds
+from archiver import log
+
+parser = argparse.ArgumentParser(
+    description="Update the static gallery feeds. Run a single instance, "
+                "it is the only writer of the feed pages.")
+parser.add_argument('subreddits', nargs='*',
+                    help="Subreddits to update, all of them by default")
+parser.add_argument('--rebuild', action='store_true',
+                    help="Start new generations of the feeds from scratch")
+args = parser.parse_args()
+
+log.setup_from_config()
+persistence = clients.persistence_client()
+materializer = feeds.FeedMaterializer(persistence)
+for subreddit in args.subreddits or persistence.subreddit_names():
+    materializer.materialize(subreddit, rebuild=args.rebuild)
@@ -0,0 +1,45 @@
+import argparse
+import json
+import logging
+
+from archiver import log
+from archiver.bench import loadtest
+
+SERVICES = ['queue', 'reddit', 'persistence', 's3', 'gfycat', 'http']
+
+parser = argparse.ArgumentParser(
+    description="Run the consumer against local stand-ins and report "
+                "throughput.")
+parser.add_argument('--posts', type=int, default=1000)
+parser.add_argument('--batch-size', type=int, default=10,
+                    help="Messages received per consumer poll")
+parser.add_argument('--embed', action='store_true',
+                    help="Embed post data in the messages")
+parser.add_argument('--batch', action='store_true',
+                    help="Send posts as batch messages")
+for service in SERVICES:
+    parser.add_argument('--{}-latency'.format(service), type=float,
+                        default=0.0, metavar='MS',
+                        help="Added latency per {} call".format(service))
+    parser.add_argument('--{}-errors'.format(service), type=float,
+                        default=0.0, metavar='RATE',
+                        help="Share of {} calls that fail".format(service))
+parser.add_argument('--max-seconds', type=int, default=600)
+parser.add_argument('--json', action='store_true',
+                    help="Print the report as JSON")
+parser.add_argument('--verbose', action='store_true')
+args = parser.parse_args()
+
+log.setup(logging.INFO if args.verbose else logging.WARNING)
+
+report = loadtest.run(
+    posts=args.posts, batch_size=args.batch_size, embed=args.embed,
+    batch=args.batch, max_seconds=args.max_seconds,
+    services={service: loadtest.Service(
+        latency=getattr(args, service + '_latency') / 1000.0,
+        error_rate=getattr(args, service + '_errors'))
+        for service in SERVICES})
+if args.json:
+    print(json.dumps(report, indent=2, sort_keys=True))
+else:
+    print(loadtest.format_report(report))
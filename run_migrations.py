@@ -0,0 +1,6 @@
+from archiver import log
+from archiver.persistence import dynamo
+
+log.setup_from_config()
+db = dynamo.DynamoPersistence()
+db.migrate_feed_index()
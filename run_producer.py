@@ -1,5 +1,7 @@
 from archiver import constants
+from archiver import log
 from archiver import producer
 
+log.setup_from_config()
 p = producer.Producer()
 p.add_subreddit("foodporn", constants.QUERY_HOT, 2)
@@ -0,0 +1,6 @@
+from archiver import log
+from archiver import scheduler
+
+log.setup_from_config()
+s = scheduler.Scheduler()
+s.run()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from archiver import bloom
+
+
+class TestScalableBloomFilter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_no_false_negatives(self):
+        bloom_filter = bloom.ScalableBloomFilter(capacity=100)
+        keys = [u'post{}'.format(i) for i in range(1000)]
+        for key in keys:
+            bloom_filter.add(key)
+
+        self.assertTrue(all(key in bloom_filter for key in keys))
+        # Filled ten times over its initial capacity, so it has grown
+        self.assertGreater(len(bloom_filter.filters), 1)
+        # Keys that already look present aren't added again
+        self.assertGreater(len(bloom_filter), 990)
+
+    def test_false_positive_rate(self):
+        bloom_filter = bloom.ScalableBloomFilter(capacity=1000,
+                                                 error_rate=0.01)
+        for i in range(10000):
+            bloom_filter.add(u'post{}'.format(i))
+
+        false_positives = sum(u'other{}'.format(i) in bloom_filter
+                              for i in range(10000))
+        # Allow some slack over the 1% bound for sampling noise
+        self.assertLess(false_positives, 150)
+
+    def test_save_load(self):
+        path = os.path.join(self.tmp, 'posts.bloom')
+        bloom_filter = bloom.ScalableBloomFilter(capacity=10)
+        for i in range(50):
+            bloom_filter.add(u'post{}'.format(i))
+        bloom_filter.save(path)
+
+        loaded = bloom.ScalableBloomFilter.load(path, capacity=10)
+
+        self.assertEqual(len(loaded.filters), len(bloom_filter.filters))
+        self.assertIn(u'post49', loaded)
+        self.assertEqual(len(loaded), len(bloom_filter))
+
+    def test_sync_merges_saved_filter(self):
+        path = os.path.join(self.tmp, 'posts.bloom')
+        first = bloom.ScalableBloomFilter(capacity=10)
+        second = bloom.ScalableBloomFilter(capacity=10)
+        for i in range(30):
+            first.add(u'first{}'.format(i))
+        for i in range(5):
+            second.add(u'second{}'.format(i))
+
+        first.sync(path)
+        second.sync(path)
+
+        loaded = bloom.ScalableBloomFilter.load(path, capacity=10)
+        self.assertIn(u'first29', loaded)
+        self.assertIn(u'second4', loaded)
+        self.assertEqual(len(loaded.filters), len(first.filters))
+        self.assertGreaterEqual(len(loaded), 30)
+
+    def test_load_missing(self):
+        loaded = bloom.ScalableBloomFilter.load(
+            os.path.join(self.tmp, 'missing.bloom'))
+        self.assertEqual(len(loaded), 0)
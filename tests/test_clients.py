@@ -44,12 +44,15 @@ class TestClientMethods(unittest.TestCase):
         self.mock_config = patcher.start()
         self.addCleanup(patcher.stop)
 
+    @mock.patch.dict(clients._CLIENTS, {'queue': {}})
     @mock.patch('archiver.clients.get_session')
-    def test_sqs_client(self, mock_session):
+    def test_queue_client(self, mock_session):
+        self.mock_config().QUEUE_DRIVER = 'archiver.clients:SQSClient'
+
         # Get clients for FAKE_QUEUE_NAME1 twice and FAKE_QUEUE_NAME2 once
-        sqs1 = clients.sqs_client(FAKE_QUEUE_NAME1)
-        sqs2 = clients.sqs_client(FAKE_QUEUE_NAME1)
-        sqs3 = clients.sqs_client(FAKE_QUEUE_NAME2)
+        sqs1 = clients.queue_client(FAKE_QUEUE_NAME1)
+        sqs2 = clients.queue_client(FAKE_QUEUE_NAME1)
+        sqs3 = clients.queue_client(FAKE_QUEUE_NAME2)
 
         # Both FAKE_QUEUE_NAME1 clients should be the same object
         self.assertTrue(sqs1 is sqs2)
@@ -194,6 +197,18 @@ class TestSQSClient(unittest.TestCase):
             MessageBody=FAKE_MESSAGE
         )
 
+    def test_send_message_delay(self):
+        sqs = self._make_sqsclient()
+
+        sqs.send_message(FAKE_MESSAGE, delay=3600)
+
+        # SQS delays messages by at most 15 minutes
+        self.mock_client().send_message.assert_called_once_with(
+            QueueUrl=self.mock_client().get_queue_url().__getitem__(),
+            MessageBody=FAKE_MESSAGE,
+            DelaySeconds=900
+        )
+
     def test_get_message(self):
         sqs = self._make_sqsclient()
 
@@ -220,6 +235,41 @@ class TestSQSClient(unittest.TestCase):
         self.assertEqual(resp.type, constants.MESSAGE_SUBREDDIT)
         self.assertEqual(resp.id, FAKE_RECEIPT_ID)
 
+    def test_get_messages(self):
+        sqs = self._make_sqsclient()
+
+        self.mock_client().receive_message.return_value = {
+            'Messages': [{
+                'Body': json.dumps({
+                    'type': FAKE_MESSAGE_TYPE,
+                    'body': FAKE_MESSAGE
+                }),
+                'ReceiptHandle': FAKE_RECEIPT_ID + str(i)
+            } for i in range(3)]
+        }
+
+        resp = sqs.get_messages(max_messages=10, wait=FAKE_WAIT_TIME)
+
+        self.mock_client().receive_message.assert_called_once_with(
+            QueueUrl=self.mock_client().get_queue_url().__getitem__(),
+            AttributeNames=['All'],
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=FAKE_WAIT_TIME
+        )
+        self.assertEqual([m.id for m in resp],
+                         [FAKE_RECEIPT_ID + str(i) for i in range(3)])
+
+    def test_extend_visibility(self):
+        sqs = self._make_sqsclient()
+
+        sqs.extend_visibility(FAKE_RECEIPT_ID, 60)
+
+        self.mock_client().change_message_visibility.assert_called_once_with(
+            QueueUrl=self.mock_client().get_queue_url().__getitem__(),
+            ReceiptHandle=FAKE_RECEIPT_ID,
+            VisibilityTimeout=60
+        )
+
     def test_get_message_timeout(self):
         sqs = self._make_sqsclient()
 
@@ -16,6 +16,15 @@ class TestConfig(unittest.TestCase):
         conf2 = config.get_config()
         self.assertTrue(conf1 is conf2)
 
+    def test_set_config(self):
+        conf = mock.Mock()
+        original = config.get_config()
+        self.addCleanup(config.set_config, original)
+
+        config.set_config(conf)
+
+        self.assertIs(config.get_config(), conf)
+
     def test_required_attributes(self):
         conf = config.get_config()
 
@@ -28,3 +37,17 @@ class TestConfig(unittest.TestCase):
         self.assertIn('AWS_REGION', conf.__dict__)
         self.assertIn('IMGUR_CLIENT_ID', conf.__dict__)
         self.assertIn('IMGUR_MASHAPE_KEY', conf.__dict__)
+
+    def test_queues(self):
+        parser = self.mock_config()
+        parser.get.return_value = 'queue'
+        parser.has_section.return_value = True
+        parser.items.return_value = [('backfill', 'backfill-queue,1'),
+                                     ('hot', 'hot-queue, 5')]
+
+        conf = config.Config()
+
+        self.assertEqual(list(conf.QUEUES.items()), [
+            ('hot', ('hot-queue', 5)),
+            ('default', ('queue', 1)),
+            ('backfill', ('backfill-queue', 1))])
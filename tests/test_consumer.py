@@ -1,9 +1,400 @@
+import collections
 import unittest
 
 import mock
 
+from archiver import bloom
+from archiver import constants
 from archiver import consumer
+from archiver.persistence import base as base_persistence
+
+FAKE_POST_LINK = 'https://www.reddit.com/r/testsub/comments/12345/mypost/'
 
 
 class TestConsumer(unittest.TestCase):
-    pass
+    def setUp(self):
+        patcher = mock.patch('archiver.config.get_config')
+        self.mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_config().DEDUPE_FILTER_FILE = None
+        self.mock_config().CONSUMER_EMBED_POST_DATA = False
+        self.mock_config().CONSUMER_POST_DATA_MAX_AGE = 3600
+        self.mock_config().CONSUMER_BATCH_POSTS = False
+        self.mock_config().PERSISTENCE_CLAIM_LEASE = 300
+        self.mock_config().QUEUE_VISIBILITY_TIMEOUT = 300
+        self.mock_config().QUEUES = collections.OrderedDict(
+            [('default', ('queue', 1))])
+
+        for target in ('archiver.consumer.praw.Reddit',
+                       'archiver.clients.queue_client',
+                       'archiver.clients.persistence_client',
+                       'archiver.image_handling.DownloadHandler'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.consumer = consumer.Consumer()
+        self.message = mock.Mock(type=constants.MESSAGE_POST,
+                                 body={'post_link': FAKE_POST_LINK})
+        self.consumer.sqs.get_messages.return_value = [self.message]
+        self.consumer.persistence.after_flush.side_effect = (
+            lambda callback: callback())
+        self.consumer.persistence.has_post.return_value = False
+
+    def test_run_once(self):
+        mock_store_post = mock.Mock()
+        self.consumer._type_map[constants.MESSAGE_POST] = mock_store_post
+
+        self.consumer.run_once()
+
+        mock_store_post.assert_called_once_with(post_link=FAKE_POST_LINK)
+        self.message.finish.assert_called_once_with(self.consumer.sqs)
+
+    def test_run_once_post_claimed(self):
+        self.consumer.persistence.persist_post.side_effect = (
+            base_persistence.PostClaimed('12345'))
+
+        self.consumer.run_once()
+
+        # The message stays on the queue for another attempt later
+        self.message.finish.assert_not_called()
+        self.consumer.downloader.store_images.assert_not_called()
+
+    def test_run_once_idle_flushes(self):
+        self.consumer.sqs.get_messages.return_value = []
+
+        self.consumer.run_once()
+
+        self.consumer.persistence.flush.assert_called_once_with()
+
+    def _listing(self, *posts):
+        return [mock.Mock(id=post_id, created_utc=created,
+                          permalink='/r/testsub/comments/' + post_id)
+                for post_id, created in posts]
+
+    @mock.patch('archiver.messages.PostMessage')
+    def test_store_subreddit_incremental_new(self, mock_message):
+        praw_subreddit = self.consumer.r.subreddit.return_value
+        praw_subreddit.new.return_value = self._listing(
+            ('c', 300), ('b', 200), ('a', 100))
+        self.consumer.persistence.get_watermark.return_value = {
+            'created_utc': 200, 'id': 'b'}
+
+        self.consumer.store_subreddit('testsub', constants.QUERY_NEW, 10,
+                                      incremental=True)
+
+        # Stops at the mark and only enqueues the post newer than it
+        mock_message.assert_called_once_with('/r/testsub/comments/c',
+                                             post=None)
+        self.consumer.persistence.set_watermark.assert_called_once_with(
+            'testsub', constants.QUERY_NEW, 300, 'c')
+        self.consumer.persistence.record_crawl.assert_called_once_with(
+            'testsub', constants.QUERY_NEW, 1, 1)
+
+    @mock.patch('archiver.messages.PostMessage')
+    def test_store_subreddit_incremental_hot(self, mock_message):
+        praw_subreddit = self.consumer.r.subreddit.return_value
+        praw_subreddit.hot.return_value = self._listing(
+            ('a', 100), ('c', 300), ('b', 200))
+        self.consumer.archived = bloom.ScalableBloomFilter()
+        self.consumer.archived.add('b')
+        self.consumer.persistence.has_post.return_value = True
+
+        self.consumer.store_subreddit('testsub', constants.QUERY_HOT, 10,
+                                      incremental=True)
+
+        # Hot isn't sorted by age, an older post that only just rose into
+        # it is still new. Posts are told apart by id, not a watermark.
+        self.assertEqual(
+            [c[0][0] for c in mock_message.call_args_list],
+            ['/r/testsub/comments/a', '/r/testsub/comments/c'])
+        self.consumer.persistence.get_watermark.assert_not_called()
+        self.consumer.persistence.set_watermark.assert_not_called()
+        self.consumer.persistence.record_crawl.assert_called_once_with(
+            'testsub', constants.QUERY_HOT, 3, 2)
+
+    @mock.patch('archiver.messages.PostMessage')
+    def test_store_subreddit_incremental_nothing_new(self, mock_message):
+        praw_subreddit = self.consumer.r.subreddit.return_value
+        praw_subreddit.new.return_value = self._listing(('b', 200))
+        self.consumer.persistence.get_watermark.return_value = {
+            'created_utc': 200, 'id': 'b'}
+
+        self.consumer.store_subreddit('testsub', constants.QUERY_NEW, 10,
+                                      incremental=True)
+
+        mock_message.assert_not_called()
+        self.consumer.persistence.set_watermark.assert_not_called()
+
+    @mock.patch('archiver.messages.PostMessage')
+    def test_store_subreddit_skips_archived(self, mock_message):
+        self.consumer.archived = bloom.ScalableBloomFilter()
+        self.consumer.archived.add('a')
+        self.consumer.archived.add('b')
+        praw_subreddit = self.consumer.r.subreddit.return_value
+        praw_subreddit.hot.return_value = self._listing(
+            ('a', 100), ('b', 200), ('c', 300))
+        # 'b' is a false positive of the filter
+        self.consumer.persistence.has_post.side_effect = (
+            lambda post_id: post_id == 'a')
+
+        self.consumer.store_subreddit('testsub', constants.QUERY_HOT, 10)
+
+        self.assertEqual(
+            [c[0][0] for c in mock_message.call_args_list],
+            ['/r/testsub/comments/b', '/r/testsub/comments/c'])
+        self.assertEqual(self.consumer.persistence.has_post.call_count, 2)
+
+    @mock.patch('archiver.messages.PostMessage')
+    def test_store_subreddit_without_filter(self, mock_message):
+        praw_subreddit = self.consumer.r.subreddit.return_value
+        praw_subreddit.hot.return_value = self._listing(('a', 100),
+                                                        ('b', 200))
+
+        self.consumer.store_subreddit('testsub', constants.QUERY_HOT, 10)
+
+        # No filter, no lookups: every post is enqueued
+        self.assertEqual(mock_message.call_count, 2)
+        self.consumer.persistence.has_post.assert_not_called()
+
+    def test_store_post_remembers_archived(self):
+        self.consumer.archived = bloom.ScalableBloomFilter()
+        praw_post = self.consumer.r.submission.return_value
+        praw_post.id = '12345'
+        self.consumer.persistence.persist_post.return_value = False
+
+        self.consumer.store_post(FAKE_POST_LINK)
+
+        self.assertIn('12345', self.consumer.archived)
+
+    @mock.patch('archiver.consumer.time.time')
+    @mock.patch('archiver.messages.PostMessage')
+    def test_store_subreddit_embeds_post_data(self, mock_message, mock_time):
+        mock_time.return_value = 1000
+        self.mock_config().CONSUMER_EMBED_POST_DATA = True
+        praw_subreddit = self.consumer.r.subreddit.return_value
+        praw_subreddit.hot.return_value = self._listing(('a', 100))
+
+        self.consumer.store_subreddit('testsub', constants.QUERY_HOT, 10)
+
+        data = mock_message.call_args[1]['post']
+        self.assertEqual(data['id'], 'a')
+        self.assertEqual(data['created_utc'], 100)
+        self.assertEqual(data['fetched_utc'], 1000)
+
+    def _post_data(self, fetched_utc):
+        return {'id': '12345', 'title': 'title', 'permalink': FAKE_POST_LINK,
+                'url': 'http://i.imgur.com/asdf.jpg', 'author': 'user',
+                'created_utc': 100, 'over_18': False, 'subreddit': 'testsub',
+                'fetched_utc': fetched_utc}
+
+    @mock.patch('archiver.consumer.time.time')
+    def test_store_post_from_embedded_data(self, mock_time):
+        mock_time.return_value = 1000
+        self.consumer.persistence.persist_post.return_value = False
+
+        self.consumer.store_post(FAKE_POST_LINK, post=self._post_data(900))
+
+        # Reddit isn't asked again for fresh data
+        self.consumer.r.submission.assert_not_called()
+        praw_post = self.consumer.persistence.finalize_post.call_args[0][0]
+        self.assertEqual(praw_post.id, '12345')
+        self.assertEqual(praw_post.author.name, 'user')
+
+    @mock.patch('archiver.consumer.time.time')
+    def test_store_post_stale_embedded_data(self, mock_time):
+        mock_time.return_value = 10000
+        self.consumer.persistence.persist_post.return_value = False
+
+        self.consumer.store_post(FAKE_POST_LINK, post=self._post_data(900))
+
+        self.consumer.r.submission.assert_called_once_with(url=FAKE_POST_LINK)
+
+    def test_run_batch_bulk_lookup(self):
+        post_messages = self._post_messages('aaa', 'bbb', 'ccc')
+        self.consumer.sqs.get_messages.return_value = post_messages
+        self.consumer.r.info.return_value = [
+            mock.Mock(id='aaa'), mock.Mock(id='bbb')]
+        self.consumer.persistence.persist_post.return_value = True
+
+        self.consumer.run_batch()
+
+        # One Reddit request for all three posts
+        self.consumer.r.info.assert_called_once_with(
+            fullnames=['t3_aaa', 't3_bbb', 't3_ccc'])
+        self.consumer.r.submission.assert_not_called()
+        self.assertEqual(self.consumer.persistence.persist_post.call_count, 2)
+        # Missing posts are acknowledged like in store_post
+        for message in post_messages:
+            message.finish.assert_called_once_with(self.consumer.sqs)
+
+    def _post_messages(self, *post_ids):
+        return [mock.Mock(type=constants.MESSAGE_POST,
+                          body={'post_link': '/r/testsub/comments/{}/x/'
+                                .format(post_id)})
+                for post_id in post_ids]
+
+    def test_run_batch_failing_message(self):
+        post_messages = self._post_messages('aaa', 'bbb', 'ccc')
+        self.consumer.sqs.get_messages.return_value = post_messages
+        self.consumer.r.info.return_value = [
+            mock.Mock(id=post_id) for post_id in ('aaa', 'bbb', 'ccc')]
+
+        def persist_post(praw_post):
+            if praw_post.id == 'bbb':
+                raise ValueError("bad post")
+            return True
+        self.consumer.persistence.persist_post.side_effect = persist_post
+
+        self.consumer.run_batch()
+
+        # The rest of the batch is handled, the failed message stays queued
+        post_messages[0].finish.assert_called_once_with(self.consumer.sqs)
+        post_messages[1].finish.assert_not_called()
+        post_messages[2].finish.assert_called_once_with(self.consumer.sqs)
+        self.consumer.persistence.flush_if_due.assert_called_once_with()
+
+    def test_run_batch_lookup_fails(self):
+        post_messages = self._post_messages('aaa', 'bbb')
+        self.consumer.sqs.get_messages.return_value = post_messages
+        self.consumer.r.info.side_effect = IOError("reddit is down")
+        self.consumer.persistence.persist_post.return_value = True
+
+        self.consumer.run_batch()
+
+        # Fetched one at a time instead
+        self.assertEqual(self.consumer.r.submission.call_count, 2)
+        for message in post_messages:
+            message.finish.assert_called_once_with(self.consumer.sqs)
+
+    def test_run_batch_chunks_lookups(self):
+        self.consumer.r.info.side_effect = lambda fullnames: []
+
+        self.consumer._fetch_posts([str(i) for i in range(150)])
+
+        self.assertEqual(self.consumer.r.info.call_count, 2)
+
+    def test_run_batch_idle_flushes(self):
+        self.consumer.sqs.get_messages.return_value = []
+
+        self.consumer.run_batch()
+
+        self.consumer.persistence.flush.assert_called_once_with()
+        self.consumer.r.info.assert_not_called()
+
+    @mock.patch('archiver.messages.PostBatchMessage.enqueue')
+    def test_store_subreddit_batches_posts(self, mock_enqueue):
+        self.mock_config().CONSUMER_BATCH_POSTS = True
+        self.mock_config().CONSUMER_COMPRESS_BATCHES = False
+        praw_subreddit = self.consumer.r.subreddit.return_value
+        praw_subreddit.hot.return_value = self._listing(
+            ('a', 100), ('b', 200), ('c', 300))
+
+        self.consumer.store_subreddit('testsub', constants.QUERY_HOT, 10)
+
+        mock_enqueue.assert_called_once_with(self.consumer.sqs)
+
+    @mock.patch('archiver.messages.PostMessage.enqueue')
+    def test_store_post_batch_requeues_failures(self, mock_enqueue):
+        self.consumer.r.info.return_value = [
+            mock.Mock(id=post_id) for post_id in ('aaa', 'bbb', 'ccc')]
+        self.consumer.persistence.persist_post.side_effect = [
+            False, base_persistence.PostClaimed('bbb'), ValueError('ccc')]
+        posts = [{'post_link': '/r/testsub/comments/{}/x/'.format(post_id)}
+                 for post_id in ('aaa', 'bbb', 'ccc')]
+
+        self.consumer.store_post_batch(posts=posts)
+
+        self.consumer.r.info.assert_called_once_with(
+            fullnames=['t3_aaa', 't3_bbb', 't3_ccc'])
+        self.assertEqual(
+            self.consumer.persistence.finalize_post.call_count, 1)
+        # Failures go back on the queue on their own, claimed posts only
+        # once the claim has run out
+        self.assertEqual(mock_enqueue.call_args_list, [
+            mock.call(self.consumer.sqs),
+            mock.call(self.consumer.sqs, delay=300)])
+
+    @mock.patch('archiver.consumer.time.time')
+    def test_store_post_batch_extends_visibility(self, mock_time):
+        mock_time.return_value = 1000
+        self.consumer.sqs.get_messages.return_value = []
+        self.consumer._receive(1)
+        message = mock.Mock(id='receipt')
+        times = iter([1100, 1160, 1200, 1400, 1450])
+
+        def archive(praw_post, post_link):
+            mock_time.return_value = next(times)
+        self.consumer._archive_post = archive
+        self.consumer.r.info.return_value = [
+            mock.Mock(id=str(i)) for i in range(5)]
+        posts = [{'post_link': '/r/testsub/comments/{}/x/'.format(i)}
+                 for i in range(5)]
+
+        self.consumer._handle(message, lambda: self.consumer.store_post_batch(
+            posts=posts))
+
+        # Extended at 1160 and again at 1400, half a timeout after that
+        self.assertEqual(self.consumer.sqs.extend_visibility.call_args_list,
+                         [mock.call('receipt', 300)] * 2)
+
+
+class TestConsumerQueues(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('archiver.config.get_config')
+        self.mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_config().DEDUPE_FILTER_FILE = None
+        self.mock_config().QUEUES = collections.OrderedDict([
+            ('hot', ('hot-queue', 5)), ('default', ('queue', 1))])
+
+        self.clients = {'hot-queue': mock.Mock(), 'queue': mock.Mock()}
+        for target in ('archiver.consumer.praw.Reddit',
+                       'archiver.clients.persistence_client',
+                       'archiver.image_handling.DownloadHandler'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('archiver.clients.queue_client',
+                             side_effect=self.clients.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.consumer = consumer.Consumer()
+        self.consumer.persistence.after_flush.side_effect = (
+            lambda callback: callback())
+
+    def test_falls_through_to_queue_with_work(self):
+        message = mock.Mock(type=constants.MESSAGE_POST,
+                            body={'post_link': FAKE_POST_LINK})
+        self.consumer._type_map[constants.MESSAGE_POST] = mock.Mock()
+        self.clients['hot-queue'].get_messages.return_value = []
+        self.clients['queue'].get_messages.return_value = [message]
+
+        self.consumer.run_once()
+
+        # Acknowledged on the queue it came from, without a long poll
+        message.finish.assert_called_once_with(self.clients['queue'])
+        self.clients['queue'].get_messages.assert_called_with(
+            max_messages=1, wait=0)
+
+    def test_idle_queues_are_long_polled(self):
+        self.consumer._type_map[constants.MESSAGE_POST] = mock.Mock()
+        for client in self.clients.values():
+            client.get_messages.return_value = []
+
+        self.consumer.run_once()
+        self.consumer.run_once()
+
+        # An empty round is followed by long polls of every queue
+        for client in self.clients.values():
+            self.assertEqual(client.get_messages.call_args_list, [
+                mock.call(max_messages=1, wait=0),
+                mock.call(max_messages=1, wait=consumer.SQS_LONG_POLL // 2)
+            ])
+
+    def test_weighted_order(self):
+        hot = self.clients['hot-queue']
+        first = collections.Counter(
+            self.consumer._weighted_order()[0] for _ in range(600))
+        self.assertGreater(first[hot], first[self.clients['queue']])
@@ -0,0 +1,81 @@
+import decimal
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from archiver import export
+from archiver.persistence import base as base_persistence
+
+
+def _make_post(number, subreddit):
+    return {'id': 'post{}'.format(number), 'subreddit': subreddit,
+            'created_utc': decimal.Decimal(number), 'title': 'title',
+            'permalink': '/r/x/', 'url': 'http://i.imgur.com/a.jpg',
+            'user': 'test_user', 'nsfw': False, 'images': []}
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output)
+
+        self.persistence = mock.Mock(spec=base_persistence.Persistence)
+        self.persistence.scan_posts.side_effect = (
+            lambda segment, total: iter([
+                _make_post(segment * 10 + 1, 'pics'),
+                _make_post(segment * 10 + 2, 'aww/../x'),
+            ]))
+
+    def _read(self, name):
+        with gzip.open(os.path.join(self.output, name)) as f:
+            return [json.loads(line) for line in f]
+
+    def test_export_segments(self):
+        count = export.export(self.persistence, self.output, segments=3)
+
+        self.assertEqual(count, 6)
+        self.persistence.scan_posts.assert_has_calls([
+            mock.call(0, 3), mock.call(1, 3), mock.call(2, 3)
+        ], any_order=True)
+        pics = self._read('pics.jsonl.gz')
+        self.assertItemsEqual([p['id'] for p in pics],
+                              ['post1', 'post11', 'post21'])
+        self.assertEqual(sorted(p['created_utc'] for p in pics), [1, 11, 21])
+        self.assertEqual(len(self._read('aww____x.jsonl.gz')), 3)
+
+    def test_reopened_files_append(self):
+        writer = export.JsonlWriter(self.output, max_open=1)
+        writer.write(_make_post(1, 'pics'))
+        writer.write(_make_post(2, 'aww'))
+        writer.write(_make_post(3, 'pics'))
+        writer.close()
+
+        self.assertEqual([p['id'] for p in self._read('pics.jsonl.gz')],
+                         ['post1', 'post3'])
+
+    @unittest.skipIf(export.pyarrow is None, "requires pyarrow")
+    def test_parquet_bounds(self):
+        writer = export.ParquetWriter(self.output, row_group_size=2,
+                                      max_open=1, max_buffered=3)
+        for number, subreddit in enumerate(['pics', 'pics', 'aww', 'aww',
+                                            'pics']):
+            writer.write(_make_post(number, subreddit))
+        writer.close()
+
+        files = sorted(os.listdir(self.output))
+        self.assertEqual(files, ['aww.parquet', 'pics.1.parquet',
+                                 'pics.parquet'])
+        rows = sum(export.parquet.read_table(
+            os.path.join(self.output, name)).num_rows for name in files)
+        self.assertEqual(rows, 5)
+
+    def test_scan_error(self):
+        self.persistence.scan_posts.side_effect = NotImplementedError
+
+        self.assertRaises(NotImplementedError, export.export,
+                          self.persistence, self.output)
@@ -0,0 +1,152 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from archiver import feeds
+
+FAKE_SUBREDDIT_NAME = 'test_subreddit'
+FAKE_IMAGE = {'url': 'http://i.imgur.com/asdf.jpg', 'path': 'abcdef/asdf.jpg'}
+FAKE_NOW = 1000
+
+
+def _make_post(number, created_utc=None, images=()):
+    return {
+        'id': 'post{}'.format(number),
+        'subreddit': FAKE_SUBREDDIT_NAME,
+        'created_utc': number if created_utc is None else created_utc,
+        'title': 'title',
+        'permalink': '/r/x/',
+        'url': 'http://i.imgur.com/asdf.jpg',
+        'user': 'test_user',
+        'nsfw': False,
+        'images': list(images)
+    }
+
+
+class TestFeedMaterializer(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('archiver.config.get_config')
+        self.mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('archiver.clients.s3_client')
+        self.mock_s3 = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('time.time', return_value=FAKE_NOW)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output)
+
+        self.mock_config().FEED_OUTPUT = self.output
+        self.mock_config().FEED_PREFIX = 'feeds'
+        self.mock_config().FEED_PAGE_SIZE = 2
+        self.mock_config().FEED_SETTLE = 100
+
+        self.posts = []
+        self.persistence = mock.Mock()
+        self.persistence.feed_posts.side_effect = self._feed_posts
+        self.feeds = feeds.FeedMaterializer(self.persistence)
+
+    def _feed_posts(self, subreddit_name, after=None):
+        self.assertEqual(subreddit_name, FAKE_SUBREDDIT_NAME)
+        return iter(sorted(
+            (p for p in self.posts
+             if after is None or p['created_utc'] >= after),
+            key=lambda p: (p['created_utc'], p['id'])))
+
+    def _read(self, name):
+        path = os.path.join(self.output, 'feeds', FAKE_SUBREDDIT_NAME, name)
+        with gzip.open(path) as f:
+            return json.loads(f.read())
+
+    def _ids(self, page):
+        return [p['id'] for p in page['posts']]
+
+    def test_head_page(self):
+        # Too new to be sealed
+        self.posts = [_make_post(1, FAKE_NOW - 20, images=[FAKE_IMAGE]),
+                      _make_post(2, FAKE_NOW - 10)]
+
+        self.assertEqual(self.feeds.materialize(FAKE_SUBREDDIT_NAME), 0)
+
+        head = self._read(feeds.HEAD_PAGE)
+        self.assertEqual(self._ids(head), ['post2', 'post1'])
+        self.assertIsNone(head['next'])
+        self.assertEqual(head['posts'][1]['images']['i'],
+                         [[0, 'asdf.jpg', 'abcdef']])
+        self.mock_s3().upload.assert_not_called()
+
+    def test_settled_pages_are_sealed_oldest_first(self):
+        # Archived out of order, posts 7 and 8 are too new to be sealed
+        self.posts = [_make_post(i) for i in (5, 2, 1, 4, 3)]
+        self.posts += [_make_post(8, FAKE_NOW), _make_post(7, FAKE_NOW - 1)]
+
+        self.assertEqual(self.feeds.materialize(FAKE_SUBREDDIT_NAME), 2)
+
+        head = self._read(feeds.HEAD_PAGE)
+        page1 = self._read('page-1-1.json')
+        page0 = self._read('page-1-0.json')
+        self.assertEqual(self._ids(head), ['post8', 'post7', 'post5'])
+        self.assertEqual(head['next'], 'page-1-1.json')
+        self.assertEqual(self._ids(page1), ['post4', 'post3'])
+        self.assertEqual(page1['next'], 'page-1-0.json')
+        self.assertEqual(self._ids(page0), ['post2', 'post1'])
+        self.assertIsNone(page0['next'])
+
+    def test_sealed_pages_are_not_rewritten(self):
+        self.posts = [_make_post(1), _make_post(2, created_utc=2),
+                      _make_post(3, created_utc=2)]
+        self.feeds.materialize(FAKE_SUBREDDIT_NAME)
+        page0 = os.path.join(self.output, 'feeds', FAKE_SUBREDDIT_NAME,
+                             'page-1-0.json')
+        os.chmod(page0, 0o444)
+
+        # A late post for a sealed time and new posts in a later run, by a
+        # fresh materializer
+        self.posts += [_make_post(0), _make_post(4), _make_post(5)]
+        materializer = feeds.FeedMaterializer(self.persistence)
+        self.assertEqual(materializer.materialize(FAKE_SUBREDDIT_NAME), 1)
+
+        head = self._read(feeds.HEAD_PAGE)
+        self.assertEqual(self._ids(self._read('page-1-0.json')),
+                         ['post2', 'post1'])
+        self.assertEqual(self._ids(self._read('page-1-1.json')),
+                         ['post4', 'post3'])
+        self.assertEqual(self._ids(head), ['post5'])
+        self.persistence.feed_posts.assert_called_with(
+            FAKE_SUBREDDIT_NAME, after=2)
+
+    def test_rebuild_starts_new_generation(self):
+        self.posts = [_make_post(1), _make_post(2)]
+        self.feeds.materialize(FAKE_SUBREDDIT_NAME)
+        self.posts.append(_make_post(0))
+
+        self.feeds.materialize(FAKE_SUBREDDIT_NAME, rebuild=True)
+
+        head = self._read(feeds.HEAD_PAGE)
+        self.assertEqual(head['generation'], 2)
+        self.assertEqual(head['next'], 'page-2-0.json')
+        self.assertEqual(self._ids(self._read('page-2-0.json')),
+                         ['post1', 'post0'])
+        self.assertEqual(self._ids(self._read('page-1-0.json')),
+                         ['post2', 'post1'])
+        self.assertEqual(self._ids(head), ['post2'])
+
+    def test_s3_output(self):
+        self.mock_config().FEED_OUTPUT = 's3'
+        self.mock_s3().download.return_value = None
+        self.posts = [_make_post(1)]
+
+        self.feeds.materialize(FAKE_SUBREDDIT_NAME)
+
+        args = self.mock_s3().upload.call_args[0]
+        self.assertEqual(args[1], 'feeds/test_subreddit/head.json')
+        self.assertEqual(args[3]['ContentEncoding'], 'gzip')
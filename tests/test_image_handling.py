@@ -285,6 +285,26 @@ class TestDownloadHandler(unittest.TestCase):
         self.assertEqual(mock_req.call_count, 0)
         self.assertEqual(image, img1_ret)
 
+    @mock.patch('archiver.image_handling.Image')
+    @requests_mock.mock()
+    def test__album_objects_exist(self, mock_image, mock_req):
+        img1_ret = {'path': FAKE_IMAGE_PATH1, 'url': FAKE_IMAGE_URL1}
+        img2_ret = {'path': FAKE_IMAGE_PATH2, 'url': FAKE_IMAGE_URL2}
+        self.mock_imgur().get_album.return_value = [
+            FAKE_IMAGE_URL1, FAKE_IMAGE_URL2]
+        self.mock_persistence().get_images.return_value = {
+            FAKE_IMAGE_PATH1: img1_ret, FAKE_IMAGE_PATH2: img2_ret}
+        self.mock_s3().object_exists.return_value = True
+
+        images = self.dh._album(FAKE_IMAGE_ID1)
+
+        # All paths are resolved with one bulk lookup and nothing downloaded
+        self.mock_persistence().get_images.assert_called_once_with(
+            [FAKE_IMAGE_PATH1, FAKE_IMAGE_PATH2])
+        self.mock_persistence().get_image.assert_not_called()
+        self.assertEqual(mock_req.call_count, 0)
+        self.assertListEqual(images, [img1_ret, img2_ret])
+
     @mock.patch.object(image_handling.DownloadHandler, '_single')
     def test_store_images(self, mock_single):
         # Make a new DownloadHandler so it will use the _single mock
@@ -308,6 +328,47 @@ class TestDownloadHandler(unittest.TestCase):
         mock_single.assert_called_once_with(FAKE_IMAGE_ID1)
         self.assertListEqual(images, [image_mock])
 
+    def test_store_images_resolvers(self):
+        resolve = self.dh._resolve
+        self.assertEqual(resolve(FAKE_IMAGE_URL1)[0].name, 'imgur_single')
+        self.assertEqual(resolve('https://imgur.com/a/abcde')[0].name,
+                         'imgur_album')
+        self.assertEqual(resolve('https://m.imgur.com/r/pics/abc')[0].name,
+                         'imgur_page')
+        self.assertEqual(resolve(FAKE_GFY_WEBM)[0].name, 'gfycat')
+        self.assertEqual(resolve('https://i.redd.it/abc.jpg')[0].name,
+                         'reddit_image')
+        self.assertEqual(resolve('https://v.redd.it/abc')[0].name,
+                         'reddit_video')
+        self.assertEqual(
+            resolve('https://www.reddit.com/gallery/abc')[0].name,
+            'reddit_gallery')
+        self.assertEqual(resolve('https://example.com/a.png')[0].name,
+                         'external')
+        self.assertIsNone(resolve('https://example.com/page.html'))
+
+    @mock.patch.object(image_handling.DownloadHandler,
+                       '_download_imgur_urls')
+    def test_store_images_reddit_gallery(self, mock_download):
+        praw_post = mock.Mock()
+        praw_post.url = 'https://www.reddit.com/gallery/abc123'
+        praw_post.media = None
+        praw_post.gallery_data = {'items': [{'media_id': 'two'},
+                                            {'media_id': 'one'}]}
+        praw_post.media_metadata = {
+            'one': {'status': 'valid', 'm': 'image/png'},
+            'two': {'status': 'valid', 'm': 'image/jpg'},
+        }
+        image_mock = mock.Mock()
+        mock_download.return_value = [image_mock]
+
+        images = self.dh.store_images(praw_post)
+
+        # Gallery order is kept, images come straight from i.redd.it
+        mock_download.assert_called_once_with(
+            ['https://i.redd.it/two.jpg', 'https://i.redd.it/one.png'])
+        self.assertListEqual(images, [image_mock])
+
     @mock.patch('archiver.image_handling.Image')
     @requests_mock.mock()
     def test__single(self, mock_image, mock_req):
@@ -0,0 +1,40 @@
+import unittest
+
+import mock
+
+from archiver import config
+from archiver.bench import loadtest
+
+
+class TestStandin(unittest.TestCase):
+    def test_times_and_injects_errors(self):
+        recorder = loadtest.Recorder()
+        target = mock.Mock()
+        standin = loadtest.Standin(target, 's3', recorder,
+                                   loadtest.Service(error_rate=1.0))
+
+        self.assertRaises(loadtest.InjectedError, standin.upload, 'a')
+
+        target.upload.assert_not_called()
+        self.assertEqual(len(recorder.timings['s3']), 1)
+
+    def test_percentile(self):
+        recorder = loadtest.Recorder()
+        recorder.timings['stage'] = [float(i) for i in range(1, 101)]
+        self.assertEqual(recorder.percentile('stage', 50), 51)
+        self.assertEqual(recorder.percentile('stage', 99), 99)
+        self.assertIsNone(recorder.percentile('missing', 50))
+
+
+class TestLoadTest(unittest.TestCase):
+    # run() installs its own config, don't leak it into other tests
+    @mock.patch.dict(config._CONFIG)
+    def test_run(self):
+        report = loadtest.run(posts=4, embed=True, batch=True)
+
+        self.assertEqual(report['archived'], 4)
+        self.assertEqual(report['unfinished_messages'], 0)
+        self.assertEqual(report['stages']['archive_post']['count'], 4)
+        # Embedded post data means Reddit is never asked
+        self.assertNotIn('reddit', report['stages'])
+        self.assertIn(u"posts/sec", loadtest.format_report(report))
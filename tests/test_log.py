@@ -0,0 +1,66 @@
+import logging
+import logging.handlers
+import unittest
+
+from six.moves import queue
+
+from archiver import log
+
+
+def make_record(msg, args=(), level=logging.INFO, name='archiver.test'):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+class TestFilters(unittest.TestCase):
+    def test_context(self):
+        context_filter = log.ContextFilter()
+        record = make_record(u"outside")
+        with log.context(message='STORE_POST'):
+            with log.context(post='abc'):
+                context_filter.filter(record)
+                self.assertEqual(record.context,
+                                 u"[message=STORE_POST] [post=abc] ")
+        context_filter.filter(record)
+        self.assertEqual(record.context, u"")
+
+    def test_sampling(self):
+        sampling = log.SamplingFilter(every=3)
+        passed = [sampling.filter(make_record(u"Storing post: %s", (i,)))
+                  for i in range(7)]
+        self.assertEqual(passed, [True, False, False, True, False, False,
+                                  True])
+        # Other lines are counted separately, warnings always pass
+        self.assertTrue(sampling.filter(make_record(u"Other: %s", (1,))))
+        self.assertTrue(all(sampling.filter(make_record(
+            u"Storing post: %s", (i,), logging.WARNING)) for i in range(3)))
+
+
+class TestQueueHandler(unittest.TestCase):
+    def test_prepare_formats_arguments(self):
+        handler = log.QueueHandler(queue.Queue())
+        items = ['a']
+        handler.handle(make_record(u"Items: %s", (items,)))
+        items.append('b')
+
+        record = handler.queue.get_nowait()
+        self.assertEqual(record.getMessage(), u"Items: ['a']")
+
+    def test_drops_when_full(self):
+        handler = log.QueueHandler(queue.Queue(maxsize=1))
+        handler.handle(make_record(u"first"))
+        handler.handle(make_record(u"second"))
+
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual(handler.queue.get_nowait().getMessage(), u"first")
+
+    def test_listener(self):
+        records = queue.Queue()
+        handler = log.QueueHandler(records)
+        output = logging.handlers.BufferingHandler(10)
+        listener = log.QueueListener(records, output)
+        listener.start()
+        handler.handle(make_record(u"Storing post: %s", ('abc',)))
+        listener.stop()
+
+        self.assertEqual([r.getMessage() for r in output.buffer],
+                         [u"Storing post: abc"])
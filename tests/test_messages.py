@@ -46,12 +46,24 @@ class TestSubredditMessage(unittest.TestCase):
         })
         self.assertEqual(str(message), expected_str)
 
+    def test_body_incremental(self):
+        message = messages.SubredditMessage(FAKE_SUBREDDIT_NAME,
+                                            incremental=True)
+        self.assertTrue(message.body['incremental'])
+
     def test_enqueue(self):
         message = messages.SubredditMessage(FAKE_SUBREDDIT_NAME)
         mock_queue = mock.Mock(spec=clients.SQSClient)
         message.enqueue(mock_queue)
         mock_queue.send_message.assert_called_once_with(str(message))
 
+    def test_enqueue_delay(self):
+        message = messages.SubredditMessage(FAKE_SUBREDDIT_NAME)
+        mock_queue = mock.Mock(spec=clients.SQSClient)
+        message.enqueue(mock_queue, delay=60)
+        mock_queue.send_message.assert_called_once_with(str(message),
+                                                        delay=60)
+
     def test_finish(self):
         message = messages.SubredditMessage(FAKE_SUBREDDIT_NAME,
                                             mid=FAKE_MESSAGE_ID)
@@ -73,6 +85,12 @@ class TestPostMessage(unittest.TestCase):
         })
         self.assertEqual(str(message), expected_str)
 
+    def test_body_with_post(self):
+        post = {'id': '12345', 'fetched_utc': 1000}
+        message = messages.PostMessage(FAKE_POST_LINK, post=post)
+        self.assertEqual(message.body, {"post_link": FAKE_POST_LINK,
+                                        "post": post})
+
     def test_enqueue(self):
         message = messages.PostMessage(FAKE_POST_LINK)
         mock_queue = mock.Mock(spec=clients.SQSClient)
@@ -90,3 +108,47 @@ class TestPostMessage(unittest.TestCase):
         message = messages.PostMessage(FAKE_POST_LINK)
         mock_queue = mock.Mock(spec=clients.SQSClient)
         self.assertRaises(AttributeError, message.finish, mock_queue)
+
+
+class TestPostBatchMessage(unittest.TestCase):
+    def _post_messages(self, num):
+        return [messages.PostMessage(FAKE_POST_LINK + str(i))
+                for i in range(num)]
+
+    def test_compressed_round_trip(self):
+        posts = [m.body for m in self._post_messages(3)]
+        message = messages.PostBatchMessage(posts, compress=True)
+        self.assertIn("z", message.body)
+
+        decoded = messages.PostBatchMessage(mid=FAKE_MESSAGE_ID,
+                                            **message.body)
+        self.assertEqual(decoded.posts, posts)
+        self.assertEqual(decoded.type, constants.MESSAGE_POST_BATCH)
+
+    def test_pack_posts(self):
+        post_messages = self._post_messages(100)
+
+        batches = messages.pack_posts(post_messages, max_size=2000)
+
+        self.assertGreater(len(batches), 1)
+        self.assertTrue(all(len(str(b)) <= 2000 for b in batches))
+        self.assertEqual(sum([b.posts for b in batches], []),
+                         [m.body for m in post_messages])
+
+    def test_pack_posts_max_posts(self):
+        post_messages = self._post_messages(10)
+
+        batches = messages.pack_posts(post_messages, max_posts=4)
+
+        self.assertEqual([len(b.posts) for b in batches], [4, 4, 2])
+
+    def test_pack_posts_compressed(self):
+        post_messages = self._post_messages(100)
+
+        batches = messages.pack_posts(post_messages, compress=True,
+                                      max_size=2000)
+
+        # Repetitive links compress well, so fewer batches are needed
+        self.assertLess(len(batches), len(messages.pack_posts(
+            post_messages, max_size=2000)))
+        self.assertTrue(all(len(str(b)) <= 2000 for b in batches))
@@ -0,0 +1,81 @@
+import unittest
+
+import mock
+import requests
+
+from archiver import metrics
+from archiver.persistence import base as base_persistence
+from archiver.persistence import metered
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_exposition(self):
+        counter = self.registry.counter('test_total', 'Test counter.',
+                                        ['type'])
+        counter.inc(type='a')
+        counter.inc(2, type='b"\n')
+
+        self.assertEqual(self.registry.expose(), (
+            u'# HELP test_total Test counter.\n'
+            u'# TYPE test_total counter\n'
+            u'test_total{type="a"} 1.0\n'
+            u'test_total{type="b\\"\\n"} 2.0\n'))
+        self.assertRaises(ValueError, counter.inc, other='a')
+
+    def test_histogram_exposition(self):
+        histogram = self.registry.histogram('test_seconds', 'Test.',
+                                            buckets=[0.1, 1])
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        self.assertEqual(self.registry.expose().splitlines()[2:], [
+            u'test_seconds_bucket{le="0.1"} 1.0',
+            u'test_seconds_bucket{le="1.0"} 2.0',
+            u'test_seconds_bucket{le="+Inf"} 3.0',
+            u'test_seconds_sum 5.55',
+            u'test_seconds_count 3.0',
+        ])
+
+    def test_timed_outcome(self):
+        histogram = self.registry.histogram('test_seconds', 'Test.',
+                                            ['stage', 'outcome'])
+        with metrics.timed(histogram, stage='a'):
+            pass
+        with self.assertRaises(KeyError):
+            with metrics.timed(histogram, stage='a'):
+                raise KeyError()
+
+        self.assertEqual(histogram.count(stage='a', outcome='ok'), 1)
+        self.assertEqual(histogram.count(stage='a', outcome='error'), 1)
+
+    def test_http_server(self):
+        self.registry.counter('test_total', 'Test counter.').inc()
+        server = metrics.start_http_server(0, registry=self.registry)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        resp = requests.get('http://127.0.0.1:{}/metrics'
+                            .format(server.server_port))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(u'test_total 1.0', resp.text)
+
+
+class TestMeteredPersistence(unittest.TestCase):
+    @mock.patch('archiver.config.get_config')
+    def test_calls_are_timed(self, mock_config):
+        driver = mock.Mock(spec=base_persistence.Persistence)
+        db = metered.MeteredPersistence(driver=driver)
+        before = metrics.STAGE_SECONDS.count(
+            stage='persistence.persist_post', outcome='ok')
+
+        self.assertEqual(db.persist_post('post'),
+                         driver.persist_post.return_value)
+
+        driver.persist_post.assert_called_once_with('post')
+        self.assertEqual(metrics.STAGE_SECONDS.count(
+            stage='persistence.persist_post', outcome='ok'), before + 1)
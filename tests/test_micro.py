@@ -0,0 +1,63 @@
+import unittest
+
+import mock
+
+from archiver import config
+from archiver.bench import micro
+
+
+class TestCompare(unittest.TestCase):
+    def test_regressions_beyond_tolerance(self):
+        baseline = {'decode/JPEG/small': 1.0, 'thumbnail/JPEG/small': 1.0,
+                    'colors/JPEG/small': 1.0}
+        results = {'decode/JPEG/small': 1.1, 'thumbnail/JPEG/small': 1.3,
+                   'colors/JPEG/small': 0.5, 'classify': 2.0}
+
+        self.assertEqual(micro.compare(results, baseline, tolerance=0.2),
+                         [('thumbnail/JPEG/small', 1.0, 1.3)])
+
+    def test_scaled_by_calibration(self):
+        baseline = {micro.CALIBRATION: 1.0, 'decode/JPEG/small': 1.0,
+                    'thumbnail/JPEG/small': 1.0}
+        # The whole machine ran 50% slower, thumbnails 25% more than that
+        results = {micro.CALIBRATION: 1.5, 'decode/JPEG/small': 1.5,
+                   'thumbnail/JPEG/small': 1.875}
+
+        self.assertEqual(micro.compare(results, baseline, tolerance=0.2),
+                         [('thumbnail/JPEG/small', 1.5, 1.875)])
+
+
+class TestMeasure(unittest.TestCase):
+    def test_min_repeat_beyond_max_time(self):
+        func = mock.Mock()
+
+        micro.measure(func, repeat=10, min_time=0, max_time=0)
+
+        # Every call took long enough, but a single repeat isn't trusted.
+        # One more call found how many to time per repeat.
+        self.assertEqual(func.call_count, micro.MIN_REPEAT + 1)
+
+    def test_scaled_by_reference(self):
+        times = iter([0, 1,  # finding the number of calls
+                      0, 2, 2, 4, 4, 6,  # calibration, func, calibration
+                      6, 7, 7, 8.5, 8.5, 9.5])
+        with mock.patch.object(micro, 'cpu_time', lambda: next(times)):
+            best = micro.measure(mock.Mock(), repeat=2, min_time=0,
+                                 reference=1.0)
+
+        # The first repeat ran while the machine was at half speed
+        self.assertEqual(best, 1.0)
+
+
+class TestRun(unittest.TestCase):
+    # run() installs its own config, don't leak it into other tests
+    @mock.patch.dict(config._CONFIG)
+    def test_run(self):
+        results = micro.run(formats=['PNG'], sizes=['small'], repeat=1)
+
+        self.assertEqual(list(results), [micro.CALIBRATION,
+                                         'decode/PNG/small',
+                                         'thumbnail/PNG/small',
+                                         'colors/PNG/small', 'classify'])
+        self.assertTrue(all(seconds > 0 for seconds in results.values()))
+        self.assertIn(u"decode/PNG/small", micro.format_results(results))
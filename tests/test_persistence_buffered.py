@@ -0,0 +1,88 @@
+import unittest
+
+import mock
+
+from archiver.persistence import base as base_persistence
+from archiver.persistence import buffered
+
+FAKE_POST_ID = 'post1'
+FAKE_IMAGE_PATH1 = 'abcdef/asdf.jpg'
+FAKE_IMAGE_PATH2 = '123456/ghjk.jpg'
+FAKE_IMAGE1 = {'path': FAKE_IMAGE_PATH1, 'url': 'http://i.imgur.com/asdf.jpg'}
+FAKE_IMAGE2 = {'path': FAKE_IMAGE_PATH2, 'url': 'http://i.imgur.com/ghjk.jpg'}
+
+
+class TestBufferedPersistence(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('archiver.config.get_config')
+        self.mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('archiver.persistence.buffered.time.time')
+        self.mock_time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_time.return_value = 100
+
+        self.mock_config().PERSISTENCE_BUFFER_SIZE = 3
+        self.mock_config().PERSISTENCE_BUFFER_LATENCY = 5
+
+        self.driver = mock.Mock(spec=base_persistence.Persistence)
+        self.db = buffered.BufferedPersistence(driver=self.driver)
+
+        self.praw_post = mock.Mock(id=FAKE_POST_ID, created_utc=0)
+
+    def test_after_flush_nothing_pending(self):
+        callback = mock.Mock()
+
+        self.db.after_flush(callback)
+
+        callback.assert_called_once_with()
+        self.driver.write_batch.assert_not_called()
+
+    def test_flush_on_size(self):
+        callback = mock.Mock()
+        self.db.persist_images([FAKE_IMAGE1])
+        self.db.after_flush(callback)
+
+        # Still below buffer_size, so nothing is written or acknowledged
+        callback.assert_not_called()
+
+        self.db.persist_images([FAKE_IMAGE2])
+        self.db.finalize_post(self.praw_post, [FAKE_IMAGE1, FAKE_IMAGE2])
+        self.db.flush_if_due()
+
+        self.driver.write_batch.assert_called_once()
+        images, posts = self.driver.write_batch.call_args[0]
+        self.assertItemsEqual(images, [FAKE_IMAGE1, FAKE_IMAGE2])
+        self.assertEqual(posts[0][0].id, FAKE_POST_ID)
+        callback.assert_called_once_with()
+
+    def test_flush_on_latency(self):
+        callback = mock.Mock()
+        self.db.persist_images([FAKE_IMAGE1])
+        self.db.after_flush(callback)
+
+        self.mock_time.return_value = 106
+        self.db.flush_if_due()
+
+        self.driver.write_batch.assert_called_once_with([FAKE_IMAGE1], [])
+        callback.assert_called_once_with()
+
+    def test_failed_flush_skips_callbacks(self):
+        callback = mock.Mock()
+        self.driver.write_batch.side_effect = (
+            base_persistence.PersistenceError)
+        self.db.persist_images([FAKE_IMAGE1])
+        self.db.after_flush(callback)
+
+        self.assertRaises(base_persistence.PersistenceError, self.db.flush)
+        callback.assert_not_called()
+
+    def test_get_images_sees_buffered(self):
+        self.db.persist_images([FAKE_IMAGE1])
+        self.driver.get_images.return_value = {}
+
+        images = self.db.get_images([FAKE_IMAGE_PATH1, FAKE_IMAGE_PATH2])
+
+        self.driver.get_images.assert_called_once_with([FAKE_IMAGE_PATH2])
+        self.assertEqual(images, {FAKE_IMAGE_PATH1: FAKE_IMAGE1})
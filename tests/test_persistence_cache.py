@@ -0,0 +1,100 @@
+import unittest
+
+import mock
+
+from archiver.persistence import base as base_persistence
+from archiver.persistence import cache
+
+FAKE_SUBREDDIT_NAME = 'test_subreddit'
+FAKE_POST_ID = 'post1'
+FAKE_IMAGE_PATH1 = 'abcdef/asdf.jpg'
+FAKE_IMAGE_PATH2 = '123456/ghjk.jpg'
+FAKE_IMAGE1 = {'path': FAKE_IMAGE_PATH1, 'url': 'http://i.imgur.com/asdf.jpg'}
+FAKE_IMAGE2 = {'path': FAKE_IMAGE_PATH2, 'url': 'http://i.imgur.com/ghjk.jpg'}
+
+
+class TestLRUCache(unittest.TestCase):
+    @mock.patch('archiver.persistence.cache.time.time')
+    def test_ttl(self, mock_time):
+        lru = cache.LRUCache(max_size=10, ttl=5)
+        mock_time.return_value = 100
+        lru.set('a', 1)
+
+        mock_time.return_value = 104
+        self.assertEqual(lru.get('a'), 1)
+        mock_time.return_value = 106
+        self.assertIsNone(lru.get('a'))
+
+    def test_evicts_least_recently_used(self):
+        lru = cache.LRUCache(max_size=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('c'), 3)
+        self.assertEqual(len(lru), 2)
+
+
+class TestCachingPersistence(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('archiver.config.get_config')
+        self.mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.mock_config().PERSISTENCE_CACHE_SIZE = 100
+        self.mock_config().PERSISTENCE_CACHE_TTL = 60
+
+        self.driver = mock.Mock(spec=base_persistence.Persistence)
+        self.db = cache.CachingPersistence(driver=self.driver)
+
+    def test_subreddit_state_cached(self):
+        praw_subreddit = mock.Mock()
+        praw_subreddit.display_name = FAKE_SUBREDDIT_NAME
+        self.driver.get_subreddit_state.return_value = None
+
+        # Unknown subreddits are cached too
+        self.assertIsNone(self.db.get_subreddit_state(FAKE_SUBREDDIT_NAME))
+        self.assertIsNone(self.db.get_subreddit_state(FAKE_SUBREDDIT_NAME))
+        self.driver.get_subreddit_state.assert_called_once_with(
+            FAKE_SUBREDDIT_NAME)
+
+        # Crawling the subreddit invalidates its state
+        self.db.persist_subreddit(praw_subreddit)
+        self.driver.persist_subreddit.assert_called_once_with(praw_subreddit)
+        self.db.get_subreddit_state(FAKE_SUBREDDIT_NAME)
+        self.assertEqual(self.driver.get_subreddit_state.call_count, 2)
+
+        # So does recording a crawl of one of its listings
+        self.db.record_crawl(FAKE_SUBREDDIT_NAME, 'get_hot', 10, 2)
+        self.db.get_subreddit_state(FAKE_SUBREDDIT_NAME)
+        self.assertEqual(self.driver.get_subreddit_state.call_count, 3)
+
+    def test_persist_post_caches_existing_only(self):
+        praw_post = mock.Mock()
+        praw_post.id = FAKE_POST_ID
+        self.driver.persist_post.return_value = False
+
+        self.assertFalse(self.db.persist_post(praw_post))
+        self.assertFalse(self.db.persist_post(praw_post))
+        self.assertEqual(self.driver.persist_post.call_count, 2)
+
+        # Finalizing writes through, so the next check is a cache hit
+        self.db.finalize_post(praw_post, [])
+        self.assertTrue(self.db.persist_post(praw_post))
+        self.assertEqual(self.driver.persist_post.call_count, 2)
+
+    def test_get_images_write_through(self):
+        self.db.persist_images([FAKE_IMAGE1])
+        self.driver.get_images.return_value = {FAKE_IMAGE_PATH2: FAKE_IMAGE2}
+
+        images = self.db.get_images([FAKE_IMAGE_PATH1, FAKE_IMAGE_PATH2])
+
+        # Only the uncached path goes to the wrapped driver
+        self.driver.get_images.assert_called_once_with([FAKE_IMAGE_PATH2])
+        self.assertEqual(images, {FAKE_IMAGE_PATH1: FAKE_IMAGE1,
+                                  FAKE_IMAGE_PATH2: FAKE_IMAGE2})
+        self.assertEqual(self.db.get_image(FAKE_IMAGE_PATH2), FAKE_IMAGE2)
+        self.driver.get_image.assert_not_called()
@@ -0,0 +1,353 @@
+import decimal
+import unittest
+
+from botocore import exceptions as boto_exceptions
+import mock
+
+from archiver import constants
+from archiver.persistence import base as base_persistence
+from archiver.persistence import dynamo
+
+FAKE_POST_ID = 'post1'
+FAKE_SUBREDDIT_NAME = 'test_subreddit'
+FAKE_IMAGE_PATH1 = 'abcdef/asdf.jpg'
+FAKE_IMAGE_PATH2 = '123456/ghjk.jpg'
+FAKE_IMAGE1 = {'path': FAKE_IMAGE_PATH1, 'url': 'http://i.imgur.com/asdf.jpg'}
+FAKE_IMAGE2 = {'path': FAKE_IMAGE_PATH2, 'url': 'http://i.imgur.com/ghjk.jpg'}
+
+
+class TestDynamoPersistence(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('archiver.config.get_config')
+        self.mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('archiver.persistence.dynamo.clients.get_session')
+        self.mock_session = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('archiver.persistence.dynamo.time.sleep')
+        self.mock_sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.mock_config().PERSISTENCE_CLAIM_LEASE = 300
+
+        self.mock_db = self.mock_session().resource()
+        self.mock_db.Table.side_effect = lambda t: mock.MagicMock()
+        self.mock_client = self.mock_db.meta.client
+
+        self.db = dynamo.DynamoPersistence()
+
+    def test_init_existing_tables(self):
+        # Every table is described and none are created or waited on
+        self.mock_client.describe_table.assert_has_calls([
+            mock.call(TableName=t) for t in dynamo.TABLE_DEFINITIONS
+        ], any_order=True)
+        self.mock_db.create_table.assert_not_called()
+        self.mock_client.get_waiter().wait.assert_not_called()
+        self.mock_db.tables.all.assert_not_called()
+        self.mock_sleep.assert_not_called()
+
+    def test_init_creates_missing_table(self):
+        self.mock_client.reset_mock()
+        self.mock_client.describe_table.side_effect = (
+            lambda TableName: self._describe_table(TableName))
+
+        dynamo.DynamoPersistence()
+
+        self.mock_db.create_table.assert_called_once_with(
+            **dynamo.TABLE_DEFINITIONS[dynamo.IMAGE_TABLE])
+        self.mock_client.get_waiter.assert_called_once_with('table_exists')
+        self.mock_client.get_waiter().wait.assert_called_once_with(
+            TableName=dynamo.IMAGE_TABLE)
+
+    def test_init_skip_ensure(self):
+        self.mock_client.reset_mock()
+        self.mock_config().PERSISTENCE_ENSURE_TABLES = False
+
+        dynamo.DynamoPersistence()
+
+        self.mock_client.describe_table.assert_not_called()
+
+    @staticmethod
+    def _describe_table(table_name):
+        if table_name == dynamo.IMAGE_TABLE:
+            raise boto_exceptions.ClientError(
+                {'Error': {'Code': 'ResourceNotFoundException',
+                           'Message': 'Not found'}}, 'DescribeTable')
+        return {}
+
+    def test_get_images_retries_unprocessed_keys(self):
+        unprocessed = {dynamo.IMAGE_TABLE: {
+            'Keys': [{'path': FAKE_IMAGE_PATH2}]}}
+        self.mock_db.batch_get_item.side_effect = [
+            {'Responses': {dynamo.IMAGE_TABLE: [FAKE_IMAGE1]},
+             'UnprocessedKeys': unprocessed},
+            {'Responses': {dynamo.IMAGE_TABLE: [FAKE_IMAGE2]},
+             'UnprocessedKeys': {}},
+        ]
+
+        images = self.db.get_images([FAKE_IMAGE_PATH1, FAKE_IMAGE_PATH2])
+
+        self.assertEqual(images, {FAKE_IMAGE_PATH1: FAKE_IMAGE1,
+                                  FAKE_IMAGE_PATH2: FAKE_IMAGE2})
+        self.assertEqual(self.mock_db.batch_get_item.call_count, 2)
+        self.mock_db.batch_get_item.assert_called_with(
+            RequestItems=unprocessed)
+
+    def test_get_images_batches_keys(self):
+        self.mock_db.batch_get_item.return_value = {'Responses': {}}
+        paths = ['{}/image.jpg'.format(i)
+                 for i in range(dynamo.BATCH_GET_SIZE + 1)]
+
+        images = self.db.get_images(paths)
+
+        self.assertEqual(images, {})
+        self.assertEqual(self.mock_db.batch_get_item.call_count, 2)
+
+    def _condition_failed(self):
+        return boto_exceptions.ClientError(
+            {'Error': {'Code': 'ConditionalCheckFailedException',
+                       'Message': 'The conditional request failed'}},
+            'PutItem')
+
+    @mock.patch('archiver.persistence.dynamo.time.time')
+    def test_persist_subreddit(self, mock_time):
+        mock_time.return_value = 1000
+        praw_subreddit = mock.Mock(id='abc', title='title')
+        praw_subreddit.display_name = FAKE_SUBREDDIT_NAME
+        table = self.db.tables[dynamo.SUBREDDIT_TABLE]
+
+        self.db.persist_subreddit(praw_subreddit)
+
+        # A single write records the crawl, nothing is read first
+        table.get_item.assert_not_called()
+        kwargs = table.update_item.call_args[1]
+        self.assertEqual(kwargs['Key'], {'name': FAKE_SUBREDDIT_NAME})
+        self.assertEqual(kwargs['ExpressionAttributeValues'][':now'], 1000)
+
+    def test_get_subreddit_state(self):
+        table = self.db.tables[dynamo.SUBREDDIT_TABLE]
+        table.get_item.return_value = {'Item': {
+            'last_crawled': decimal.Decimal(1000),
+            'post_count': decimal.Decimal(12),
+            'depth_get_hot': decimal.Decimal(50),
+            'new_posts_get_hot': decimal.Decimal(20)}}
+
+        state = self.db.get_subreddit_state(FAKE_SUBREDDIT_NAME)
+
+        # A single read, the posts aren't counted
+        self.db.tables[dynamo.POST_TABLE].query.assert_not_called()
+        self.assertEqual(state, {
+            'last_crawled': 1000, 'post_count': 12,
+            'listings': {constants.QUERY_HOT: {'depth': 50, 'new_posts': 20}}
+        })
+        table.get_item.return_value = {}
+        self.assertIsNone(self.db.get_subreddit_state(FAKE_SUBREDDIT_NAME))
+        self.assertFalse(self.db.has_subreddit(FAKE_SUBREDDIT_NAME))
+
+    def test_record_crawl(self):
+        table = self.db.tables[dynamo.SUBREDDIT_TABLE]
+
+        self.db.record_crawl(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 50, 20)
+
+        kwargs = table.update_item.call_args[1]
+        self.assertIn('post_count :new', kwargs['UpdateExpression'])
+        self.assertEqual(kwargs['ExpressionAttributeNames'], {
+            '#depth': 'depth_get_hot', '#new': 'new_posts_get_hot'})
+        self.assertEqual(kwargs['ExpressionAttributeValues'],
+                         {':depth': 50, ':new': 20})
+
+    def test_watermark(self):
+        table = self.db.tables[dynamo.SUBREDDIT_TABLE]
+        table.get_item.return_value = {'Item': {'watermark_get_hot': {
+            'created_utc': decimal.Decimal(200), 'id': 'b'}}}
+
+        self.assertEqual(
+            self.db.get_watermark(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT),
+            {'created_utc': 200, 'id': 'b'})
+
+        # A stale mark fails the condition and is silently dropped
+        table.update_item.side_effect = self._condition_failed()
+        self.db.set_watermark(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT,
+                              100, 'a')
+        kwargs = table.update_item.call_args[1]
+        self.assertEqual(kwargs['ExpressionAttributeNames'],
+                         {'#mark': 'watermark_get_hot'})
+        self.assertEqual(kwargs['ExpressionAttributeValues'][':created'],
+                         100)
+
+    @mock.patch('archiver.persistence.dynamo.time.time')
+    def test_persist_post_claims_new_post(self, mock_time):
+        mock_time.return_value = 1000
+        praw_post = mock.Mock(id=FAKE_POST_ID)
+        table = self.db.tables[dynamo.POST_TABLE]
+
+        self.assertFalse(self.db.persist_post(praw_post))
+
+        table.put_item.assert_called_once_with(
+            Item={'id': FAKE_POST_ID, 'claimed_until': 1300},
+            ConditionExpression=('attribute_not_exists(id) OR '
+                                 'claimed_until < :now'),
+            ExpressionAttributeValues={':now': 1000}
+        )
+        table.get_item.assert_not_called()
+
+    def test_persist_post_finalized(self):
+        praw_post = mock.Mock(id=FAKE_POST_ID)
+        table = self.db.tables[dynamo.POST_TABLE]
+        table.put_item.side_effect = self._condition_failed()
+        table.get_item.return_value = {'Item': {}}
+
+        self.assertTrue(self.db.persist_post(praw_post))
+
+    def test_persist_post_claimed_elsewhere(self):
+        praw_post = mock.Mock(id=FAKE_POST_ID)
+        table = self.db.tables[dynamo.POST_TABLE]
+        table.put_item.side_effect = self._condition_failed()
+        table.get_item.return_value = {'Item': {'claimed_until': 1300}}
+
+        self.assertRaises(base_persistence.PostClaimed,
+                          self.db.persist_post, praw_post)
+
+    def test_has_post(self):
+        table = self.db.tables[dynamo.POST_TABLE]
+        table.get_item.return_value = {'Item': {'id': FAKE_POST_ID}}
+        self.assertTrue(self.db.has_post(FAKE_POST_ID))
+
+        # Neither a claimed nor a missing post counts as archived
+        table.get_item.return_value = {
+            'Item': {'id': FAKE_POST_ID, 'claimed_until': 1300}}
+        self.assertFalse(self.db.has_post(FAKE_POST_ID))
+        table.get_item.return_value = {}
+        self.assertFalse(self.db.has_post(FAKE_POST_ID))
+        table.put_item.assert_not_called()
+
+    def test_write_batch(self):
+        praw_post = mock.Mock(id=FAKE_POST_ID, created_utc=0)
+        praw_post.subreddit.display_name = FAKE_SUBREDDIT_NAME
+        self.mock_db.batch_write_item.side_effect = [
+            {'UnprocessedItems': {dynamo.IMAGE_TABLE: [
+                {'PutRequest': {'Item': FAKE_IMAGE1}}]}},
+            {'UnprocessedItems': {}},
+        ]
+
+        # The repeated image is only written once
+        self.db.write_batch([FAKE_IMAGE1, FAKE_IMAGE1, FAKE_IMAGE2],
+                            [(praw_post, [FAKE_IMAGE1, FAKE_IMAGE2])])
+
+        self.assertEqual(self.mock_db.batch_write_item.call_count, 2)
+        request = self.mock_db.batch_write_item.call_args_list[0][1][
+            'RequestItems']
+        self.assertEqual(len(request[dynamo.IMAGE_TABLE]), 2)
+        self.assertEqual(len(request[dynamo.POST_TABLE]), 1)
+        # Nothing but the batch is written
+        self.db.tables[dynamo.SUBREDDIT_TABLE].update_item.assert_not_called()
+
+    def test_write_batch_gives_up(self):
+        self.mock_db.batch_write_item.return_value = {
+            'UnprocessedItems': {dynamo.IMAGE_TABLE: [
+                {'PutRequest': {'Item': FAKE_IMAGE1}}]}}
+
+        self.assertRaises(base_persistence.PersistenceError,
+                          self.db.write_batch, [FAKE_IMAGE1], [])
+
+    def test_post_item_feed_keys(self):
+        praw_post = mock.Mock(id=FAKE_POST_ID, created_utc=1500000000.5)
+        praw_post.subreddit.display_name = FAKE_SUBREDDIT_NAME
+
+        item = self.db._post_item(praw_post, [])
+
+        self.assertEqual(item['created_utc'], 1500000000)
+        self.assertEqual(item['subreddit'], FAKE_SUBREDDIT_NAME)
+
+    def test_parse_created(self):
+        self.assertEqual(dynamo._parse_created('2017-07-14 02:40:00'),
+                         1500000000)
+        self.assertEqual(dynamo._parse_created('2017-07-14 02:40:00.500000'),
+                         1500000000)
+
+    def test_migrate_feed_index(self):
+        wanted = dynamo.TABLE_DEFINITIONS[dynamo.POST_TABLE][
+            'GlobalSecondaryIndexes'][0]
+        old_index = {'IndexName': dynamo.FEED_INDEX,
+                     'KeySchema': [{'AttributeName': 'subreddit',
+                                    'KeyType': 'HASH'},
+                                   {'AttributeName': 'created',
+                                    'KeyType': 'RANGE'}],
+                     'Projection': {'ProjectionType': 'ALL'}}
+        new_index = dict(wanted, IndexStatus='ACTIVE')
+        self.mock_client.describe_table.side_effect = [
+            {'Table': {'GlobalSecondaryIndexes': [old_index]}},
+            {'Table': {}},
+            {'Table': {'GlobalSecondaryIndexes': [new_index]}},
+        ]
+        self.mock_client.get_paginator().paginate.return_value = [
+            {'Items': [{'id': {'S': FAKE_POST_ID},
+                        'created': {'S': '2017-07-14 02:40:00'}}]}]
+        posts = self.db.tables[dynamo.POST_TABLE]
+
+        self.db.migrate_feed_index()
+
+        posts.update_item.assert_called_once_with(
+            Key={'id': FAKE_POST_ID},
+            UpdateExpression='SET created_utc = :created',
+            ExpressionAttributeValues={':created': 1500000000}
+        )
+        # The hand-made index is dropped and the managed one created
+        updates = [c[1]['GlobalSecondaryIndexUpdates'][0]
+                   for c in self.mock_client.update_table.call_args_list]
+        self.assertEqual(updates, [
+            {'Delete': {'IndexName': dynamo.FEED_INDEX}},
+            {'Create': wanted}
+        ])
+
+    def test_scan_posts(self):
+        posts = self.db.tables[dynamo.POST_TABLE]
+        posts.scan.side_effect = [
+            {'Items': [{'id': 'a', 'subreddit': FAKE_SUBREDDIT_NAME,
+                        'created': '2017-07-14 02:40:00',
+                        'images': [FAKE_IMAGE1]}],
+             'LastEvaluatedKey': {'id': 'a'}},
+            {'Items': [{'id': 'b', 'subreddit': FAKE_SUBREDDIT_NAME,
+                        'created_utc': 1500000001,
+                        'images': {'v': 1, 'p': ['http://i.imgur.com/'],
+                                   'i': [[0, 'asdf.jpg', 'abcdef']]}}]},
+        ]
+
+        records = list(self.db.scan_posts(1, 4))
+
+        self.assertEqual(posts.scan.call_args_list[1][1]['ExclusiveStartKey'],
+                         {'id': 'a'})
+        self.assertEqual(posts.scan.call_args_list[0][1]['Segment'], 1)
+        self.assertEqual([r['created_utc'] for r in records],
+                         [1500000000, 1500000001])
+        self.assertEqual(records[1]['images'], [FAKE_IMAGE1])
+
+    def test_feed_posts(self):
+        posts = self.db.tables[dynamo.POST_TABLE]
+        posts.query.side_effect = [
+            {'Items': [{'id': 'a', 'subreddit': FAKE_SUBREDDIT_NAME,
+                        'created_utc': 1500000000}],
+             'LastEvaluatedKey': {'id': 'a'}},
+            {'Items': [{'id': 'b', 'subreddit': FAKE_SUBREDDIT_NAME,
+                        'created_utc': 1500000001}]},
+        ]
+
+        records = list(self.db.feed_posts(FAKE_SUBREDDIT_NAME,
+                                          after=1500000000))
+
+        self.assertEqual([r['id'] for r in records], ['a', 'b'])
+        kwargs = posts.query.call_args_list[1][1]
+        self.assertEqual(kwargs['IndexName'], dynamo.FEED_INDEX)
+        self.assertTrue(kwargs['ScanIndexForward'])
+        self.assertEqual(kwargs['ExpressionAttributeValues'][':after'],
+                         1500000000)
+        self.assertEqual(kwargs['ExclusiveStartKey'], {'id': 'a'})
+
+    def test_subreddit_names(self):
+        subreddits = self.db.tables[dynamo.SUBREDDIT_TABLE]
+        subreddits.scan.return_value = {'Items': [{'name': 'a'},
+                                                  {'name': 'b'}]}
+
+        self.assertEqual(list(self.db.subreddit_names()), ['a', 'b'])
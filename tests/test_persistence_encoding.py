@@ -0,0 +1,49 @@
+import unittest
+
+from archiver.persistence import encoding
+
+FAKE_IMAGE1 = {
+    'url': 'http://i.imgur.com/asdf.jpg',
+    'path': 'abcdef/asdf.jpg',
+    'dimensions': {'height': 600, 'width': 800},
+    'colors': [{'value': '#ff8000', 'prominence': 50},
+               {'value': '#000001', 'prominence': 3}]
+}
+FAKE_IMAGE2 = {
+    'url': 'http://i.imgur.com/ghjk.jpg',
+    'path': '123456/ghjk.jpg',
+}
+FAKE_FAILED_IMAGE = {'url': 'https://example.com/pics/gone.png'}
+FAKE_ODD_IMAGE = {'url': 'http://i.imgur.com/qwer.jpg',
+                  'path': 'abcdef/other.jpg'}
+
+
+class TestEncoding(unittest.TestCase):
+    def test_color_packing(self):
+        color = {'value': '#ff8000', 'prominence': 50}
+        self.assertEqual(encoding.unpack_color(encoding.pack_color(color)),
+                         color)
+
+    def test_round_trip(self):
+        images = [FAKE_IMAGE1, FAKE_IMAGE2, FAKE_FAILED_IMAGE, FAKE_ODD_IMAGE]
+
+        encoded = encoding.encode_images(images)
+
+        # Prefixes are shared between images on the same host
+        self.assertEqual(encoded['p'], ['http://i.imgur.com/',
+                                        'https://example.com/pics/'])
+        self.assertEqual(encoded['i'][1], [0, 'ghjk.jpg', '123456'])
+        self.assertEqual(encoded['i'][2], [1, 'gone.png'])
+        # Images that don't fit the path scheme are kept as they are
+        self.assertEqual(encoded['i'][3], FAKE_ODD_IMAGE)
+        self.assertEqual(encoding.decode_images(encoded), images)
+
+    def test_without_details(self):
+        encoded = encoding.encode_images([FAKE_IMAGE1], details=False)
+
+        self.assertEqual(encoded['i'], [[0, 'asdf.jpg', 'abcdef']])
+        self.assertEqual(encoding.decode_images(encoded), [{
+            'url': FAKE_IMAGE1['url'], 'path': FAKE_IMAGE1['path']}])
+
+    def test_decode_legacy_list(self):
+        self.assertEqual(encoding.decode_images([FAKE_IMAGE2]), [FAKE_IMAGE2])
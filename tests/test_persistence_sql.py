@@ -0,0 +1,207 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+
+from archiver import constants
+from archiver.persistence import sql
+
+FAKE_SUBREDDIT_NAME = 'test_subreddit'
+FAKE_USERNAME = 'test_user'
+FAKE_POST_ID = 'post1'
+FAKE_CREATED_UTC = 1500000000.0
+FAKE_IMAGE_PATH1 = 'abcdef/asdf.jpg'
+FAKE_IMAGE_PATH2 = '123456/ghjk.jpg'
+FAKE_IMAGE1 = {
+    'url': 'http://i.imgur.com/asdf.jpg',
+    'path': FAKE_IMAGE_PATH1,
+    'dimensions': {'height': 600, 'width': 800},
+    'colors': [{'value': '#ffffff', 'prominence': 50}]
+}
+FAKE_IMAGE2 = {
+    'url': 'http://i.imgur.com/ghjk.jpg',
+    'path': FAKE_IMAGE_PATH2,
+    'dimensions': None,
+    'colors': None
+}
+FAKE_FAILED_IMAGE = {'url': 'http://i.imgur.com/gone.jpg'}
+
+
+class TestSqlPersistence(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('archiver.config.get_config')
+        self.mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.mock_config().PERSISTENCE_SQL_DATABASE = ':memory:'
+
+        self.praw_post = mock.Mock()
+        self.praw_post.id = FAKE_POST_ID
+        self.praw_post.created_utc = FAKE_CREATED_UTC
+        self.praw_post.over_18 = False
+        self.praw_post.author.name = FAKE_USERNAME
+        self.praw_post.subreddit.display_name = FAKE_SUBREDDIT_NAME
+        self.praw_post.title = 'title'
+        self.praw_post.permalink = '/r/test_subreddit/comments/post1/title/'
+        self.praw_post.url = FAKE_IMAGE1['url']
+
+        self.db = sql.SqlPersistence()
+
+    def test_indexes(self):
+        indexes = {row[0] for row in self.db.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIn('posts_subreddit_created', indexes)
+
+    def test_persist_subreddit(self):
+        praw_subreddit = mock.Mock()
+        praw_subreddit.display_name = FAKE_SUBREDDIT_NAME
+        praw_subreddit.id = 'abc'
+        praw_subreddit.title = 'title'
+
+        # Persisting twice keeps a single row
+        self.db.persist_subreddit(praw_subreddit)
+        self.db.persist_subreddit(praw_subreddit)
+
+        rows = self.db.conn.execute("SELECT name FROM subreddits").fetchall()
+        self.assertEqual(rows, [(FAKE_SUBREDDIT_NAME,)])
+
+    def test_get_subreddit_state(self):
+        praw_subreddit = mock.Mock(id='abc', title='title')
+        praw_subreddit.display_name = FAKE_SUBREDDIT_NAME
+        self.assertIsNone(self.db.get_subreddit_state(FAKE_SUBREDDIT_NAME))
+
+        self.db.persist_subreddit(praw_subreddit)
+        self.db.finalize_post(self.praw_post, [])
+
+        state = self.db.get_subreddit_state(FAKE_SUBREDDIT_NAME)
+        self.assertEqual(state['post_count'], 1)
+        self.assertIsNotNone(state['last_crawled'])
+        self.assertEqual(state['listings'], {})
+        self.assertTrue(self.db.has_subreddit(FAKE_SUBREDDIT_NAME))
+
+    def test_record_crawl(self):
+        praw_subreddit = mock.Mock(id='abc', title='title')
+        praw_subreddit.display_name = FAKE_SUBREDDIT_NAME
+        self.db.persist_subreddit(praw_subreddit)
+
+        self.db.record_crawl(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 50, 20)
+        self.db.record_crawl(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 40, 5)
+
+        # The latest depth, and the new posts of every crawl
+        state = self.db.get_subreddit_state(FAKE_SUBREDDIT_NAME)
+        self.assertEqual(state['listings'], {
+            constants.QUERY_HOT: {'depth': 40, 'new_posts': 25}})
+
+    def test_has_post(self):
+        self.assertFalse(self.db.has_post(FAKE_POST_ID))
+        self.db.finalize_post(self.praw_post, [])
+        self.assertTrue(self.db.has_post(FAKE_POST_ID))
+
+    def test_watermark(self):
+        self.assertIsNone(
+            self.db.get_watermark(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT))
+
+        self.db.set_watermark(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT,
+                              200, 'b')
+        # Older marks never move it back
+        self.db.set_watermark(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT,
+                              100, 'a')
+
+        self.assertEqual(
+            self.db.get_watermark(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT),
+            {'created_utc': 200, 'id': 'b'})
+        self.assertIsNone(
+            self.db.get_watermark(FAKE_SUBREDDIT_NAME, constants.QUERY_NEW))
+
+    def test_persist_user_deleted(self):
+        self.db.persist_user(None)
+
+        rows = self.db.conn.execute("SELECT name FROM users").fetchall()
+        self.assertEqual(rows, [])
+
+    def test_persist_images_and_get_image(self):
+        self.db.persist_images([FAKE_IMAGE1, FAKE_IMAGE2, FAKE_FAILED_IMAGE])
+
+        self.assertEqual(self.db.get_image(FAKE_IMAGE_PATH1), FAKE_IMAGE1)
+        self.assertEqual(self.db.get_image(FAKE_IMAGE_PATH2), FAKE_IMAGE2)
+        self.assertIsNone(self.db.get_image('missing/path.jpg'))
+
+    def test_get_images(self):
+        self.db.persist_images([FAKE_IMAGE1, FAKE_IMAGE2])
+
+        images = self.db.get_images(
+            [FAKE_IMAGE_PATH1, FAKE_IMAGE_PATH2, 'missing/path.jpg'])
+
+        self.assertEqual(images, {FAKE_IMAGE_PATH1: FAKE_IMAGE1,
+                                  FAKE_IMAGE_PATH2: FAKE_IMAGE2})
+
+    def test_persist_post_and_finalize(self):
+        # The post doesn't exist until it is finalized
+        self.assertFalse(self.db.persist_post(self.praw_post))
+
+        self.db.finalize_post(self.praw_post, [FAKE_IMAGE1])
+
+        self.assertTrue(self.db.persist_post(self.praw_post))
+        row = self.db.conn.execute(
+            "SELECT subreddit, created, user, nsfw FROM posts WHERE id = ?",
+            (FAKE_POST_ID,)).fetchone()
+        self.assertEqual(row, (FAKE_SUBREDDIT_NAME, int(FAKE_CREATED_UTC),
+                               FAKE_USERNAME, 0))
+
+    def test_scan_posts(self):
+        self.db.finalize_post(self.praw_post, [FAKE_IMAGE1])
+
+        posts = list(self.db.scan_posts())
+
+        self.assertEqual(len(posts), 1)
+        self.assertEqual(posts[0]['id'], FAKE_POST_ID)
+        self.assertEqual(posts[0]['images'], [FAKE_IMAGE1])
+        self.assertEqual(list(self.db.scan_posts(0, 2)), [])
+
+    def test_scan_posts_from_threads(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        db = sql.SqlPersistence(os.path.join(directory, 'tweench.db'))
+        db.finalize_post(self.praw_post, [FAKE_IMAGE1])
+        results = {}
+
+        def scan(segment):
+            results[segment] = [p['id'] for p in db.scan_posts(segment, 2)]
+
+        threads = [threading.Thread(target=scan, args=(segment,))
+                   for segment in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results[0] + results[1]), [FAKE_POST_ID])
+
+    def test_feed_posts(self):
+        self.db.finalize_post(self.praw_post, [FAKE_IMAGE1])
+        older = mock.Mock(id='post0', created_utc=FAKE_CREATED_UTC - 10,
+                          over_18=False, title='title', permalink='/r/x/',
+                          url=FAKE_IMAGE2['url'])
+        older.author.name = FAKE_USERNAME
+        older.subreddit.display_name = FAKE_SUBREDDIT_NAME
+        self.db.finalize_post(older, [FAKE_IMAGE2])
+
+        posts = list(self.db.feed_posts(FAKE_SUBREDDIT_NAME))
+
+        self.assertEqual([p['id'] for p in posts], ['post0', FAKE_POST_ID])
+        self.assertEqual(
+            [p['id'] for p in self.db.feed_posts(
+                FAKE_SUBREDDIT_NAME, after=FAKE_CREATED_UTC)],
+            [FAKE_POST_ID])
+        self.assertEqual(list(self.db.feed_posts('other')), [])
+
+    def test_subreddit_names(self):
+        praw_subreddit = mock.Mock(id='abc', title='title')
+        praw_subreddit.display_name = FAKE_SUBREDDIT_NAME
+        self.db.persist_subreddit(praw_subreddit)
+
+        self.assertEqual(list(self.db.subreddit_names()),
+                         [FAKE_SUBREDDIT_NAME])
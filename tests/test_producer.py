@@ -0,0 +1,100 @@
+import collections
+import unittest
+
+import mock
+
+from archiver import constants
+from archiver import producer
+
+FAKE_SUBREDDIT_NAME = 'test_subreddit'
+
+
+class TestProducer(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('archiver.config.get_config')
+        self.mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_config().PERSISTENCE_CACHE_SIZE = 100
+        self.mock_config().PRODUCER_STATE_TTL = 60
+        self.mock_config().PRODUCER_MIN_CRAWL_INTERVAL = 3600
+        self.mock_config().QUEUES = collections.OrderedDict([
+            ('hot', ('hot-queue', 5)), ('default', ('queue', 1))])
+
+        patcher = mock.patch('archiver.clients.persistence_client')
+        self.persistence = patcher.start()()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('archiver.clients.queue_client')
+        self.sqs = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('archiver.producer.time.time')
+        patcher.start().return_value = 10000
+        self.addCleanup(patcher.stop)
+
+        self.producer = producer.Producer()
+
+    def test_has_subreddit(self):
+        self.persistence.get_subreddit_state.return_value = None
+        self.assertFalse(self.producer.has_subreddit(FAKE_SUBREDDIT_NAME))
+        self.assertFalse(self.producer.has_subreddit(FAKE_SUBREDDIT_NAME))
+        # Misses are cached as well
+        self.persistence.get_subreddit_state.assert_called_once_with(
+            FAKE_SUBREDDIT_NAME)
+
+    @mock.patch('archiver.messages.SubredditMessage.enqueue')
+    def test_add_subreddit_new(self, mock_enqueue):
+        self.persistence.get_subreddit_state.return_value = None
+        self.assertTrue(self.producer.add_subreddit(
+            FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 10))
+        mock_enqueue.assert_called_once_with(self.sqs())
+
+    @mock.patch('archiver.messages.SubredditMessage.enqueue')
+    def test_add_subreddit_recently_crawled(self, mock_enqueue):
+        self.persistence.get_subreddit_state.return_value = {
+            'last_crawled': 9000, 'post_count': 0}
+        self.assertFalse(self.producer.add_subreddit(
+            FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 10))
+        mock_enqueue.assert_not_called()
+
+        self.assertTrue(self.producer.add_subreddit(
+            FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 10, force=True))
+        self.assertEqual(mock_enqueue.call_count, 1)
+
+    @mock.patch('archiver.messages.SubredditMessage.enqueue')
+    def test_add_subreddit_top_already_crawled(self, mock_enqueue):
+        self.persistence.get_subreddit_state.return_value = {
+            'last_crawled': 1000, 'post_count': 10,
+            'listings': {constants.QUERY_TOP_ALL_TIME: {
+                'depth': 10, 'new_posts': 10}}}
+        self.assertFalse(self.producer.add_subreddit(
+            FAKE_SUBREDDIT_NAME, constants.QUERY_TOP_ALL_TIME, 10))
+        self.assertTrue(self.producer.add_subreddit(
+            FAKE_SUBREDDIT_NAME, constants.QUERY_TOP_ALL_TIME, 20))
+        self.assertTrue(self.producer.add_subreddit(
+            FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 10))
+        self.assertEqual(mock_enqueue.call_count, 2)
+
+    @mock.patch('archiver.messages.SubredditMessage.enqueue')
+    def test_add_subreddit_top_other_listings_crawled(self, mock_enqueue):
+        # Posts archived from other listings say nothing about the all time
+        # top list
+        self.persistence.get_subreddit_state.return_value = {
+            'last_crawled': 1000, 'post_count': 500,
+            'listings': {constants.QUERY_HOT: {
+                'depth': 100, 'new_posts': 500}}}
+        self.assertTrue(self.producer.add_subreddit(
+            FAKE_SUBREDDIT_NAME, constants.QUERY_TOP_ALL_TIME, 10))
+        self.assertEqual(mock_enqueue.call_count, 1)
+
+    @mock.patch('archiver.messages.SubredditMessage.enqueue')
+    def test_add_subreddit_queue(self, mock_enqueue):
+        self.persistence.get_subreddit_state.return_value = None
+
+        self.producer.add_subreddit(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT,
+                                    10, queue='hot')
+
+        self.sqs.assert_called_with('hot-queue')
+        self.assertRaises(ValueError, self.producer.add_subreddit,
+                          FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 10,
+                          queue='unknown')
@@ -0,0 +1,120 @@
+import json
+import os
+import pstats
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from archiver import metrics
+from archiver import profiling
+
+
+def busy_loop(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class FakeConsumer(object):
+    def __init__(self):
+        self.handled = []
+
+    def _handle(self, resp, handler):
+        handler()
+        self.handled.append(resp.body['post_link'])
+
+    def archive(self, post_link):
+        self._handle(mock.Mock(type='STORE_POST',
+                               body={'post_link': post_link}),
+                     self._archive_post)
+
+    def _archive_post(self):
+        with metrics.stage('reddit_fetch'):
+            busy_loop(0.01)
+        with metrics.stage('thumbnail'):
+            busy_loop(0.02)
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_samples_thread(self):
+        profiler = profiling.SamplingProfiler(
+            threading.current_thread().ident, interval=0.001)
+        profiler.start()
+        busy_loop(0.1)
+        profiler.stop()
+
+        self.assertTrue(any('test_profiling.py:busy_loop' in stack
+                            for stack in profiler.stacks))
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        self.consumer = FakeConsumer()
+
+    def _run_session(self, fmt):
+        profiler = profiling.Profiler(self.consumer, self.output_dir,
+                                      fmt=fmt, messages=2, seconds=60,
+                                      interval=0.001)
+        profiler.start()
+        self.assertTrue(profiler.active)
+        self.consumer.archive('post1')
+        self.assertTrue(profiler.active)
+        with metrics.stage('queue_receive'):
+            pass
+        self.consumer.archive('post2')
+
+        # The second message ended the session and wrote the files
+        self.assertFalse(profiler.active)
+        self.consumer.archive('post3')
+        self.assertEqual(self.consumer.handled, ['post1', 'post2', 'post3'])
+        return sorted(os.listdir(self.output_dir))
+
+    def test_collapsed(self):
+        profile_file, timings_file = self._run_session(
+            profiling.FORMAT_COLLAPSED)
+
+        self.assertTrue(profile_file.endswith('.collapsed'))
+        with open(os.path.join(self.output_dir, profile_file)) as f:
+            self.assertIn('busy_loop', f.read())
+        with open(os.path.join(self.output_dir, timings_file)) as f:
+            timings = [json.loads(line) for line in f]
+        self.assertEqual([t['target'] for t in timings[:2]],
+                         ['post1', 'post2'])
+        # Every stage within the message handler is covered
+        self.assertEqual(sorted(timings[0]['stages']),
+                         ['reddit_fetch', 'thumbnail'])
+        self.assertLessEqual(timings[0]['stages']['thumbnail'],
+                             timings[0]['seconds'])
+        # Stages outside any message come last
+        self.assertIsNone(timings[2]['message'])
+        self.assertEqual(list(timings[2]['stages']), ['queue_receive'])
+
+    def test_signal_only_requests(self):
+        profiler = profiling.Profiler(self.consumer, self.output_dir,
+                                      messages=1)
+        profiler.install_signal(signal.SIGUSR2)
+        self.addCleanup(signal.signal, signal.SIGUSR2, signal.SIG_DFL)
+
+        os.kill(os.getpid(), signal.SIGUSR2)
+
+        # Nothing is started from the handler, the next poll does it
+        self.assertTrue(profiler.requested)
+        self.assertFalse(profiler.active)
+        profiler.poll()
+        self.assertTrue(profiler.active)
+        self.assertFalse(profiler.requested)
+        profiler.stop()
+
+    def test_pstats(self):
+        profile_file, _ = self._run_session(profiling.FORMAT_PSTATS)
+
+        self.assertTrue(profile_file.endswith('.pstats'))
+        stats = pstats.Stats(os.path.join(self.output_dir, profile_file))
+        self.assertTrue(any(func[2] == 'busy_loop' for func in stats.stats))
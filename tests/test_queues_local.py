@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from archiver import constants
+from archiver import messages
+from archiver.queues import local
+
+FAKE_QUEUE_NAME = 'myqueue'
+FAKE_SUBREDDIT_NAME = 'mysubreddit'
+
+
+class TestLocalQueue(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('archiver.config.get_config')
+        self.mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_config().QUEUE_VISIBILITY_TIMEOUT = 30
+
+        patcher = mock.patch('archiver.queues.local.time.time')
+        self.mock_time = patcher.start()
+        self.mock_time.return_value = 1000
+        self.addCleanup(patcher.stop)
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.database = os.path.join(tmp, 'queue.db')
+        self.queue = local.LocalQueue(FAKE_QUEUE_NAME, self.database)
+
+    def _send(self, num):
+        for i in range(num):
+            messages.SubredditMessage(FAKE_SUBREDDIT_NAME + str(i)).enqueue(
+                self.queue)
+
+    def test_receive_and_delete(self):
+        self._send(3)
+
+        resp = self.queue.get_messages(max_messages=2, wait=0)
+
+        self.assertEqual([m.subreddit_name for m in resp],
+                         [FAKE_SUBREDDIT_NAME + str(i) for i in range(2)])
+        self.assertEqual(resp[0].type, constants.MESSAGE_SUBREDDIT)
+        for m in resp:
+            m.finish(self.queue)
+        self.assertEqual(self.queue.get_message(wait=0).subreddit_name,
+                         FAKE_SUBREDDIT_NAME + '2')
+        self.assertIsNone(self.queue.get_message(wait=0))
+
+    def test_visibility_timeout(self):
+        self._send(1)
+        first = self.queue.get_message(wait=0)
+        self.assertIsNone(self.queue.get_message(wait=0))
+
+        # Redelivered once the timeout runs out, with a new receipt handle
+        self.mock_time.return_value = 1031
+        second = self.queue.get_message(wait=0)
+        self.assertIsNotNone(second)
+        first.finish(self.queue)
+        self.mock_time.return_value = 1062
+        self.assertIsNotNone(self.queue.get_message(wait=0))
+
+    def test_extend_visibility(self):
+        self._send(1)
+        resp = self.queue.get_message(wait=0)
+
+        self.queue.extend_visibility(resp.id, 120)
+
+        self.mock_time.return_value = 1031
+        self.assertIsNone(self.queue.get_message(wait=0))
+        self.mock_time.return_value = 1121
+        self.assertIsNotNone(self.queue.get_message(wait=0))
+
+    def test_send_delay(self):
+        messages.SubredditMessage(FAKE_SUBREDDIT_NAME).enqueue(
+            self.queue, delay=60)
+
+        self.assertIsNone(self.queue.get_message(wait=0))
+        self.mock_time.return_value = 1060
+        self.assertIsNotNone(self.queue.get_message(wait=0))
+
+    def test_queues_are_separate(self):
+        other = local.LocalQueue('other', self.database)
+        self._send(1)
+        self.assertIsNone(other.get_message(wait=0))
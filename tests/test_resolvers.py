@@ -0,0 +1,52 @@
+import unittest
+
+from archiver import resolvers
+
+
+class TestResolverRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = resolvers.ResolverRegistry()
+        self.image = resolvers.Resolver(
+            'image', r'^https?://i\.example\.com/(\w+)\.jpg', 'image')
+        self.page = resolvers.Resolver(
+            'page', r'^https?://example\.com/(\w+)$', 'page')
+        self.external = resolvers.Resolver(
+            'external', r'(https?://.*\.png)', 'external')
+        self.registry.register(self.image, hosts=['i.example.com'])
+        self.registry.register(self.page, hosts=['example.com'])
+        self.registry.register(self.external)
+
+    def test_resolve_by_host(self):
+        self.assertEqual(
+            self.registry.resolve('https://i.example.com/abc.jpg'),
+            (self.image, ('abc',)))
+        self.assertEqual(self.registry.resolve('http://EXAMPLE.com/abc'),
+                         (self.page, ('abc',)))
+
+    def test_subdomains_use_parent_host(self):
+        page = resolvers.Resolver('page', r'^https?://(?:\w+\.)?example\.com/'
+                                          r'(\w+)$', 'page')
+        self.registry.register(page, hosts=['example.com'])
+
+        self.assertEqual(
+            self.registry.resolve('https://m.example.com/abc'),
+            (page, ('abc',)))
+
+    def test_fallback(self):
+        # Unknown hosts, and URLs their host's resolvers don't match
+        self.assertEqual(
+            self.registry.resolve('https://other.org/a.png'),
+            (self.external, ('https://other.org/a.png',)))
+        self.assertEqual(
+            self.registry.resolve('https://example.com/a/b.png'),
+            (self.external, ('https://example.com/a/b.png',)))
+
+    def test_hits(self):
+        self.registry.resolve('https://i.example.com/abc.jpg')
+        self.registry.resolve('https://i.example.com/def.jpg')
+        self.registry.resolve('https://other.org/a.png')
+        self.assertIsNone(self.registry.resolve('https://other.org/a.html'))
+        self.assertIsNone(self.registry.resolve('not a url'))
+
+        self.assertEqual(self.registry.hits, {'image': 2, 'external': 1})
+        self.assertEqual(self.registry.misses, 2)
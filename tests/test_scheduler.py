@@ -0,0 +1,148 @@
+import unittest
+
+import mock
+
+from archiver import constants
+from archiver import scheduler
+
+FAKE_SUBREDDIT_NAME = 'test_subreddit'
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('archiver.config.get_config')
+        self.mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_config().SCHEDULER_JITTER = 0.1
+        self.mock_config().SCHEDULER_MIN_INTERVAL = 100
+        self.mock_config().SCHEDULER_MAX_INTERVAL = 10000
+
+        patcher = mock.patch('archiver.scheduler.time.time')
+        self.mock_time = patcher.start()
+        self.mock_time.return_value = 0
+        self.addCleanup(patcher.stop)
+
+        # No jitter, so runs are exactly one interval apart
+        patcher = mock.patch('archiver.scheduler.random.uniform')
+        patcher.start().side_effect = lambda low, high: (low + high) / 2.0
+        self.addCleanup(patcher.stop)
+
+        self.producer = mock.Mock()
+        self.producer.get_subreddit_state.return_value = None
+
+    def _scheduler(self, *crawls):
+        return scheduler.Scheduler(plan=list(crawls),
+                                   producer_client=self.producer)
+
+    def _listing_state(self, new_posts):
+        return {'last_crawled': 0, 'post_count': 1000, 'listings': {
+            constants.QUERY_HOT: {'depth': 10, 'new_posts': new_posts}}}
+
+    def test_priority_order(self):
+        low = scheduler.Crawl('low', constants.QUERY_HOT, 10, 1000)
+        high = scheduler.Crawl('high', constants.QUERY_HOT, 10, 1200,
+                               priority=5)
+        s = self._scheduler(low, high)
+
+        # Due at 50 and 60, both overdue by the time they are checked
+        self.mock_time.return_value = 60
+        self.assertEqual(s.run_pending(), 1000)
+
+        self.assertEqual(
+            [c[0][0] for c in self.producer.add_subreddit.call_args_list],
+            ['high', 'low'])
+        self.assertEqual(self.producer.add_subreddit.call_args[1]['queue'],
+                         'default')
+
+    def test_first_runs_spread(self):
+        s = self._scheduler(
+            scheduler.Crawl(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 10,
+                            1000))
+
+        # Not due before half of the jitter window has passed
+        self.assertEqual(s.run_pending(), 50)
+        self.producer.add_subreddit.assert_not_called()
+
+    def test_due_order_kept(self):
+        low = scheduler.Crawl('low', constants.QUERY_HOT, 10, 1000)
+        high = scheduler.Crawl('high', constants.QUERY_HOT, 10, 1200,
+                               priority=5)
+        s = self._scheduler(low, high)
+
+        # The jitter between them is kept, priority doesn't hold low back
+        self.mock_time.return_value = 50
+        self.assertEqual(s.run_pending(), 10)
+        self.assertEqual(
+            [c[0][0] for c in self.producer.add_subreddit.call_args_list],
+            ['low'])
+
+    @mock.patch('archiver.scheduler.LOG')
+    def test_incremental_needs_time_order(self, mock_log):
+        self._scheduler(
+            scheduler.Crawl('new', constants.QUERY_NEW, 10, 1000,
+                            incremental=True),
+            scheduler.Crawl('hot', constants.QUERY_HOT, 10, 1000,
+                            incremental=True))
+
+        self.assertEqual(mock_log.warning.call_count, 1)
+        self.assertIn('hot', mock_log.warning.call_args[0])
+
+    def test_quiet_subreddit_slows_down(self):
+        crawl = scheduler.Crawl(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 10,
+                                1000)
+        self.producer.get_subreddit_state.return_value = (
+            self._listing_state(20))
+        s = self._scheduler(crawl)
+
+        self.mock_time.return_value = 60
+        s.run_pending()
+        self.mock_time.return_value = 1080
+        s.run_pending()
+
+        self.assertEqual(crawl.interval, 2000)
+        self.assertEqual(self.producer.add_subreddit.call_count, 2)
+
+    def test_busy_subreddit_speeds_up(self):
+        crawl = scheduler.Crawl(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 10,
+                                1000)
+        self.producer.get_subreddit_state.return_value = (
+            self._listing_state(0))
+        s = self._scheduler(crawl)
+
+        self.mock_time.return_value = 60
+        s.run_pending()
+        # 10 new posts in 1020s, aim for 5 per crawl
+        self.producer.get_subreddit_state.return_value = (
+            self._listing_state(10))
+        self.mock_time.return_value = 1080
+        s.run_pending()
+
+        self.assertEqual(crawl.interval, 510)
+
+    def test_other_listings_ignored(self):
+        crawl = scheduler.Crawl(FAKE_SUBREDDIT_NAME, constants.QUERY_HOT, 10,
+                                1000)
+        state = self._listing_state(0)
+        self.producer.get_subreddit_state.return_value = state
+        s = self._scheduler(crawl)
+
+        self.mock_time.return_value = 60
+        s.run_pending()
+        # Another entry archiving lots of posts doesn't speed this one up
+        state['post_count'] += 500
+        state['listings'][constants.QUERY_TOP_ALL_TIME] = {
+            'depth': 500, 'new_posts': 500}
+        self.mock_time.return_value = 1080
+        s.run_pending()
+
+        self.assertEqual(crawl.interval, 2000)
+
+
+class TestLoadPlan(unittest.TestCase):
+    def test_from_dict(self):
+        crawl = scheduler.Crawl.from_dict({
+            'subreddit': FAKE_SUBREDDIT_NAME, 'query_type': 'get_new',
+            'num': '25', 'interval': 600})
+        self.assertEqual(crawl.num, 25)
+        self.assertEqual(crawl.priority, 0)
+        self.assertFalse(crawl.incremental)